@@ -0,0 +1,596 @@
+import argparse
+import asyncio
+import functools
+import json
+import os
+import random
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+import main
+
+
+# -----------------------------------------------------------------------------
+# Конфигурация
+# -----------------------------------------------------------------------------
+
+DEFAULT_SIZES = (10, 1000, 10000)
+TARGETS = ("process_conversion", "check", "service", "telethon", "pyrogram", "tdata")
+SERVICE_DIRECTIONS = {
+    "telethon": "telethon-tdata",
+    "pyrogram": "pyrogram-tdata",
+    "tdata": "tdata-telethon",
+}
+DIALOGS_PAGE_SIZE = 100
+# Примерный размер ответа: contacts.getContactIDs — int32 на контакт,
+# contacts.getContacts — запись контакта и объект User на каждого.
+CONTACT_ID_BYTES = 4
+CONTACT_BYTES = 160
+
+
+# -----------------------------------------------------------------------------
+# Локальная замена Telegram
+# -----------------------------------------------------------------------------
+
+class FakeBackend:
+    def __init__(
+        self,
+        latency_ms: float = 50.0,
+        jitter_ms: float = 10.0,
+        dialogs: int = 200,
+        contacts: int = 50,
+        flood_rate: float = 0.0,
+        flood_seconds: int = 5,
+        unauthorized_rate: float = 0.0,
+        bandwidth_kbps: float = 1000.0,
+        seed: int = 0,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.bandwidth_kbps = bandwidth_kbps
+        self.jitter_ms = jitter_ms
+        self.dialogs = dialogs
+        self.contacts = contacts
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.unauthorized_rate = unauthorized_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.flood_waits = 0
+
+    async def round_trip(self, flood_allowed: bool = True, payload: int = 0) -> None:
+        from telethon.errors import FloodWaitError
+
+        self.requests += 1
+        delay = self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        if self.bandwidth_kbps > 0:
+            delay += payload / self.bandwidth_kbps  # КБ/с — это байт/мс
+        await asyncio.sleep(max(0.0, delay) / 1000)
+        if flood_allowed and self.random.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+    def client_factory(self):
+        def create_client(session, api):
+            return FakeTelegramClient(self, session)
+
+        return create_client
+
+
+class FakeTelegramClient:
+    def __init__(self, backend: FakeBackend, session) -> None:
+        from telethon.sessions import SQLiteSession
+
+        self.backend = backend
+        self.session = SQLiteSession(session) if isinstance(session, str) else session
+        self.connected = False
+
+    async def connect(self) -> None:
+        await self.backend.round_trip(flood_allowed=False)
+        self.connected = True
+
+    async def disconnect(self) -> None:
+        self.connected = False
+        self.session.save()
+        self.session.close()
+
+    async def is_user_authorized(self) -> bool:
+        await self.backend.round_trip(flood_allowed=False)
+        return self.authorized()
+
+    def authorized(self) -> bool:
+        if self.session.auth_key is None:
+            return False
+        return self.backend.random.random() >= self.backend.unauthorized_rate
+
+    def user_id(self) -> int:
+        return int.from_bytes(self.session.auth_key.key[:4], "big") or 1
+
+    async def get_me(self):
+        await self.backend.round_trip()
+        user_id = self.user_id()
+        return SimpleNamespace(
+            id=user_id,
+            first_name="Bench",
+            last_name=str(user_id),
+            username=f"bench_{user_id}",
+            phone=f"7{user_id:010d}"[:11],
+        )
+
+    async def get_dialogs(self, limit: Optional[int] = None):
+        if limit == 0:
+            await self.backend.round_trip()
+            return SimpleNamespace(total=self.backend.dialogs)
+        return [dialog async for dialog in self.iter_dialogs(limit=limit)]
+
+    async def iter_dialogs(self, limit: Optional[int] = None):
+        total = self.backend.dialogs if limit is None else min(limit, self.backend.dialogs)
+        for offset in range(0, total, DIALOGS_PAGE_SIZE):
+            await self.backend.round_trip()
+            for index in range(offset, min(offset + DIALOGS_PAGE_SIZE, total)):
+                yield SimpleNamespace(id=index)
+
+    async def __call__(self, request):
+        name = type(request).__name__
+        payload = {
+            "GetContactIDsRequest": CONTACT_ID_BYTES,
+            "GetContactsRequest": CONTACT_BYTES,
+        }.get(name, 0) * self.backend.contacts
+        await self.backend.round_trip(payload=payload)
+        if name == "GetStateRequest":
+            if not self.authorized():
+                from telethon.errors import AuthKeyUnregisteredError
+
+                raise AuthKeyUnregisteredError(request=request)
+            return SimpleNamespace(pts=1, qts=0, date=None, seq=0, unread_count=0)
+        if name == "GetContactIDsRequest":
+            return list(range(self.backend.contacts))
+        if name == "GetContactsRequest":
+            return SimpleNamespace(contacts=[None] * self.backend.contacts)
+        raise NotImplementedError(name)
+
+
+# -----------------------------------------------------------------------------
+# Синтетические входные данные
+# -----------------------------------------------------------------------------
+
+def make_material(index: int, rng: random.Random) -> Dict:
+    return {
+        "auth_key": rng.randbytes(256),
+        "dc_id": rng.randint(1, 5),
+        "user_id": 100000 + index,
+    }
+
+
+def write_pyrogram_session(output_file: Path, material: Dict) -> None:
+    conn = sqlite3.connect(output_file)
+    try:
+        conn.executescript(
+            "CREATE TABLE sessions (dc_id INTEGER PRIMARY KEY, api_id INTEGER, "
+            "test_mode INTEGER, auth_key BLOB, date INTEGER NOT NULL, "
+            "user_id INTEGER, is_bot INTEGER);"
+            "CREATE TABLE peers (id INTEGER PRIMARY KEY, access_hash INTEGER, "
+            "type INTEGER NOT NULL, username TEXT, phone_number TEXT, "
+            "last_update_on INTEGER NOT NULL DEFAULT 0);"
+            "CREATE TABLE version (number INTEGER PRIMARY KEY);"
+            "INSERT INTO version VALUES (3);"
+        )
+        conn.execute(
+            "INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                material["dc_id"],
+                2040,
+                0,
+                material["auth_key"],
+                int(time.time()),
+                material["user_id"],
+                0,
+            ),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def make_fixtures(root: Path, count: int, mix: List[str], seed: int) -> None:
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    pending = []
+    for index in range(count):
+        kind = mix[index % len(mix)]
+        material = make_material(index, rng)
+        folder = root / f"{index // 1000:03d}"
+        folder.mkdir(exist_ok=True)
+        if kind == "telethon":
+            main.write_telethon_session(folder / f"{index}.session", material)
+        elif kind == "pyrogram":
+            write_pyrogram_session(folder / f"{index}.session", material)
+        else:
+            pending.append(
+                main.run_in_cpu_pool(
+                    main.save_tdata_worker,
+                    material["auth_key"],
+                    material["dc_id"],
+                    material["user_id"],
+                    str(folder / f"{index}" / "tdata"),
+                )
+            )
+    await asyncio.gather(*pending)
+
+
+# -----------------------------------------------------------------------------
+# Замеры
+# -----------------------------------------------------------------------------
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def peak_rss_mb(who: int) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+async def http_request(
+    host: str,
+    port: int,
+    method: str,
+    path: str,
+    body: bytes = b"",
+    content_type: str = "application/json",
+    token: str = "",
+) -> Tuple[int, bytes]:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = (
+            f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+            f"Authorization: Bearer {token}\r\n"
+            f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n"
+        )
+        writer.write(head.encode() + body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        return status, await reader.read()
+    finally:
+        writer.close()
+
+
+async def run_service(concurrency: int, options: main.ConversionOptions) -> List[Dict]:
+    service = main.ConversionService(
+        workers=concurrency, queue_size=concurrency * 4, options=options
+    )
+    await service.start("127.0.0.1", 0)
+    host, port = service.address[:2]
+    request = functools.partial(http_request, host, port, token=service.token)
+    limit = asyncio.Semaphore(concurrency * 8)
+
+    async def run_one(path: Path, file_type: str) -> Dict:
+        direction = SERVICE_DIRECTIONS[file_type]
+        if file_type == "tdata":
+            body = json.dumps({
+                "direction": direction,
+                "path": path.relative_to(main.SESSIONS_DIR).as_posix(),
+            }).encode()
+            submit = ("/jobs", body, "application/json")
+        else:
+            submit = (
+                f"/jobs?direction={direction}&name={path.name}",
+                path.read_bytes(),
+                "application/octet-stream",
+            )
+        async with limit:
+            started = time.perf_counter()
+            while True:
+                status, payload = await request("POST", *submit)
+                if status != 503:
+                    break
+                await asyncio.sleep(0.05)
+            if status != 202:
+                raise RuntimeError(f"{status}: {payload.decode()}")
+            job_id = json.loads(payload)["id"]
+            while True:
+                status, payload = await request("GET", f"/jobs/{job_id}")
+                job = json.loads(payload)
+                if job["status"] not in ("queued", "running"):
+                    break
+                await asyncio.sleep(0.02)
+            if job["status"] == "done":
+                status, _ = await request("GET", f"/jobs/{job_id}/result")
+                if status != 200:
+                    raise RuntimeError(f"результат задачи {job_id}: {status}")
+            result = job["result"] or {
+                "input_file": str(path), "status": "error", "error": job["error"]
+            }
+            result["latency"] = time.perf_counter() - started
+            return result
+
+    try:
+        inputs = [item async for item in main.iter_input_files()]
+        return list(await asyncio.gather(*(run_one(*item) for item in inputs)))
+    finally:
+        await service.close()
+
+
+async def run_target(
+    target: str,
+    concurrency: int,
+    options: main.ConversionOptions,
+) -> List[Dict]:
+    latencies: Dict[str, float] = {}
+    original = main.convert_input
+
+    async def timed_convert_input(file_path, file_type, mode, progress, task_id, options=None):
+        started = time.perf_counter()
+        try:
+            return await original(file_path, file_type, mode, progress, task_id, options)
+        finally:
+            latencies[str(file_path)] = time.perf_counter() - started
+
+    if target == "service":
+        return await run_service(concurrency, options)
+    if target in ("process_conversion", "check"):
+        main.convert_input = timed_convert_input
+        try:
+            results = await main.process_conversion(
+                main.iter_input_files(),
+                "auto",
+                concurrency=concurrency,
+                options=options,
+                show_progress=False,
+            )
+        finally:
+            main.convert_input = original
+    else:
+        converters = {
+            "telethon": main.convert_telethon_to_tdata,
+            "pyrogram": main.convert_pyrogram_to_tdata,
+            "tdata": main.convert_tdata_to_telethon,
+        }
+        converter = converters[target]
+        inputs = [path async for path, _ in main.iter_input_files(target)]
+        limit = asyncio.Semaphore(concurrency)
+        progress = main.NullProgress()
+
+        async def run_one(path: Path) -> Dict:
+            async with limit:
+                started = time.perf_counter()
+                try:
+                    return await converter(path, progress, 0, options)
+                finally:
+                    latencies[str(path)] = time.perf_counter() - started
+
+        results = await asyncio.gather(*(run_one(path) for path in inputs))
+
+    for result in results:
+        result["latency"] = latencies.get(result["input_file"], 0.0)
+    return list(results)
+
+
+def run_single(args: argparse.Namespace) -> Dict:
+    backend = FakeBackend(
+        latency_ms=args.latency,
+        jitter_ms=args.jitter,
+        dialogs=args.dialogs,
+        contacts=args.contacts,
+        flood_rate=args.flood_rate,
+        flood_seconds=args.flood_seconds,
+        unauthorized_rate=args.unauthorized_rate,
+        bandwidth_kbps=args.bandwidth,
+        seed=args.seed,
+    )
+    main.create_client = backend.client_factory()
+    main.CPU_WORKERS = args.cpu_workers or main.CPU_WORKERS
+
+    with tempfile.TemporaryDirectory(prefix="tdata-bench-") as workdir:
+        os.chdir(workdir)
+        mix = args.mix.split(",")
+        if args.target not in ("process_conversion", "check", "service"):
+            mix = [args.target]
+        asyncio.run(make_fixtures(Path(main.SESSIONS_DIR), args.inputs, mix, args.seed))
+
+        options = main.ConversionOptions(
+            offline=args.offline,
+            info_level=args.info_level,
+            use_cache=False,
+            use_manifest=False,
+            check_only=args.target == "check",
+        )
+        started = time.perf_counter()
+        results = asyncio.run(run_target(args.target, args.concurrency, options))
+        elapsed = time.perf_counter() - started
+        main.shutdown_cpu_pool()
+
+    failed = sum(1 for r in results if r["status"] == "error")
+    latencies = [r["latency"] for r in results]
+    stages: Dict[str, List[float]] = {}
+    for result in results:
+        for stage, ms in (result.get("timings") or {}).items():
+            stages.setdefault(stage, []).append(ms)
+    return {
+        "target": args.target,
+        "inputs": len(results),
+        "successful": sum(1 for r in results if r["status"] == "success"),
+        "failed": failed,
+        "valid": failed <= args.max_failed * len(results) and bool(results),
+        "elapsed_s": round(elapsed, 3),
+        "sessions_per_s": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "peak_rss_workers_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        "requests": backend.requests,
+        "flood_waits": backend.flood_waits,
+        "stages_p50_ms": {
+            stage: round(percentile(values, 0.50), 1)
+            for stage, values in sorted(stages.items())
+        },
+    }
+
+
+# -----------------------------------------------------------------------------
+# Набор замеров
+# -----------------------------------------------------------------------------
+
+def single_run_argv(args: argparse.Namespace, size: int) -> List[str]:
+    argv = [
+        sys.executable,
+        str(Path(__file__).resolve()),
+        "--single",
+        str(size),
+        "--target", args.target,
+        "--mix", args.mix,
+        "--concurrency", str(args.concurrency),
+        "--info-level", args.info_level,
+        "--latency", str(args.latency),
+        "--jitter", str(args.jitter),
+        "--dialogs", str(args.dialogs),
+        "--contacts", str(args.contacts),
+        "--flood-rate", str(args.flood_rate),
+        "--flood-seconds", str(args.flood_seconds),
+        "--unauthorized-rate", str(args.unauthorized_rate),
+        "--bandwidth", str(args.bandwidth),
+        "--max-failed", str(args.max_failed),
+        "--seed", str(args.seed),
+    ]
+    if args.cpu_workers:
+        argv += ["--cpu-workers", str(args.cpu_workers)]
+    if args.offline:
+        argv.append("--offline")
+    return argv
+
+
+def print_report(rows: List[Dict]) -> None:
+    columns = (
+        "target", "inputs", "failed", "sessions_per_s", "p50_ms", "p99_ms",
+        "peak_rss_mb", "peak_rss_workers_mb", "flood_waits",
+    )
+    widths = {
+        column: max(len(column), *(len(str(row[column])) for row in rows))
+        for column in columns
+    }
+    print("  ".join(column.rjust(widths[column]) for column in columns))
+    for row in rows:
+        cells = [str(row[column]).rjust(widths[column]) for column in columns]
+        if not row["valid"]:
+            cells.append("НЕДЕЙСТВИТЕЛЬНО: есть ошибки конвертации")
+        print("  ".join(cells))
+    for row in rows:
+        stages = row.get("stages_p50_ms") or {}
+        if stages:
+            breakdown = ", ".join(f"{stage} {ms}" for stage, ms in stages.items())
+            print(f"{row['target']}/{row['inputs']} p50 по этапам, мс: {breakdown}")
+
+
+def compare_with_baseline(rows: List[Dict], baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(row["target"], row["inputs"]): row for row in json.load(f)}
+    ok = True
+    for row in rows:
+        previous = baseline.get((row["target"], row["inputs"]))
+        if not previous or not previous.get("valid", True):
+            continue
+        if row["sessions_per_s"] < previous["sessions_per_s"] * (1 - tolerance):
+            print(
+                f"РЕГРЕССИЯ {row['target']}/{row['inputs']}: "
+                f"{row['sessions_per_s']} < {previous['sessions_per_s']} сессий/с",
+                file=sys.stderr,
+            )
+            ok = False
+        if row["p99_ms"] > previous["p99_ms"] * (1 + tolerance):
+            print(
+                f"РЕГРЕССИЯ {row['target']}/{row['inputs']}: "
+                f"p99 {row['p99_ms']} > {previous['p99_ms']} мс",
+                file=sys.stderr,
+            )
+            ok = False
+    return ok
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Замер пропускной способности конвертера на локальной замене Telegram",
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--target", choices=TARGETS, default="process_conversion")
+    parser.add_argument(
+        "--mix", default="telethon,pyrogram,tdata",
+        help="типы входных файлов для process_conversion, по кругу",
+    )
+    parser.add_argument("--concurrency", type=int, default=main.MAX_CONCURRENCY)
+    parser.add_argument("--cpu-workers", type=int)
+    parser.add_argument("--info-level", choices=main.INFO_LEVELS, default=main.INFO_LEVEL)
+    parser.add_argument("--offline", action="store_true")
+    parser.add_argument("--latency", type=float, default=50.0, help="задержка запроса, мс")
+    parser.add_argument("--jitter", type=float, default=10.0, help="разброс задержки, мс")
+    parser.add_argument("--dialogs", type=int, default=200)
+    parser.add_argument("--contacts", type=int, default=50)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля запросов с FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=5)
+    parser.add_argument("--unauthorized-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--bandwidth", type=float, default=1000.0,
+        help="скорость передачи ответов, КБ/с (0 — без учёта размера)",
+    )
+    parser.add_argument(
+        "--max-failed", type=float, default=0.0,
+        help="допустимая доля ошибок; при большей замер недействителен",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", metavar="PATH", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", metavar="PATH", help="сравнить с сохранёнными результатами")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    return parser
+
+
+def benchmark_main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.single is not None:
+        args.inputs = args.single
+        print(json.dumps(run_single(args)))
+        return 0
+
+    rows = []
+    for size in args.sizes:
+        completed = subprocess.run(
+            single_run_argv(args, size), capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            sys.stderr.write(completed.stderr)
+            return completed.returncode
+        rows.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    print_report(rows)
+    invalid = [row for row in rows if not row["valid"]]
+    for row in invalid:
+        print(
+            f"ОШИБКА {row['target']}/{row['inputs']}: "
+            f"{row['failed']} из {row['inputs']} входов с ошибкой",
+            file=sys.stderr,
+        )
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+    if args.compare and not compare_with_baseline(rows, args.compare, args.tolerance):
+        return 1
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(benchmark_main())
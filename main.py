@@ -1,94 +1,466 @@
+from __future__ import annotations
+
+import argparse
 import asyncio
+import collections
+import csv
+import functools
+import hashlib
+import html
 import json
+import os
+import random
+import shutil
+import signal
 import sqlite3
+import sys
+import textwrap
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, replace
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
-
-from opentele.td import TDesktop
-from opentele.tl import TelegramClient
-from opentele.api import API, UseCurrentSession
-from telethon import functions
-from TGConvertor import SessionManager
-from rich.console import Console
-from rich.table import Table
-from rich.panel import Panel
-from rich.prompt import Confirm
-from InquirerPy import inquirer
-from rich.progress import (
-    Progress,
-    SpinnerColumn,
-    TextColumn,
-    BarColumn,
-    TaskProgressColumn,
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
 )
-from rich import box
+
+if TYPE_CHECKING:
+    from opentele.tl import TelegramClient
+    from rich.progress import Progress
+    from TGConvertor import SessionManager
 
 
 # -----------------------------------------------------------------------------
 # Конфигурация
 # -----------------------------------------------------------------------------
 
-console = Console()
+class LazyConsole:
+    def __init__(self) -> None:
+        self._console = None
+
+    def get(self):
+        if self._console is None:
+            from rich.console import Console
+
+            self._console = Console()
+        return self._console
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+
+console = LazyConsole()
 
 SESSIONS_DIR = "sessions"
 TDATAS_DIR = "tdatas"
 RESULTS_FILE = "conversion_results.json"
+RESULTS_JSONL_FILE = "conversion_results.jsonl"
+RESULTS_RUN = "last"  # какой запуск читают report и выгрузки: last, all или run_id
+SUMMARY_FILE = "conversion_summary.json"
+RESULTS_CSV_FILE = "conversion_results.csv"
+RESULTS_HTML_FILE = "conversion_results.html"
+CACHE_FILE = "account_cache.sqlite"
+MANIFEST_FILE = "conversion_manifest.sqlite"
+SCAN_CACHE_FILE = "scan_cache.sqlite"
+ARCHIVE_INDEX_FILE = "archive_index.jsonl"
+STORE_FILE = "session_store.sqlite"
+STORE_BATCH_SIZE = 500
+
+DEDUPE_POLICIES = ("off", "first", "newest", "oldest", "prefer-session", "prefer-tdata")
+DEDUPE_POLICY = "off"
+
+PASSCODE_SALT_POLICIES = ("batch", "account")
+PASSCODE_SALT_POLICY = "batch"  # account — своя соль и свой KDF на каждый аккаунт
+PASSCODE_SALT_SIZE = 32
+PASSCODE_KEY_CACHE_SIZE = 16  # ключей код-пароля на процесс пула
+# Проверочное значение код-пароля в манифесте считается так же медленно, как
+# ключ tdata в Telegram Desktop (PBKDF2-HMAC-SHA512, 100000 итераций).
+MANIFEST_PASSCODE_ITERATIONS = 100000
+
+SHARD_KEYS = ("path", "fingerprint")
+SHARD_KEY = "path"  # fingerprint — копии одного аккаунта попадают в один шард
+
+OUTPUT_FORMATS = ("dir", "zip", "tar")
+OUTPUT_FORMAT = "dir"
+ARCHIVE_COMPRESSION = 6  # 0 — без сжатия, 1–9 — уровень deflate/gzip
+RENDER_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+CACHE_TTL = 24 * 60 * 60
+CACHE_MAX_ENTRIES = 100_000
+
+MAX_CONCURRENCY = 16
+TYPE_CONCURRENCY: Dict[str, int] = {
+    "telethon": 0,
+    "pyrogram": 0,
+    "tdata": 0,
+}
+
+CPU_WORKERS = os.cpu_count() or 1
+SCAN_WORKERS = 32
+QUEUE_SIZE = 256
+WATCH_POLL_INTERVAL = 2.0  # пересканирование без watchfiles, секунд
+WATCH_DEBOUNCE = 1.0  # файл берётся в работу, когда столько секунд не менялся
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+SERVICE_DIR = "service_jobs"  # загруженные файлы и архивы результатов по задачам
+SERVICE_WORKERS = 8
+SERVICE_QUEUE_SIZE = 64  # сверх этого новые задачи получают 503
+SERVICE_JOB_TTL = 3600  # завершённые задачи забываются через столько секунд
+SERVICE_MAX_UPLOAD = 64 * 1024 * 1024
+SERVICE_MAX_EXTRACTED = 256 * 1024 * 1024  # распакованный размер zip с tdata
+SERVICE_MAX_MEMBERS = 1000  # файлов в zip с tdata
+SERVICE_STRING_FIELDS = (
+    "direction", "info_level", "name", "path", "data", "passcode", "input_passcode"
+)
+SERVICE_DIRECTIONS = {
+    "telethon-tdata": "telethon",
+    "pyrogram-tdata": "pyrogram",
+    "tdata-telethon": "tdata",
+}
+DC_CONCURRENCY = 8  # начальный лимит на DC, дальше подстраивается (0 — как MAX_CONCURRENCY)
+DC_MIN_CONCURRENCY = 1
+DC_DECREASE = 0.5
+DC_ERROR_RATE = 0.2  # доля сессий с сетевыми ошибками, выше которой лимит DC снижается
+DC_ERROR_WINDOW = 20  # примерно за столько последних сессий считается эта доля
+DC_RATE = 0.0  # запусков в секунду на DC (0 — без ограничения)
+FLOOD_WAIT_MAX = 300  # более долгий FloodWait считается ошибкой
+FLOOD_REQUEUE_LIMIT = 3
+
+SESSION_TIMEOUT = 300.0  # на все попытки одной сессии (0 — без ограничения)
+STAGE_TIMEOUTS: Dict[str, float] = {
+    "connect": 20.0,
+    "authorize": 15.0,
+    "get_me": 15.0,
+    "dialogs": 120.0,
+    "contacts": 30.0,
+}
+RETRY_ATTEMPTS = 2  # повторов при временных ошибках
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 5.0
+HEDGE_AFTER = 0.0  # через сколько секунд запускать второе подключение (0 — выключено)
+DISCONNECT_TIMEOUT = 5.0
+
+# Проверка авторизации (команда check): короткие пределы и много подключений
+CHECK_CONCURRENCY = 64
+CHECK_TIMEOUTS = {"connect": 8.0, "authorize": 5.0, "get_me": 5.0}
+CHECK_SESSION_TIMEOUT = 30.0
+CHECK_RETRY_ATTEMPTS = 0
+HEALTH_RESULTS_FILE = "health_results.jsonl"
+HEALTH_SUMMARY_FILE = "health_summary.json"
+PROGRESS_KEEP_FINISHED = 100
+PROGRESS_MODES = ("rows", "aggregate")
+PROGRESS_MODE = "rows"  # aggregate — общая полоса и несколько активных строк
+PROGRESS_ACTIVE_WINDOW = 10
+REPORT_TABLE_LIMIT = 200  # больше результатов — сводка вместо полной таблицы
+REPORT_TOP_ERRORS = 10
+RESULTS_FLUSH_EVERY = 100
+RESULTS_FLUSH_INTERVAL = 2.0
+
+TRACE_FILE = "conversion_trace.jsonl"
+METRICS_PREFIX = "session_converter"
+METRICS_HOST = "127.0.0.1"
+METRICS_WRITE_INTERVAL = 5.0
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DC_ADDRESSES: Dict[int, Tuple[str, int]] = {
+    1: ("149.154.175.53", 443),
+    2: ("149.154.167.51", 443),
+    3: ("149.154.175.100", 443),
+    4: ("149.154.167.91", 443),
+    5: ("91.108.56.130", 443),
+}
+
+
+INFO_LEVELS = ("none", "identity", "counts", "full")
+INFO_LEVEL = "full"
+
+
+@dataclass
+class ConversionOptions:
+    offline: bool = False
+    info_level: str = INFO_LEVEL
+    use_cache: bool = True
+    trust_cache: bool = False
+    use_manifest: bool = True
+    session_timeout: float = SESSION_TIMEOUT
+    retries: int = RETRY_ATTEMPTS
+    hedge_after: float = HEDGE_AFTER
+    output_format: str = OUTPUT_FORMAT
+    compression: int = ARCHIVE_COMPRESSION
+    dedupe: str = DEDUPE_POLICY
+    shard: Optional[Tuple[int, int]] = None
+    shard_key: str = SHARD_KEY
+    passcode: Optional[str] = None
+    input_passcode: Optional[str] = None
+    passcode_salt_policy: str = PASSCODE_SALT_POLICY
+    passcode_salt: Optional[bytes] = None
+    check_only: bool = False
+    check_get_me: bool = False
+    skip_dead: bool = True
+    output_dir: Optional[str] = None  # вместо TDATAS_DIR и SESSIONS_DIR для результатов
+
+    def __post_init__(self) -> None:
+        if self.info_level not in INFO_LEVELS:
+            raise ValueError(f"Неизвестный уровень информации: {self.info_level}")
+        if self.output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Неизвестный формат вывода: {self.output_format}")
+        if not 0 <= self.compression <= 9:
+            raise ValueError(f"Уровень сжатия должен быть от 0 до 9: {self.compression}")
+        if self.dedupe not in DEDUPE_POLICIES:
+            raise ValueError(f"Неизвестная политика дубликатов: {self.dedupe}")
+        if self.shard is not None and not 1 <= self.shard[0] <= self.shard[1]:
+            raise ValueError(f"Неверный шард: {self.shard[0]}/{self.shard[1]}")
+        if self.shard_key not in SHARD_KEYS:
+            raise ValueError(f"Неизвестный ключ шардирования: {self.shard_key}")
+        if self.passcode_salt_policy not in PASSCODE_SALT_POLICIES:
+            raise ValueError(
+                f"Неизвестная политика соли код-пароля: {self.passcode_salt_policy}"
+            )
+        for passcode in (self.passcode, self.input_passcode):
+            # Telegram Desktop и opentele кодируют код-пароль как ASCII.
+            if passcode and not passcode.isascii():
+                raise ValueError("Код-пароль tdata должен состоять из ASCII-символов")
+        if (
+            self.passcode
+            and self.passcode_salt_policy == "batch"
+            and self.passcode_salt is None
+        ):
+            self.passcode_salt = os.urandom(PASSCODE_SALT_SIZE)
 
 
 # -----------------------------------------------------------------------------
 # Поиск файлов и определение типа
 # -----------------------------------------------------------------------------
 
-def detect_session_type(file_path: Path) -> str:
-    if file_path.is_dir():
-        if (file_path / "D877F783D5D3EF8C").exists() or (
-            file_path / "key_datas"
-        ).exists():
-            return "tdata"
-        return "unknown"
-    if file_path.suffix == ".session":
+SQLITE_HEADER = b"SQLite format 3\x00"
+TDATA_MARKERS = ("D877F783D5D3EF8C", "key_datas")
+
+
+def detect_sqlite_session_type(file_path: Path) -> str:
+    try:
+        with open(file_path, "rb") as f:
+            if f.read(len(SQLITE_HEADER)) != SQLITE_HEADER:
+                return "unknown"
+        conn = sqlite3.connect(
+            f"{file_path.resolve().as_uri()}?mode=ro&immutable=1", uri=True
+        )
         try:
-            conn = sqlite3.connect(file_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT name FROM sqlite_master WHERE type='table'"
-            )
-            tables = [row[0] for row in cursor.fetchall()]
+            tables = {
+                row[0]
+                for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table'"
+                )
+            }
+        finally:
             conn.close()
-            if "sessions" in tables:
-                return "telethon"
-            return "pyrogram"
-        except Exception:
-            return "pyrogram"
+    except (OSError, sqlite3.Error):
+        return "pyrogram"
+    if "peers" in tables:
+        return "pyrogram"
+    if "entities" in tables or "sessions" in tables:
+        return "telethon"
+    return "pyrogram"
+
+
+def detect_session_type(file_path: Path) -> str:
+    if file_path.suffix == ".session":
+        return detect_sqlite_session_type(file_path)
+    try:
+        names = set(os.listdir(file_path))
+    except OSError:
+        return "unknown"
+    if any(marker in names for marker in TDATA_MARKERS):
+        return "tdata"
     return "unknown"
 
 
-def find_input_files() -> List[Tuple[Path, str]]:
+def scan_directory(
+    path: str, is_root: bool = False
+) -> Tuple[bool, List[str], List[Tuple[str, int, int]]]:
+    subdirs = []
+    session_files = []
+    names = set()
+    with os.scandir(path) as entries:
+        for entry in entries:
+            names.add(entry.name)
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.endswith(".session") and entry.is_file():
+                    stat = entry.stat()
+                    session_files.append(
+                        (entry.path, stat.st_size, stat.st_mtime_ns)
+                    )
+            except OSError:
+                continue
+    if not is_root and any(marker in names for marker in TDATA_MARKERS):
+        return True, [], []
+    return False, subdirs, session_files
+
+
+def load_scan_cache() -> Dict[str, Tuple[int, int, str]]:
+    conn = sqlite3.connect(SCAN_CACHE_FILE)
+    try:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS scan_cache ("
+            "path TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "session_type TEXT NOT NULL)"
+        )
+        return {
+            path: (size, mtime_ns, session_type)
+            for path, size, mtime_ns, session_type in conn.execute(
+                "SELECT path, size, mtime_ns, session_type FROM scan_cache"
+            )
+        }
+    finally:
+        conn.close()
+
+
+def save_scan_cache(entries: List[Tuple[str, int, int, str]]) -> None:
+    if not entries:
+        return
+    conn = sqlite3.connect(SCAN_CACHE_FILE)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO scan_cache "
+                "(path, size, mtime_ns, session_type) VALUES (?, ?, ?, ?)",
+                entries,
+            )
+    finally:
+        conn.close()
+
+
+async def iter_input_files(
+    file_type: Optional[str] = None,
+) -> AsyncIterator[Tuple[Path, str]]:
     sessions_path = Path(SESSIONS_DIR)
     if not sessions_path.exists():
         console.print(f"[yellow]⚠ Папка {SESSIONS_DIR} не найдена[/yellow]")
-        return []
+        return
+
+    loop = asyncio.get_running_loop()
+    scan_cache = await loop.run_in_executor(None, load_scan_cache)
+    new_entries = []
+
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+        root = str(sessions_path)
+        pending = {
+            loop.run_in_executor(pool, scan_directory, root, True): ("dir", root)
+        }
+        while pending:
+            done, _ = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for future in done:
+                kind, payload = pending.pop(future)
+                try:
+                    value = future.result()
+                except OSError:
+                    continue
+
+                if kind == "file":
+                    path, size, mtime_ns = payload
+                    new_entries.append((path, size, mtime_ns, value))
+                    if value != "unknown" and file_type in (None, value):
+                        yield Path(path), value
+                    continue
+
+                is_tdata, subdirs, files = value
+                if is_tdata:
+                    if file_type in (None, "tdata"):
+                        yield Path(payload), "tdata"
+                    continue
+                for subdir in subdirs:
+                    pending[
+                        loop.run_in_executor(pool, scan_directory, subdir)
+                    ] = ("dir", subdir)
+                for path, size, mtime_ns in files:
+                    cached = scan_cache.get(path)
+                    if cached and cached[:2] == (size, mtime_ns):
+                        if cached[2] != "unknown" and file_type in (None, cached[2]):
+                            yield Path(path), cached[2]
+                        continue
+                    pending[
+                        loop.run_in_executor(pool, detect_session_type, Path(path))
+                    ] = ("file", (path, size, mtime_ns))
+
+    await loop.run_in_executor(None, save_scan_cache, new_entries)
 
-    found = []
-    for path in sessions_path.rglob("*"):
-        if path.is_file() and path.suffix == ".session":
-            session_type = detect_session_type(path)
-            if session_type != "unknown":
-                found.append((path, session_type))
-        elif path.is_dir() and detect_session_type(path) == "tdata":
-            found.append((path, "tdata"))
 
-    return sorted(found, key=lambda x: str(x[0]))
+def find_input_files() -> List[Tuple[Path, str]]:
+    async def collect() -> List[Tuple[Path, str]]:
+        return [item async for item in iter_input_files()]
+
+    return sorted(asyncio.run(collect()), key=lambda x: str(x[0]))
 
 
 # -----------------------------------------------------------------------------
 # Информация об аккаунте
 # -----------------------------------------------------------------------------
 
-async def get_account_info(client) -> Optional[Dict]:
+async def count_dialogs_total(client) -> int:
+    dialogs = await client.get_dialogs(limit=0)
+    return dialogs.total
+
+
+async def count_contacts_total(client) -> int:
+    from telethon import functions
+
+    # Запроса, возвращающего только число контактов, в API нет: у
+    # contacts.getContacts saved_count — это импортированные из телефонной
+    # книги, а не контакты, и в ответе есть объект User на каждого.
+    # contacts.getContactIDs — самый дешёвый точный способ, 4 байта на контакт.
+    contact_ids = await client(functions.contacts.GetContactIDsRequest(hash=0))
+    return len(contact_ids)
+
+
+async def count_dialogs(client) -> int:
+    chats_count = 0
+    async for _ in client.iter_dialogs():
+        chats_count += 1
+    return chats_count
+
+
+async def count_contacts(client) -> int:
+    from telethon import functions
+
+    contacts_result = await client(functions.contacts.GetContactsRequest(hash=0))
+    if hasattr(contacts_result, "contacts"):
+        return len(contacts_result.contacts)
+    return 0
+
+
+async def get_account_info(
+    client,
+    level: str = INFO_LEVEL,
+    user_id: Optional[int] = None,
+    result: Optional[Dict] = None,
+) -> Optional[Dict]:
+    if level == "none":
+        return make_offline_account_info(user_id)
+
     try:
-        me = await client.get_me()
+        async with stage_deadline(result, "get_me"):
+            me = await client.get_me()
 
         first_name = me.first_name or ""
         last_name = me.last_name or ""
@@ -98,19 +470,28 @@ async def get_account_info(client) -> Optional[Dict]:
         phone = me.phone or None
         user_id = me.id
 
-        dialogs = await client.get_dialogs()
-        chats_count = len(dialogs)
-
-        try:
-            contacts_result = await client(
-                functions.contacts.GetContactsRequest(hash=0)
-            )
-            if hasattr(contacts_result, "contacts"):
-                contacts_count = len(contacts_result.contacts)
-            else:
+        chats_count = None
+        contacts_count = None
+        if level == "counts":
+            async with stage_deadline(result, "dialogs"):
+                chats_count = await count_dialogs_total(client)
+            try:
+                async with stage_deadline(result, "contacts"):
+                    contacts_count = await count_contacts_total(client)
+            except Exception as e:
+                if flood_wait_seconds(e) is not None or is_transient_error(e):
+                    raise
+                contacts_count = 0
+        elif level == "full":
+            async with stage_deadline(result, "dialogs"):
+                chats_count = await count_dialogs(client)
+            try:
+                async with stage_deadline(result, "contacts"):
+                    contacts_count = await count_contacts(client)
+            except Exception as e:
+                if flood_wait_seconds(e) is not None or is_transient_error(e):
+                    raise
                 contacts_count = 0
-        except Exception:
-            contacts_count = 0
 
         return {
             "name": full_name,
@@ -120,545 +501,4132 @@ async def get_account_info(client) -> Optional[Dict]:
             "user_id": user_id,
             "chats_count": chats_count,
             "contacts_count": contacts_count,
+            "info_level": level,
         }
     except Exception as e:
+        if flood_wait_seconds(e) is not None or is_transient_error(e):
+            raise
         console.print(
             f"[red]✗ Не удалось получить информацию об аккаунте: {e}[/red]"
         )
         return None
 
 
-def get_output_folder_name(account_info: Dict) -> str:
+def flood_wait_seconds(error: BaseException) -> Optional[int]:
+    from telethon.errors import FloodWaitError
+
+    if isinstance(error, FloodWaitError):
+        return error.seconds
+    return None
+
+
+def record_error(result: Dict, error: BaseException) -> None:
+    result["error"] = str(error)
+    result["status"] = "error"
+    seconds = flood_wait_seconds(error)
+    if seconds is not None:
+        result["flood_wait"] = seconds
+    elif is_transient_error(error):
+        result["retryable"] = True
+
+
+def make_offline_account_info(user_id: Optional[int]) -> Dict:
+    return {
+        "name": "Не указано",
+        "username": None,
+        "username_display": "Не указан",
+        "phone": "Не указан",
+        "user_id": user_id,
+        "chats_count": None,
+        "contacts_count": None,
+        "info_level": "none",
+    }
+
+
+def get_output_folder_name(account_info: Dict, fallback: str = "unknown") -> str:
     if account_info and account_info.get("username"):
         return f"tdata_{account_info['username']}"
     if account_info and account_info.get("user_id"):
         return f"tdata_{account_info['user_id']}"
-    return "tdata_unknown"
+    return f"tdata_{fallback}"
 
 
-def get_output_session_name(account_info: Dict, prefix: str = "session") -> str:
+def get_output_session_name(
+    account_info: Dict, prefix: str = "session", fallback: str = "unknown"
+) -> str:
     if account_info and account_info.get("username"):
         return f"{prefix}_{account_info['username']}.session"
     if account_info and account_info.get("user_id"):
         return f"{prefix}_{account_info['user_id']}.session"
-    return f"{prefix}_unknown.session"
+    return f"{prefix}_{fallback}.session"
 
 
 # -----------------------------------------------------------------------------
-# Конвертация Telethon → tdata
+# Офлайн-чтение сессий
 # -----------------------------------------------------------------------------
 
-async def convert_telethon_to_tdata(
-    session_file: Path,
-    progress: Progress,
-    task_id,
-) -> Dict:
-    session_path = str(session_file.with_suffix(""))
-    client = None
-    result = {
-        "input_file": str(session_file),
-        "input_type": "telethon",
-        "output_type": "tdata",
-        "session_name": session_file.name,
-        "status": "error",
-        "account_info": None,
-        "output_folder": None,
-        "error": None,
-        "timestamp": datetime.now().isoformat(),
-    }
+def read_telethon_session(session_file: Path) -> Optional[Dict]:
+    conn = sqlite3.connect(f"{session_file.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        row = conn.execute(
+            "SELECT dc_id, auth_key FROM sessions WHERE auth_key IS NOT NULL LIMIT 1"
+        ).fetchone()
+        if not row or not row[1]:
+            return None
+    finally:
+        conn.close()
+    # Telethon не хранит id владельца сессии: в entities лежат и контакты,
+    # поэтому id остаётся неизвестным до подключения (см. --enrich).
+    return {"auth_key": bytes(row[1]), "dc_id": row[0], "user_id": None}
 
+
+def session_dc_id(file_path: Path, file_type: str) -> int:
+    if file_type not in ("telethon", "pyrogram"):
+        return 0
     try:
-        progress.update(
-            task_id,
-            description=f"[cyan]Telethon: подключение к {session_file.name}...[/cyan]",
-        )
-        api = API.TelegramDesktop.Generate()
-        client = TelegramClient(session_path, api=api)
-        await client.connect()
+        conn = sqlite3.connect(f"{file_path.resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            row = conn.execute("SELECT dc_id FROM sessions LIMIT 1").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return 0
+    return row[0] if row and row[0] else 0
 
-        if not await client.is_user_authorized():
-            result["error"] = "Сессия не авторизована"
-            progress.update(
-                task_id,
-                description=f"[red]✗ {session_file.name} - не авторизована[/red]",
-            )
-            return result
 
-        progress.update(
-            task_id,
-            description=f"[cyan]Telethon: получение информации об аккаунте...[/cyan]",
-        )
-        account_info = await get_account_info(client)
-        if not account_info:
-            result["error"] = "Не удалось получить информацию об аккаунте"
-            return result
+def pyrogram_session_material(session: SessionManager) -> Dict:
+    return {
+        "auth_key": session.auth_key,
+        "dc_id": session.dc_id,
+        "user_id": session.user_id,
+    }
 
-        folder_name = get_output_folder_name(account_info)
-        out_folder = Path(TDATAS_DIR) / folder_name
-        result["account_info"] = account_info
-        result["output_folder"] = str(out_folder)
 
-        progress.update(
-            task_id,
-            description=f"[cyan]Telethon: конвертация в tdata...[/cyan]",
-        )
-        tdesk = await client.ToTDesktop(flag=UseCurrentSession, api=api)
-        out_folder.mkdir(parents=True, exist_ok=True)
-        tdesk.SaveTData(str(out_folder))
+async def read_pyrogram_session(session_file: Path) -> Dict:
+    from TGConvertor import SessionManager
 
-        result["status"] = "success"
-        progress.update(
-            task_id,
-            description=f"[green]✓ Telethon → tdata: {session_file.name}[/green]",
-        )
-        return result
+    session = await SessionManager.from_pyrogram_file(str(session_file))
+    return pyrogram_session_material(session)
 
-    except Exception as e:
-        result["error"] = str(e)
-        result["status"] = "error"
-        progress.update(
-            task_id,
-            description=f"[red]✗ Telethon: ошибка {session_file.name}[/red]",
-        )
-        return result
-    finally:
-        if client:
-            try:
-                await client.disconnect()
-            except Exception:
-                pass
+
+def write_telethon_session(output_file: Path, material: Dict) -> None:
+    from telethon.crypto import AuthKey
+    from telethon.sessions import SQLiteSession
+
+    session = SQLiteSession(str(output_file.with_suffix("")))
+    address, port = DC_ADDRESSES.get(material["dc_id"], DC_ADDRESSES[2])
+    session.set_dc(material["dc_id"], address, port)
+    session.auth_key = AuthKey(data=material["auth_key"])
+    session.save()
+    session.close()
+
+
+def client_material(client: TelegramClient) -> Dict:
+    return {
+        "auth_key": client.session.auth_key.key,
+        "dc_id": client.session.dc_id,
+        "user_id": None,
+    }
+
+
+async def write_tdata_output(
+    result: Dict,
+    material: Dict,
+    account_info: Dict,
+    fallback_name: str,
+    options: Optional[ConversionOptions] = None,
+) -> None:
+    options = options or ConversionOptions()
+    folder_name = get_output_folder_name(account_info, fallback_name)
+    user_id = account_info.get("user_id") or material.get("user_id") or 0
+    if options.output_format == "dir":
+        out_folder = Path(options.output_dir or TDATAS_DIR) / folder_name
+        with timed_stage(result, "save_tdata"):
+            await run_in_cpu_pool(
+                save_tdata_worker,
+                material["auth_key"],
+                material["dc_id"],
+                user_id,
+                str(out_folder),
+                options.passcode,
+                options.passcode_salt,
+            )
+        result["output_folder"] = str(out_folder)
+    else:
+        with timed_stage(result, "save_tdata"):
+            files = await run_in_cpu_pool(
+                render_tdata_worker,
+                material["auth_key"],
+                material["dc_id"],
+                user_id,
+                options.passcode,
+                options.passcode_salt,
+            )
+        with timed_stage(result, "write_archive"):
+            archive = open_archive_writer(
+                options.output_format, options.compression, options.output_dir
+            )
+            result["output_archive"], result["archive_entry"] = archive.add(
+                folder_name, files
+            )
+    if options.passcode:
+        result["passcode_protected"] = True
+    result["account_info"] = account_info
+    result["info_level"] = account_info["info_level"]
+    result["status"] = "success"
+    store_account(result, material, account_info)
 
 
 # -----------------------------------------------------------------------------
-# Конвертация Pyrogram → tdata
+# Архивы tdata
 # -----------------------------------------------------------------------------
 
-async def convert_pyrogram_to_tdata(
-    session_file: Path,
-    progress: Progress,
-    task_id,
-) -> Dict:
-    client = None
-    result = {
-        "input_file": str(session_file),
-        "input_type": "pyrogram",
-        "output_type": "tdata",
-        "session_name": session_file.name,
-        "status": "error",
-        "account_info": None,
-        "output_folder": None,
-        "error": None,
-        "timestamp": datetime.now().isoformat(),
-    }
+class ArchiveWriter:
+    def __init__(
+        self,
+        output_format: str = OUTPUT_FORMAT,
+        compression: int = ARCHIVE_COMPRESSION,
+        directory: Optional[str] = None,
+    ) -> None:
+        self.output_format = output_format
+        self.compression = compression
+        self.directory = Path(directory or TDATAS_DIR)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.tar = None
+        self.tar_path: Optional[Path] = None
+        if output_format == "tar":
+            import tarfile
 
-    try:
-        progress.update(
-            task_id,
-            description=f"[cyan]Pyrogram: загрузка {session_file.name}...[/cyan]",
-        )
+            suffix = ".tar.gz" if compression else ".tar"
+            self.tar_path = self.directory / f"tdatas_{datetime.now():%Y%m%d_%H%M%S}{suffix}"
+            if compression:
+                self.tar = tarfile.open(self.tar_path, "w:gz", compresslevel=compression)
+            else:
+                self.tar = tarfile.open(self.tar_path, "w")
+        self.index = open(self.directory / ARCHIVE_INDEX_FILE, "a", encoding="utf-8")
 
-        temp_session_path = Path(
-            session_file.parent / f"temp_{session_file.stem}.session"
+    def add(self, folder_name: str, files: Dict[str, bytes]) -> Tuple[str, str]:
+        if self.output_format == "zip":
+            archive_path = self.write_zip(folder_name, files)
+            entry = "tdata"
+        else:
+            archive_path = self.write_tar(folder_name, files)
+            entry = folder_name
+        self.index.write(
+            json.dumps(
+                {
+                    "archive": str(archive_path),
+                    "entry": entry,
+                    "folder_name": folder_name,
+                    "files": [
+                        {
+                            "name": name,
+                            "size": len(data),
+                            "sha256": hashlib.sha256(data).hexdigest(),
+                        }
+                        for name, data in sorted(files.items())
+                    ],
+                    "timestamp": datetime.now().isoformat(),
+                },
+                ensure_ascii=False,
+            )
+            + "\n"
         )
-        session = await SessionManager.from_pyrogram_file(str(session_file))
-        await session.to_telethon_file(str(temp_session_path))
+        return str(archive_path), entry
 
-        session_path = str(temp_session_path.with_suffix(""))
+    def write_zip(self, folder_name: str, files: Dict[str, bytes]) -> Path:
+        import zipfile
 
-        progress.update(
-            task_id,
-            description=f"[cyan]Pyrogram: подключение...[/cyan]",
-        )
-        api = API.TelegramDesktop.Generate()
-        client = TelegramClient(session_path, api=api)
-        await client.connect()
+        archive_path = self.directory / f"{folder_name}.zip"
+        temp_path = archive_path.with_name(archive_path.name + ".tmp")
+        compression = zipfile.ZIP_DEFLATED if self.compression else zipfile.ZIP_STORED
+        with zipfile.ZipFile(
+            temp_path, "w", compression, compresslevel=self.compression or None
+        ) as archive:
+            for name, data in sorted(files.items()):
+                archive.writestr(f"tdata/{name}", data)
+        os.replace(temp_path, archive_path)
+        return archive_path
 
-        if not await client.is_user_authorized():
-            result["error"] = "Сессия не авторизована"
-            progress.update(
-                task_id,
-                description=f"[red]✗ Pyrogram: не авторизована[/red]",
-            )
-            return result
+    def write_tar(self, folder_name: str, files: Dict[str, bytes]) -> Path:
+        import io
+        import tarfile
 
-        progress.update(
-            task_id,
-            description=f"[cyan]Pyrogram: получение информации...[/cyan]",
-        )
-        account_info = await get_account_info(client)
-        if not account_info:
-            result["error"] = "Не удалось получить информацию об аккаунте"
-            return result
+        now = time.time()
+        for name, data in sorted(files.items()):
+            info = tarfile.TarInfo(f"{folder_name}/{name}")
+            info.size = len(data)
+            info.mtime = now
+            info.mode = 0o644
+            self.tar.addfile(info, io.BytesIO(data))
+        return self.tar_path
 
-        folder_name = get_output_folder_name(account_info)
-        out_folder = Path(TDATAS_DIR) / folder_name
-        result["account_info"] = account_info
-        result["output_folder"] = str(out_folder)
+    def close(self) -> None:
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+        if not self.index.closed:
+            self.index.close()
 
-        progress.update(
-            task_id,
-            description=f"[cyan]Pyrogram: конвертация в tdata...[/cyan]",
-        )
-        tdesk = await client.ToTDesktop(flag=UseCurrentSession, api=api)
-        out_folder.mkdir(parents=True, exist_ok=True)
-        tdesk.SaveTData(str(out_folder))
 
-        result["status"] = "success"
-        progress.update(
-            task_id,
-            description=f"[green]✓ Pyrogram → tdata: {session_file.name}[/green]",
-        )
-        return result
+_archive_writers: Dict[Optional[str], ArchiveWriter] = {}
+
+
+def open_archive_writer(
+    output_format: str = OUTPUT_FORMAT,
+    compression: int = ARCHIVE_COMPRESSION,
+    directory: Optional[str] = None,
+) -> ArchiveWriter:
+    if directory not in _archive_writers:
+        _archive_writers[directory] = ArchiveWriter(output_format, compression, directory)
+    return _archive_writers[directory]
 
-    except Exception as e:
-        result["error"] = str(e)
-        result["status"] = "error"
-        progress.update(
-            task_id,
-            description=f"[red]✗ Pyrogram: ошибка {session_file.name}[/red]",
-        )
-        return result
-    finally:
-        if client:
-            try:
-                await client.disconnect()
-            except Exception:
-                pass
-        temp_session_path = Path(
-            session_file.parent / f"temp_{session_file.stem}.session"
-        )
-        if temp_session_path.exists():
-            try:
-                temp_session_path.unlink()
-            except Exception:
-                pass
+
+def close_archive_writer(directory: Optional[str] = None) -> None:
+    # Без directory закрываются все архивы, включая архивы задач сервиса.
+    directories = [directory] if directory else list(_archive_writers)
+    for key in directories:
+        writer = _archive_writers.pop(key, None)
+        if writer is not None:
+            writer.close()
 
 
 # -----------------------------------------------------------------------------
-# Конвертация tdata → Telethon session
+# Кэш информации об аккаунтах
 # -----------------------------------------------------------------------------
 
-async def convert_tdata_to_telethon(
-    tdata_folder: Path,
-    progress: Progress,
-    task_id,
-) -> Dict:
-    client = None
-    result = {
-        "input_file": str(tdata_folder),
-        "input_type": "tdata",
-        "output_type": "telethon",
+_account_cache: Optional[sqlite3.Connection] = None
+
+
+def auth_key_fingerprint(auth_key: bytes, dc_id: int) -> str:
+    return f"{dc_id}:{hashlib.sha256(auth_key).hexdigest()}"
+
+
+def open_account_cache() -> sqlite3.Connection:
+    global _account_cache
+    if _account_cache is None:
+        conn = sqlite3.connect(CACHE_FILE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS account_info ("
+            "fingerprint TEXT PRIMARY KEY, "
+            "info_level TEXT NOT NULL, "
+            "account_info TEXT NOT NULL, "
+            "updated REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS account_info_updated "
+            "ON account_info (updated)"
+        )
+        _account_cache = conn
+    return _account_cache
+
+
+def cache_get(material: Dict, level: str) -> Optional[Dict]:
+    row = open_account_cache().execute(
+        "SELECT info_level, account_info, updated FROM account_info "
+        "WHERE fingerprint = ?",
+        (auth_key_fingerprint(material["auth_key"], material["dc_id"]),),
+    ).fetchone()
+    if not row or time.time() - row[2] > CACHE_TTL:
+        return None
+    if INFO_LEVELS.index(row[0]) < INFO_LEVELS.index(level):
+        return None
+    return json.loads(row[1])
+
+
+def cache_put(material: Dict, account_info: Dict) -> None:
+    if account_info.get("info_level", "none") == "none":
+        return
+    conn = open_account_cache()
+    conn.execute(
+        "INSERT OR REPLACE INTO account_info "
+        "(fingerprint, info_level, account_info, updated) VALUES (?, ?, ?, ?)",
+        (
+            auth_key_fingerprint(material["auth_key"], material["dc_id"]),
+            account_info["info_level"],
+            json.dumps(account_info, ensure_ascii=False),
+            time.time(),
+        ),
+    )
+    conn.commit()
+
+
+def close_account_cache() -> None:
+    global _account_cache
+    if _account_cache is None:
+        return
+    conn = _account_cache
+    conn.execute(
+        "DELETE FROM account_info WHERE updated < ?",
+        (time.time() - CACHE_TTL,),
+    )
+    conn.execute(
+        "DELETE FROM account_info WHERE fingerprint NOT IN ("
+        "SELECT fingerprint FROM account_info ORDER BY updated DESC LIMIT ?)",
+        (CACHE_MAX_ENTRIES,),
+    )
+    conn.commit()
+    conn.close()
+    _account_cache = None
+
+
+def lookup_account_info(
+    material: Dict, options: ConversionOptions
+) -> Tuple[Optional[Dict], bool]:
+    # Без подключения из кэша берётся только офлайн или по явному
+    # --trust-cache: иначе отозванная сессия снова попала бы в результат.
+    if options.use_cache and (options.offline or options.trust_cache):
+        level = "none" if options.offline else options.info_level
+        cached = cache_get(material, level)
+        if cached:
+            return cached, True
+    if options.offline:
+        return make_offline_account_info(material.get("user_id")), False
+    return None, False
+
+
+async def fetch_account_info(
+    client: TelegramClient,
+    material: Optional[Dict],
+    options: ConversionOptions,
+    result: Dict,
+) -> Optional[Dict]:
+    if options.use_cache and material:
+        cached = cache_get(material, options.info_level)
+        if cached:
+            result["cached"] = True
+            return cached
+    account_info = await get_account_info(
+        client, options.info_level, material["user_id"] if material else None, result
+    )
+    if account_info and options.use_cache and material:
+        cache_put(material, account_info)
+    return account_info
+
+
+# -----------------------------------------------------------------------------
+# Манифест обработанных файлов
+# -----------------------------------------------------------------------------
+
+_manifest: Optional[sqlite3.Connection] = None
+_manifest_passcode_salt: Optional[bytes] = None
+
+
+def open_manifest() -> sqlite3.Connection:
+    global _manifest
+    if _manifest is None:
+        conn = sqlite3.connect(MANIFEST_FILE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS manifest ("
+            "input_file TEXT PRIMARY KEY, "
+            "input_type TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "content_hash TEXT NOT NULL, "
+            "status TEXT NOT NULL, "
+            "output TEXT, "
+            "error TEXT, "
+            "result TEXT NOT NULL, "
+            "updated REAL NOT NULL, "
+            "options TEXT)"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(manifest)")}
+        if "options" not in columns:
+            conn.execute("ALTER TABLE manifest ADD COLUMN options TEXT")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS health ("
+            "input_file TEXT PRIMARY KEY, "
+            "input_type TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "content_hash TEXT NOT NULL, "
+            "health TEXT NOT NULL, "
+            "error TEXT, "
+            "checked REAL NOT NULL)"
+        )
+        _manifest = conn
+    return _manifest
+
+
+def close_manifest() -> None:
+    global _manifest
+    if _manifest is not None:
+        _manifest.close()
+        _manifest = None
+
+
+def input_stat(path: Path) -> Tuple[int, int]:
+    stat = path.stat()
+    if not path.is_dir():
+        return stat.st_size, stat.st_mtime_ns
+    size = 0
+    mtime_ns = stat.st_mtime_ns
+    for file in path.rglob("*"):
+        if file.is_file():
+            file_stat = file.stat()
+            size += file_stat.st_size
+            mtime_ns = max(mtime_ns, file_stat.st_mtime_ns)
+    return size, mtime_ns
+
+
+def input_content_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    if path.is_dir():
+        files = sorted(file for file in path.rglob("*") if file.is_file())
+    else:
+        files = [path]
+    for file in files:
+        if path.is_dir():
+            digest.update(file.relative_to(path).as_posix().encode())
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def input_unchanged(
+    path: Path, size: int, mtime_ns: int, content_hash: str
+) -> bool:
+    if not path.exists():
+        return False
+    if input_stat(path) == (size, mtime_ns):
+        return True
+    return input_content_hash(path) == content_hash
+
+
+@functools.lru_cache(maxsize=PASSCODE_KEY_CACHE_SIZE)
+def manifest_passcode_verifier(passcode: str, salt: bytes) -> str:
+    # Быстрый хэш позволил бы подбирать код-пароль по манифесту в обход
+    # медленного KDF tdata, поэтому значение солёное и не дешевле самого KDF.
+    # Записи одного запуска делят соль, и KDF считается один раз на соль.
+    digest = hashlib.pbkdf2_hmac(
+        "sha512", passcode.encode("ascii"), salt, MANIFEST_PASSCODE_ITERATIONS
+    )
+    return f"{salt.hex()}:{digest[:16].hex()}"
+
+
+def manifest_options(
+    file_type: str, options: ConversionOptions, verifier_salt: Optional[bytes] = None
+) -> str:
+    # Параметры, от которых зависит результат. Запись с другими параметрами
+    # не считается готовой: файл конвертируется заново. verifier_salt берётся
+    # из сравниваемой записи; для новых записей — своя соль запуска.
+    global _manifest_passcode_salt
+    key = {"info_level": options.info_level, "offline": options.offline}
+    if OUTPUT_TYPES.get(file_type) == "tdata":
+        key["output_format"] = options.output_format
+        if options.output_format != "dir":
+            key["compression"] = options.compression
+        key["passcode"] = None
+        if options.passcode:
+            if verifier_salt is None:
+                if _manifest_passcode_salt is None:
+                    _manifest_passcode_salt = os.urandom(PASSCODE_SALT_SIZE)
+                verifier_salt = _manifest_passcode_salt
+            key["passcode"] = manifest_passcode_verifier(options.passcode, verifier_salt)
+    return json.dumps(key, sort_keys=True)
+
+
+def recorded_passcode_salt(recorded_options: Optional[str]) -> Optional[bytes]:
+    try:
+        salt, _ = json.loads(recorded_options)["passcode"].split(":")
+        return bytes.fromhex(salt)
+    except (TypeError, ValueError, KeyError, AttributeError):
+        return None
+
+
+async def manifest_lookup(
+    path: Path, file_type: str, options: ConversionOptions
+) -> Optional[Dict]:
+    row = open_manifest().execute(
+        "SELECT size, mtime_ns, content_hash, output, result, options FROM manifest "
+        "WHERE input_file = ? AND status = 'success'",
+        (str(path),),
+    ).fetchone()
+    if not row:
+        return None
+    size, mtime_ns, content_hash, output, result, recorded_options = row
+    expected = await asyncio.to_thread(
+        manifest_options, file_type, options, recorded_passcode_salt(recorded_options)
+    )
+    if recorded_options != expected:
+        return None
+    if output and not Path(output).exists():
+        return None
+    if not await asyncio.to_thread(
+        input_unchanged, path, size, mtime_ns, content_hash
+    ):
+        return None
+    return json.loads(result)
+
+
+async def manifest_record(
+    path: Path, file_type: str, result: Dict, options: ConversionOptions
+) -> None:
+    size, mtime_ns = await asyncio.to_thread(input_stat, path)
+    content_hash = await asyncio.to_thread(input_content_hash, path)
+    recorded_options = await asyncio.to_thread(manifest_options, file_type, options)
+    conn = open_manifest()
+    conn.execute(
+        "INSERT OR REPLACE INTO manifest (input_file, input_type, size, "
+        "mtime_ns, content_hash, status, output, error, result, updated, options) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            str(path),
+            file_type,
+            size,
+            mtime_ns,
+            content_hash,
+            result["status"],
+            result.get("output_folder")
+            or result.get("output_file")
+            or result.get("output_archive"),
+            result.get("error"),
+            json.dumps(result, ensure_ascii=False),
+            time.time(),
+            recorded_options,
+        ),
+    )
+    conn.commit()
+
+
+async def health_lookup(path: Path) -> Optional[Dict]:
+    row = open_manifest().execute(
+        "SELECT size, mtime_ns, content_hash, error, checked FROM health "
+        "WHERE input_file = ? AND health = 'dead'",
+        (str(path),),
+    ).fetchone()
+    if not row:
+        return None
+    size, mtime_ns, content_hash, error, checked = row
+    if not await asyncio.to_thread(
+        input_unchanged, path, size, mtime_ns, content_hash
+    ):
+        return None
+    return {"health": "dead", "error": error, "checked": checked}
+
+
+async def health_record(path: Path, file_type: str, result: Dict) -> None:
+    size, mtime_ns = await asyncio.to_thread(input_stat, path)
+    content_hash = await asyncio.to_thread(input_content_hash, path)
+    conn = open_manifest()
+    conn.execute(
+        "INSERT OR REPLACE INTO health (input_file, input_type, size, mtime_ns, "
+        "content_hash, health, error, checked) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            str(path),
+            file_type,
+            size,
+            mtime_ns,
+            content_hash,
+            result["health"],
+            result.get("error"),
+            time.time(),
+        ),
+    )
+    conn.commit()
+
+
+def make_dead_result(file_path: Path, file_type: str, health: Dict) -> Dict:
+    checked = datetime.fromtimestamp(health["checked"]).isoformat(timespec="seconds")
+    result = make_skipped_result(
+        file_path,
+        file_type,
+        OUTPUT_TYPES.get(file_type, "unknown"),
+        f"Сессия не авторизована (проверка {checked})",
+    )
+    result["health"] = "dead"
+    result["session_name"] = file_path.name
+    result["timings"] = {}
+    return result
+
+
+def make_resumed_result(previous: Dict) -> Dict:
+    result = dict(previous)
+    result["status"] = "skipped"
+    result["error"] = "Уже сконвертировано ранее"
+    result["resumed"] = True
+    result["timestamp"] = datetime.now().isoformat()
+    result["timings"] = {}
+    return result
+
+
+# -----------------------------------------------------------------------------
+# Замеры этапов, метрики и трассировка
+# -----------------------------------------------------------------------------
+
+class StageHistogram:
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_BUCKETS) -> None:
+        self.buckets = buckets
+        self.stages: Dict[Tuple[str, str], StageHistogram] = {}
+        self.results: Dict[Tuple[str, str], int] = collections.Counter()
+        self.exporters: List[Any] = []
+        self.lock = threading.Lock()
+
+    def observe_stage(self, stage: str, seconds: float, input_type: str = "") -> None:
+        with self.lock:
+            key = (input_type or "unknown", stage)
+            histogram = self.stages.get(key)
+            if histogram is None:
+                histogram = self.stages[key] = StageHistogram(self.buckets)
+            histogram.observe(seconds)
+
+    def observe_result(self, result: Dict) -> None:
+        with self.lock:
+            self.results[
+                (result.get("input_type") or "unknown", result.get("status") or "error")
+            ] += 1
+        for exporter in self.exporters:
+            exporter.update(self)
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {METRICS_PREFIX}_stage_seconds Время этапа конвертации.",
+            f"# TYPE {METRICS_PREFIX}_stage_seconds histogram",
+        ]
+        with self.lock:
+            for (input_type, stage), histogram in sorted(self.stages.items()):
+                labels = f'input_type="{input_type}",stage="{stage}"'
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(
+                        f'{METRICS_PREFIX}_stage_seconds_bucket{{{labels},le="{bound}"}} {count}'
+                    )
+                lines.append(
+                    f'{METRICS_PREFIX}_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}'
+                )
+                lines.append(f"{METRICS_PREFIX}_stage_seconds_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"{METRICS_PREFIX}_stage_seconds_count{{{labels}}} {histogram.count}")
+            lines.append(f"# HELP {METRICS_PREFIX}_results_total Завершённые конвертации.")
+            lines.append(f"# TYPE {METRICS_PREFIX}_results_total counter")
+            for (input_type, status), count in sorted(self.results.items()):
+                lines.append(
+                    f'{METRICS_PREFIX}_results_total{{input_type="{input_type}",status="{status}"}} {count}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def add_exporter(self, exporter) -> None:
+        self.exporters.append(exporter)
+
+    def close(self) -> None:
+        for exporter in self.exporters:
+            exporter.close(self)
+        self.exporters.clear()
+
+
+class PrometheusFileExporter:
+    def __init__(self, path: str, interval: float = METRICS_WRITE_INTERVAL) -> None:
+        self.path = Path(path)
+        self.interval = interval
+        self.last_write = 0.0
+
+    def update(self, metrics: Metrics) -> None:
+        if time.monotonic() - self.last_write >= self.interval:
+            self.write(metrics)
+
+    def write(self, metrics: Metrics) -> None:
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        temp_path.write_text(metrics.render(), encoding="utf-8")
+        os.replace(temp_path, self.path)
+        self.last_write = time.monotonic()
+
+    def close(self, metrics: Metrics) -> None:
+        self.write(metrics)
+
+
+class MetricsHTTPServer:
+    def __init__(self, metrics: Metrics, port: int, host: str = METRICS_HOST) -> None:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def update(self, metrics: Metrics) -> None:
+        pass
+
+    def close(self, metrics: Metrics) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TraceLog:
+    def __init__(self, path: str = TRACE_FILE) -> None:
+        self.path = Path(path)
+        self.run_id = uuid.uuid4().hex
+        self.buffer: List[str] = []
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def span(
+        self,
+        input_file: Optional[str],
+        stage: str,
+        started: float,
+        seconds: float,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        span = {
+            "run_id": self.run_id,
+            "input_file": input_file,
+            "stage": stage,
+            "start": round(started, 6),
+            "duration_ms": round(seconds * 1000, 3),
+            "status": "error" if error else "ok",
+        }
+        if error:
+            span["error"] = str(error) or type(error).__name__
+        self.buffer.append(json.dumps(span, ensure_ascii=False))
+        if len(self.buffer) >= RESULTS_FLUSH_EVERY:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffer:
+            self.file.write("\n".join(self.buffer) + "\n")
+            self.buffer.clear()
+        self.file.flush()
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+
+metrics = Metrics()
+_trace_log: Optional[TraceLog] = None
+
+
+def open_trace_log(path: str = TRACE_FILE) -> TraceLog:
+    global _trace_log
+    if _trace_log is None:
+        _trace_log = TraceLog(path)
+    return _trace_log
+
+
+def close_trace_log() -> None:
+    global _trace_log
+    if _trace_log is not None:
+        _trace_log.close()
+        _trace_log = None
+
+
+def start_metrics_exporters(
+    metrics_file: Optional[str] = None, metrics_port: Optional[int] = None
+) -> None:
+    if metrics_file:
+        metrics.add_exporter(PrometheusFileExporter(metrics_file))
+    if metrics_port:
+        metrics.add_exporter(MetricsHTTPServer(metrics, metrics_port))
+
+
+def record_stage(
+    result: Optional[Dict],
+    stage: str,
+    started: float,
+    seconds: float,
+    error: Optional[BaseException] = None,
+) -> None:
+    input_type = ""
+    input_file = None
+    if result is not None:
+        timings = result.setdefault("timings", {})
+        timings[stage] = round(timings.get(stage, 0.0) + seconds * 1000, 3)
+        input_type = result.get("input_type", "")
+        input_file = result.get("input_file")
+    metrics.observe_stage(stage, seconds, input_type)
+    if _trace_log is not None:
+        _trace_log.span(input_file, stage, started, seconds, error)
+
+
+@contextmanager
+def timed_stage(result: Optional[Dict], stage: str) -> Iterator[None]:
+    started = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        record_stage(result, stage, started, time.perf_counter() - start, error)
+
+
+class StageTimeout(TimeoutError):
+    def __init__(self, stage: str, seconds: float) -> None:
+        super().__init__(f"Этап {stage} не уложился в {seconds:g} с")
+        self.stage = stage
+        self.seconds = seconds
+
+
+@asynccontextmanager
+async def stage_deadline(result: Optional[Dict], stage: str) -> AsyncIterator[None]:
+    seconds = STAGE_TIMEOUTS.get(stage)
+    with timed_stage(result, stage):
+        if not seconds:
+            yield
+            return
+        try:
+            async with asyncio.timeout(seconds):
+                yield
+        except TimeoutError as e:
+            raise StageTimeout(stage, seconds) from e
+
+
+def is_transient_error(error: BaseException) -> bool:
+    from telethon import errors
+
+    return isinstance(
+        error,
+        (
+            TimeoutError,
+            ConnectionError,
+            asyncio.IncompleteReadError,
+            errors.ServerError,
+            errors.TimedOutError,
+        ),
+    )
+
+
+def retry_delay(attempt: int) -> float:
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+async def disconnect_client(client) -> None:
+    try:
+        await asyncio.wait_for(client.disconnect(), DISCONNECT_TIMEOUT)
+    except Exception:
+        pass
+
+
+async def connect_client(
+    result: Optional[Dict],
+    make_client: Callable[[], TelegramClient],
+    hedge_after: float = 0.0,
+    make_hedge: Optional[Callable[[], TelegramClient]] = None,
+) -> TelegramClient:
+    clients: Dict[asyncio.Future, TelegramClient] = {}
+
+    def launch(factory: Callable[[], TelegramClient]) -> None:
+        client = factory()
+        clients[asyncio.ensure_future(client.connect())] = client
+
+    launch(make_client)
+    primary = next(iter(clients.values()))
+    pending = set(clients)
+    winner = None
+    error: Optional[BaseException] = None
+    try:
+        async with stage_deadline(result, "connect"):
+            while pending and winner is None:
+                hedge = hedge_after if hedge_after and len(clients) == 1 else None
+                done, pending = await asyncio.wait(
+                    pending, timeout=hedge, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    launch(make_hedge or make_client)
+                    pending = {task for task in clients if not task.done()}
+                    continue
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = clients[task]
+            if winner is None:
+                raise error
+    finally:
+        for task, client in clients.items():
+            if client is not winner:
+                task.cancel()
+                await disconnect_client(client)
+        if result is not None and len(clients) > 1:
+            if winner is None:
+                result["hedged"] = "failed"
+            else:
+                result["hedged"] = "primary" if winner is primary else "hedge"
+    return winner
+
+
+# -----------------------------------------------------------------------------
+# Общее хранилище сессий
+# -----------------------------------------------------------------------------
+
+class SessionStore:
+    def __init__(self, path: str = STORE_FILE, batch_size: int = STORE_BATCH_SIZE) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.pending: List[Tuple] = []
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS accounts ("
+            "fingerprint TEXT PRIMARY KEY, "
+            "auth_key BLOB NOT NULL, "
+            "dc_id INTEGER NOT NULL, "
+            "user_id INTEGER, "
+            "account_info TEXT, "
+            "source TEXT, "
+            "source_type TEXT, "
+            "updated REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS accounts_user_id ON accounts (user_id)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS accounts_source ON accounts (source)"
+        )
+
+    def add(
+        self,
+        material: Dict,
+        account_info: Optional[Dict] = None,
+        source: Optional[str] = None,
+        source_type: Optional[str] = None,
+    ) -> None:
+        user_id = material.get("user_id")
+        if account_info and account_info.get("user_id"):
+            user_id = account_info["user_id"]
+        info = account_info if account_info and account_info.get("info_level") != "none" else None
+        self.pending.append(
+            (
+                auth_key_fingerprint(material["auth_key"], material["dc_id"]),
+                material["auth_key"],
+                material["dc_id"],
+                user_id,
+                json.dumps(info, ensure_ascii=False) if info else None,
+                source,
+                source_type,
+                time.time(),
+            )
+        )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO accounts (fingerprint, auth_key, dc_id, user_id, "
+                "account_info, source, source_type, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (fingerprint) DO UPDATE SET "
+                "user_id = COALESCE(excluded.user_id, accounts.user_id), "
+                "account_info = COALESCE(excluded.account_info, accounts.account_info), "
+                "source = excluded.source, "
+                "source_type = excluded.source_type, "
+                "updated = excluded.updated",
+                self.pending,
+            )
+        self.pending.clear()
+
+    def iter_accounts(self) -> Iterator[Dict]:
+        self.flush()
+        cursor = self.conn.execute(
+            "SELECT fingerprint, auth_key, dc_id, user_id, account_info, source, "
+            "source_type FROM accounts ORDER BY rowid"
+        )
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                return
+            for fingerprint, auth_key, dc_id, user_id, info, source, source_type in rows:
+                yield {
+                    "fingerprint": fingerprint,
+                    "auth_key": bytes(auth_key),
+                    "dc_id": dc_id,
+                    "user_id": user_id,
+                    "account_info": json.loads(info) if info else None,
+                    "source": source,
+                    "source_type": source_type,
+                }
+
+    def stats(self) -> Dict:
+        self.flush()
+        total, with_info = self.conn.execute(
+            "SELECT COUNT(*), COUNT(account_info) FROM accounts"
+        ).fetchone()
+        by_type = dict(
+            self.conn.execute(
+                "SELECT COALESCE(source_type, 'unknown'), COUNT(*) FROM accounts "
+                "GROUP BY source_type"
+            ).fetchall()
+        )
+        by_dc = {
+            str(dc_id): count
+            for dc_id, count in self.conn.execute(
+                "SELECT dc_id, COUNT(*) FROM accounts GROUP BY dc_id ORDER BY dc_id"
+            )
+        }
+        return {
+            "total": total,
+            "with_account_info": with_info,
+            "by_type": by_type,
+            "by_dc": by_dc,
+        }
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
+
+
+_session_store: Optional[SessionStore] = None
+
+
+def open_session_store(path: str = STORE_FILE) -> SessionStore:
+    global _session_store
+    if _session_store is None:
+        _session_store = SessionStore(path)
+    return _session_store
+
+
+def close_session_store() -> None:
+    global _session_store
+    if _session_store is not None:
+        _session_store.close()
+        _session_store = None
+
+
+def store_account(result: Dict, material: Dict, account_info: Optional[Dict]) -> None:
+    if _session_store is not None:
+        _session_store.add(
+            material, account_info, result.get("input_file"), result.get("input_type")
+        )
+
+
+async def read_input_materials(
+    file_path: Path, file_type: str, passcode: Optional[str] = None
+) -> List[Dict]:
+    if file_type == "telethon":
+        material = read_telethon_session(file_path)
+        return [material] if material else []
+    if file_type == "pyrogram":
+        return [await read_pyrogram_session(file_path)]
+    if file_type == "tdata":
+        return await run_in_cpu_pool(load_tdata_worker, str(file_path), passcode)
+    return []
+
+
+async def import_to_store(
+    store: SessionStore,
+    file_type: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    passcode: Optional[str] = None,
+) -> Dict:
+    summary = {"inputs": 0, "accounts": 0, "failed": 0}
+    limit = asyncio.Semaphore(max(1, concurrency or MAX_CONCURRENCY))
+
+    async def import_one(file_path: Path, session_type: str) -> None:
+        async with limit:
+            try:
+                materials = await read_input_materials(
+                    file_path, session_type, passcode
+                )
+            except Exception as e:
+                console.print(f"[red]✗ {file_path}: {e}[/red]")
+                materials = []
+        if not materials:
+            summary["failed"] += 1
+            return
+        for material in materials:
+            account_info = cache_get(material, "identity")
+            store.add(material, account_info, str(file_path), session_type)
+            summary["accounts"] += 1
+
+    tasks = set()
+    async for file_path, session_type in iter_input_files(file_type):
+        summary["inputs"] += 1
+        tasks.add(asyncio.ensure_future(import_one(file_path, session_type)))
+        if len(tasks) >= QUEUE_SIZE:
+            _, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    if tasks:
+        await asyncio.gather(*tasks)
+    store.flush()
+    return summary
+
+
+async def export_from_store(
+    store: SessionStore,
+    output_type: str,
+    options: Optional[ConversionOptions] = None,
+    concurrency: Optional[int] = None,
+) -> Dict:
+    options = options or ConversionOptions(offline=True)
+    summary = {"accounts": 0, "exported": 0, "failed": 0}
+    limit = asyncio.Semaphore(max(1, concurrency or MAX_CONCURRENCY))
+    Path(SESSIONS_DIR if output_type == "telethon" else TDATAS_DIR).mkdir(
+        parents=True, exist_ok=True
+    )
+
+    async def export_one(account: Dict) -> None:
+        account_info = account["account_info"] or make_offline_account_info(
+            account["user_id"]
+        )
+        fallback_name = account["fingerprint"].split(":")[1][:16]
+        async with limit:
+            try:
+                if output_type == "telethon":
+                    write_telethon_session(
+                        Path(SESSIONS_DIR)
+                        / get_output_session_name(account_info, "session", fallback_name),
+                        account,
+                    )
+                else:
+                    await write_tdata_output(
+                        {"timings": {}}, account, account_info, fallback_name, options
+                    )
+                summary["exported"] += 1
+            except Exception as e:
+                console.print(f"[red]✗ {account['fingerprint']}: {e}[/red]")
+                summary["failed"] += 1
+
+    tasks = set()
+    for account in store.iter_accounts():
+        summary["accounts"] += 1
+        tasks.add(asyncio.ensure_future(export_one(account)))
+        if len(tasks) >= QUEUE_SIZE:
+            _, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return summary
+
+
+# -----------------------------------------------------------------------------
+# Пул процессов для шифрования tdata
+# -----------------------------------------------------------------------------
+
+_cpu_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_cpu_pool(workers: Optional[int] = None) -> ProcessPoolExecutor:
+    global _cpu_pool
+    if _cpu_pool is None:
+        _cpu_pool = ProcessPoolExecutor(max_workers=max(1, workers or CPU_WORKERS))
+    return _cpu_pool
+
+
+def shutdown_cpu_pool() -> None:
+    global _cpu_pool
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(wait=True, cancel_futures=True)
+        _cpu_pool = None
+
+
+def warm_worker() -> int:
+    import opentele.td  # noqa: F401
+    import opentele.api  # noqa: F401
+
+    return os.getpid()
+
+
+def warm_cpu_pool(workers: Optional[int] = None) -> None:
+    pool = get_cpu_pool(workers)
+    count = max(1, workers or CPU_WORKERS)
+    for future in [pool.submit(warm_worker) for _ in range(count)]:
+        future.result()
+
+
+async def run_in_cpu_pool(func: Callable, *args) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_pool(), func, *args)
+
+
+def install_passcode_key_cache(size: int = PASSCODE_KEY_CACHE_SIZE) -> None:
+    # Ключ из код-пароля считается намеренно дорогим KDF. В пределах процесса
+    # он одинаков для всех аккаунтов с тем же код-паролем и солью.
+    from opentele import td
+    from PyQt5.QtCore import QByteArray
+
+    if getattr(td.Storage.CreateLocalKey, "cache_info", None):
+        return
+    create_local_key = td.Storage.CreateLocalKey
+
+    @functools.lru_cache(maxsize=size)
+    def cached(salt: bytes, passcode: bytes):
+        return create_local_key(QByteArray(salt), QByteArray(passcode))
+
+    def create_local_key_cached(salt, passcode=QByteArray()):
+        # Пустой код-пароль стоит одну итерацию, кэшировать его незачем.
+        if not len(passcode):
+            return create_local_key(salt, passcode)
+        return cached(bytes(salt), bytes(passcode))
+
+    create_local_key_cached.cache_info = cached.cache_info
+    td.Storage.CreateLocalKey = staticmethod(create_local_key_cached)
+
+
+def protect_tdesktop(tdesk, passcode: str, salt: bytes) -> bool:
+    from opentele import td
+    from PyQt5.QtCore import QByteArray
+
+    # Кодировка как в opentele.TDesktop.SaveTData, иначе tdata не откроется.
+    passcode_bytes = passcode.encode("ascii")
+    try:
+        key = td.Storage.CreateLocalKey(QByteArray(salt), QByteArray(passcode_bytes))
+        data = td.Storage.EncryptedDescriptor(td.AuthKey.kSize)
+        tdesk._TDesktop__localKey.write(data.stream)
+        encrypted = td.Storage.PrepareEncrypted(data, key)
+        tdesk._TDesktop__passcode = passcode
+        tdesk._TDesktop__passcodeBytes = passcode_bytes
+        tdesk._TDesktop__passcodeKeySalt = QByteArray(salt)
+        tdesk._TDesktop__passcodeKey = key
+        tdesk._TDesktop__passcodeKeyEncrypted = encrypted
+    except AttributeError:
+        return False
+    return True
+
+
+def save_tdata_worker(
+    auth_key: bytes,
+    dc_id: int,
+    user_id: int,
+    out_folder: str,
+    passcode: Optional[str] = None,
+    salt: Optional[bytes] = None,
+) -> None:
+    from opentele import td
+    from opentele.api import API
+    from opentele.td import TDesktop
+    from opentele.td.configs import DcId
+
+    tdesk = TDesktop()
+    tdesk._TDesktop__generateLocalKey()
+    account = td.Account(owner=tdesk, api=API.TelegramDesktop)
+    account._setMtpAuthorizationCustom(
+        DcId(dc_id),
+        user_id,
+        [td.AuthKey(auth_key, td.AuthKeyType.ReadFromFile, DcId(dc_id))],
+    )
+    tdesk._addSingleAccount(account)
+    Path(out_folder).mkdir(parents=True, exist_ok=True)
+    if not passcode:
+        tdesk.SaveTData(out_folder)
+        return
+    install_passcode_key_cache()
+    if salt is not None and protect_tdesktop(tdesk, passcode, salt):
+        tdesk.SaveTData(out_folder)
+    else:
+        tdesk.SaveTData(out_folder, passcode=passcode)
+
+
+def render_tdata_worker(
+    auth_key: bytes,
+    dc_id: int,
+    user_id: int,
+    passcode: Optional[str] = None,
+    salt: Optional[bytes] = None,
+) -> Dict[str, bytes]:
+    import tempfile
+
+    with tempfile.TemporaryDirectory(prefix="tdata-", dir=RENDER_DIR) as temp_dir:
+        save_tdata_worker(auth_key, dc_id, user_id, temp_dir, passcode, salt)
+        root = Path(temp_dir)
+        return {
+            file.relative_to(root).as_posix(): file.read_bytes()
+            for file in sorted(root.rglob("*"))
+            if file.is_file()
+        }
+
+
+def load_tdata_worker(tdata_folder: str, passcode: Optional[str] = None) -> List[Dict]:
+    from opentele.td import TDesktop
+
+    if passcode:
+        install_passcode_key_cache()
+    tdesk = TDesktop(tdata_folder, passcode=passcode)
+    if not tdesk.isLoaded():
+        return []
+    accounts = [tdesk.mainAccount] + [
+        account for account in tdesk.accounts if account is not tdesk.mainAccount
+    ]
+    return [
+        {
+            "auth_key": account.authKey.key,
+            "dc_id": int(account.MainDcId),
+            "user_id": account.UserId,
+        }
+        for account in accounts
+    ]
+
+
+def generate_api():
+    from opentele.api import API
+
+    return API.TelegramDesktop.Generate()
+
+
+def create_client(session, api) -> TelegramClient:
+    from opentele.tl import TelegramClient
+
+    return TelegramClient(session, api=api)
+
+
+def make_telethon_client(
+    session, auth_key: bytes, dc_id: int, api
+) -> TelegramClient:
+    from telethon.crypto import AuthKey
+
+    client = create_client(session, api)
+    address, port = DC_ADDRESSES.get(dc_id, DC_ADDRESSES[2])
+    client.session.set_dc(dc_id, address, port)
+    client.session.auth_key = AuthKey(data=auth_key)
+    return client
+
+
+# -----------------------------------------------------------------------------
+# Конвертация Telethon → tdata
+# -----------------------------------------------------------------------------
+
+async def convert_telethon_to_tdata(
+    session_file: Path,
+    progress: Progress,
+    task_id,
+    options: Optional[ConversionOptions] = None,
+) -> Dict:
+    from telethon.sessions import MemorySession
+
+    options = options or ConversionOptions()
+    client = None
+    result = {
+        "input_file": str(session_file),
+        "input_type": "telethon",
+        "output_type": "tdata",
+        "session_name": session_file.name,
+        "status": "error",
+        "account_info": None,
+        "output_folder": None,
+        "error": None,
+        "info_level": "none" if options.offline else options.info_level,
+        "timestamp": datetime.now().isoformat(),
+        "timings": {},
+    }
+
+    try:
+        progress.update(
+            task_id,
+            description=f"[cyan]Telethon: чтение {session_file.name}...[/cyan]",
+        )
+        with timed_stage(result, "read_session"):
+            material = read_telethon_session(session_file)
+        if not material:
+            result["error"] = "В сессии нет ключа авторизации"
+            progress.update(
+                task_id,
+                description=f"[red]✗ {session_file.name} - нет ключа[/red]",
+            )
+            return result
+
+        account_info, cached = lookup_account_info(material, options)
+        if account_info:
+            await write_tdata_output(
+                result, material, account_info, session_file.stem, options
+            )
+            result["offline"] = options.offline
+            result["cached"] = cached
+            source = "кэш" if cached else "офлайн"
+            progress.update(
+                task_id,
+                description=f"[green]✓ Telethon → tdata ({source}): {session_file.name}[/green]",
+            )
+            return result
+
+        progress.update(
+            task_id,
+            description=f"[cyan]Telethon: подключение к {session_file.name}...[/cyan]",
+        )
+        api = generate_api()
+        # Клиент работает с копией ключа в памяти: SQLiteSession переписывает
+        # входной .session при подключении, и --watch принимал бы его за новый.
+        client = await connect_client(
+            result,
+            lambda: make_telethon_client(
+                MemorySession(), material["auth_key"], material["dc_id"], api
+            ),
+            options.hedge_after,
+        )
+
+        async with stage_deadline(result, "authorize"):
+            authorized = await client.is_user_authorized()
+        if not authorized:
+            result["error"] = "Сессия не авторизована"
+            progress.update(
+                task_id,
+                description=f"[red]✗ {session_file.name} - не авторизована[/red]",
+            )
+            return result
+
+        progress.update(
+            task_id,
+            description=f"[cyan]Telethon: получение информации об аккаунте...[/cyan]",
+        )
+        account_info = await fetch_account_info(client, material, options, result)
+        if not account_info:
+            result["error"] = "Не удалось получить информацию об аккаунте"
+            return result
+
+        progress.update(
+            task_id,
+            description=f"[cyan]Telethon: конвертация в tdata...[/cyan]",
+        )
+        await write_tdata_output(
+            result, client_material(client), account_info, session_file.stem, options
+        )
+        progress.update(
+            task_id,
+            description=f"[green]✓ Telethon → tdata: {session_file.name}[/green]",
+        )
+        return result
+
+    except Exception as e:
+        record_error(result, e)
+        progress.update(
+            task_id,
+            description=f"[red]✗ Telethon: ошибка {session_file.name}[/red]",
+        )
+        return result
+    finally:
+        if client:
+            await disconnect_client(client)
+
+
+# -----------------------------------------------------------------------------
+# Конвертация Pyrogram → tdata
+# -----------------------------------------------------------------------------
+
+async def convert_pyrogram_to_tdata(
+    session_file: Path,
+    progress: Progress,
+    task_id,
+    options: Optional[ConversionOptions] = None,
+) -> Dict:
+    from telethon.sessions import MemorySession
+    from TGConvertor import SessionManager
+
+    options = options or ConversionOptions()
+    client = None
+    result = {
+        "input_file": str(session_file),
+        "input_type": "pyrogram",
+        "output_type": "tdata",
+        "session_name": session_file.name,
+        "status": "error",
+        "account_info": None,
+        "output_folder": None,
+        "error": None,
+        "info_level": "none" if options.offline else options.info_level,
+        "timestamp": datetime.now().isoformat(),
+        "timings": {},
+    }
+
+    try:
+        progress.update(
+            task_id,
+            description=f"[cyan]Pyrogram: загрузка {session_file.name}...[/cyan]",
+        )
+
+        with timed_stage(result, "read_session"):
+            session = await SessionManager.from_pyrogram_file(str(session_file))
+        material = pyrogram_session_material(session)
+
+        account_info, cached = lookup_account_info(material, options)
+        if account_info:
+            await write_tdata_output(
+                result, material, account_info, session_file.stem, options
+            )
+            result["offline"] = options.offline
+            result["cached"] = cached
+            source = "кэш" if cached else "офлайн"
+            progress.update(
+                task_id,
+                description=f"[green]✓ Pyrogram → tdata ({source}): {session_file.name}[/green]",
+            )
+            return result
+
+        progress.update(
+            task_id,
+            description=f"[cyan]Pyrogram: подключение...[/cyan]",
+        )
+        api = generate_api()
+        client = await connect_client(
+            result,
+            lambda: make_telethon_client(
+                MemorySession(), material["auth_key"], material["dc_id"], api
+            ),
+            options.hedge_after,
+        )
+
+        async with stage_deadline(result, "authorize"):
+            authorized = await client.is_user_authorized()
+        if not authorized:
+            result["error"] = "Сессия не авторизована"
+            progress.update(
+                task_id,
+                description=f"[red]✗ Pyrogram: не авторизована[/red]",
+            )
+            return result
+
+        progress.update(
+            task_id,
+            description=f"[cyan]Pyrogram: получение информации...[/cyan]",
+        )
+        account_info = await fetch_account_info(client, material, options, result)
+        if not account_info:
+            result["error"] = "Не удалось получить информацию об аккаунте"
+            return result
+
+        progress.update(
+            task_id,
+            description=f"[cyan]Pyrogram: конвертация в tdata...[/cyan]",
+        )
+        await write_tdata_output(
+            result, client_material(client), account_info, session_file.stem, options
+        )
+        progress.update(
+            task_id,
+            description=f"[green]✓ Pyrogram → tdata: {session_file.name}[/green]",
+        )
+        return result
+
+    except Exception as e:
+        record_error(result, e)
+        progress.update(
+            task_id,
+            description=f"[red]✗ Pyrogram: ошибка {session_file.name}[/red]",
+        )
+        return result
+    finally:
+        if client:
+            await disconnect_client(client)
+
+
+# -----------------------------------------------------------------------------
+# Конвертация tdata → Telethon session
+# -----------------------------------------------------------------------------
+
+async def convert_tdata_account(
+    tdata_folder: Path,
+    index: int,
+    material: Dict,
+    result: Dict,
+    options: ConversionOptions,
+) -> Dict:
+    from telethon.sessions import MemorySession
+
+    fallback_name = tdata_folder.name if index == 0 else f"{tdata_folder.name}_{index}"
+    client = None
+    try:
+        account_info, cached = lookup_account_info(material, options)
+        if account_info:
+            result["offline"] = options.offline
+            result["cached"] = cached
+        else:
+            api = generate_api()
+            client = await connect_client(
+                result,
+                lambda: make_telethon_client(
+                    MemorySession(), material["auth_key"], material["dc_id"], api
+                ),
+                options.hedge_after,
+            )
+
+            async with stage_deadline(result, "authorize"):
+                authorized = await client.is_user_authorized()
+            if not authorized:
+                result["error"] = "Сессия не авторизована"
+                return result
+
+            account_info = await fetch_account_info(client, material, options, result)
+            if not account_info:
+                result["error"] = "Не удалось получить информацию об аккаунте"
+                return result
+
+        output_dir = Path(options.output_dir or SESSIONS_DIR)
+        output_file = output_dir / get_output_session_name(
+            account_info, "session", fallback_name
+        )
+        output_dir.mkdir(parents=True, exist_ok=True)
+        with timed_stage(result, "write_session"):
+            write_telethon_session(output_file, material)
+        store_account(result, material, account_info)
+
+        result["account_info"] = account_info
+        result["output_file"] = str(output_file)
+        result["info_level"] = account_info["info_level"]
+        result["status"] = "success"
+        return result
+
+    except Exception as e:
+        record_error(result, e)
+        return result
+    finally:
+        if client:
+            await disconnect_client(client)
+
+
+def merge_account_results(result: Dict, account_results: List[Dict]) -> None:
+    main_result = account_results[0]
+    for key in ("status", "account_info", "output_file", "error", "info_level"):
+        result[key] = main_result[key]
+    for key in ("offline", "cached"):
+        if key in main_result:
+            result[key] = main_result[key]
+    for account_result in account_results:
+        for stage, ms in account_result["timings"].items():
+            result["timings"][stage] = round(result["timings"].get(stage, 0.0) + ms, 3)
+    flood_waits = [r["flood_wait"] for r in account_results if "flood_wait" in r]
+    if flood_waits:
+        result["flood_wait"] = max(flood_waits)
+    if any(r.pop("retryable", False) for r in account_results):
+        result["retryable"] = True
+    if len(account_results) == 1:
+        return
+
+    result["accounts"] = [
+        {
+            "account_index": index,
+            "status": account_result["status"],
+            "account_info": account_result["account_info"],
+            "output_file": account_result["output_file"],
+            "error": account_result["error"],
+            "cached": account_result.get("cached", False),
+            "timings": account_result["timings"],
+        }
+        for index, account_result in enumerate(account_results)
+    ]
+    failed = [
+        f"аккаунт {index}: {account_result['error']}"
+        for index, account_result in enumerate(account_results)
+        if account_result["status"] != "success"
+    ]
+    if failed:
+        result["status"] = "error"
+        result["error"] = "; ".join(failed)
+
+
+async def convert_tdata_to_telethon(
+    tdata_folder: Path,
+    progress: Progress,
+    task_id,
+    options: Optional[ConversionOptions] = None,
+) -> Dict:
+    options = options or ConversionOptions()
+    result = {
+        "input_file": str(tdata_folder),
+        "input_type": "tdata",
+        "output_type": "telethon",
         "session_name": tdata_folder.name,
         "status": "error",
-        "account_info": None,
-        "output_file": None,
-        "error": None,
+        "account_info": None,
+        "output_file": None,
+        "error": None,
+        "info_level": "none" if options.offline else options.info_level,
+        "timestamp": datetime.now().isoformat(),
+        "timings": {},
+    }
+
+    try:
+        progress.update(
+            task_id,
+            description=f"[cyan]tdata: загрузка {tdata_folder.name}...[/cyan]",
+        )
+
+        with timed_stage(result, "load_tdata"):
+            accounts = await run_in_cpu_pool(
+                load_tdata_worker, str(tdata_folder), options.input_passcode
+            )
+        if not accounts:
+            result["error"] = "Не удалось загрузить tdata"
+            progress.update(
+                task_id,
+                description=f"[red]✗ tdata: не загружен[/red]",
+            )
+            return result
+
+        progress.update(
+            task_id,
+            description=f"[cyan]tdata: конвертация в Telethon ({len(accounts)} акк.)...[/cyan]",
+        )
+        account_results = await asyncio.gather(
+            *(
+                convert_tdata_account(
+                    tdata_folder,
+                    index,
+                    material,
+                    dict(result, account_info=None, timings={}),
+                    options,
+                )
+                for index, material in enumerate(accounts)
+            )
+        )
+        merge_account_results(result, account_results)
+
+        if result["status"] != "success":
+            progress.update(
+                task_id,
+                description=f"[red]✗ tdata: {result['error']}[/red]",
+            )
+            return result
+
+        source = ""
+        if result.get("cached"):
+            source = " (кэш)"
+        elif result.get("offline"):
+            source = " (офлайн)"
+        progress.update(
+            task_id,
+            description=f"[green]✓ tdata → Telethon{source}: {tdata_folder.name}[/green]",
+        )
+        return result
+
+    except Exception as e:
+        record_error(result, e)
+        progress.update(
+            task_id,
+            description=f"[red]✗ tdata: ошибка {tdata_folder.name}[/red]",
+        )
+        return result
+
+
+# -----------------------------------------------------------------------------
+# Проверка авторизации
+# -----------------------------------------------------------------------------
+
+def is_dead_error(error: BaseException) -> bool:
+    from telethon import errors
+
+    return isinstance(
+        error,
+        (
+            errors.UnauthorizedError,
+            errors.AuthKeyDuplicatedError,
+            errors.UserDeactivatedBanError,
+        ),
+    )
+
+
+async def check_account(
+    material: Dict, options: ConversionOptions, result: Dict
+) -> Dict:
+    from telethon import functions
+    from telethon.sessions import MemorySession
+
+    account = {"user_id": material.get("user_id"), "health": "unknown", "error": None}
+    api = generate_api()
+    client = None
+    try:
+        client = await connect_client(
+            result,
+            lambda: make_telethon_client(
+                MemorySession(), material["auth_key"], material["dc_id"], api
+            ),
+            options.hedge_after,
+        )
+        # is_user_authorized() превращает любую RPC-ошибку (FloodWait, 5xx) в
+        # False, поэтому запрос делается напрямую, а ошибка разбирается ниже.
+        async with stage_deadline(result, "authorize"):
+            await client(functions.updates.GetStateRequest())
+        account["health"] = "alive"
+        if options.check_get_me:
+            account_info = await get_account_info(
+                client, "identity", material.get("user_id"), result
+            )
+            if account_info is None:
+                account["health"] = "unknown"
+                account["error"] = "Не удалось получить информацию об аккаунте"
+            else:
+                account["user_id"] = account_info["user_id"]
+                account["account_info"] = account_info
+        return account
+    except Exception as e:
+        if flood_wait_seconds(e) is not None or is_transient_error(e):
+            raise
+        account["health"] = "dead" if is_dead_error(e) else "unknown"
+        account["error"] = str(e) or type(e).__name__
+        return account
+    finally:
+        if client:
+            await disconnect_client(client)
+
+
+def merge_health(accounts: List[Dict]) -> str:
+    states = {account["health"] for account in accounts}
+    if states == {"alive"}:
+        return "alive"
+    if states == {"dead"}:
+        return "dead"
+    return "unknown"
+
+
+async def check_input(
+    file_path: Path,
+    file_type: str,
+    progress: Progress,
+    task_id,
+    options: ConversionOptions,
+) -> Dict:
+    result = {
+        "input_file": str(file_path),
+        "input_type": file_type,
+        "output_type": "check",
+        "session_name": file_path.name,
+        "status": "error",
+        "health": "unknown",
+        "account_info": None,
+        "error": None,
+        "info_level": "identity" if options.check_get_me else "none",
+        "timestamp": datetime.now().isoformat(),
+        "timings": {},
+    }
+
+    try:
+        progress.update(
+            task_id,
+            description=f"[cyan]Проверка: {file_path.name}...[/cyan]",
+        )
+        stage = "load_tdata" if file_type == "tdata" else "read_session"
+        with timed_stage(result, stage):
+            materials = await read_input_materials(
+                file_path, file_type, options.input_passcode
+            )
+        if not materials:
+            result["health"] = "dead"
+            result["error"] = "В сессии нет ключа авторизации"
+            progress.update(
+                task_id,
+                description=f"[red]✗ {file_path.name} - нет ключа[/red]",
+            )
+            return result
+
+        accounts = await asyncio.gather(
+            *(check_account(material, options, result) for material in materials)
+        )
+        result["health"] = merge_health(accounts)
+        if len(accounts) > 1:
+            result["accounts"] = [
+                {key: value for key, value in account.items() if key != "account_info"}
+                for account in accounts
+            ]
+        alive = [account for account in accounts if account["health"] == "alive"]
+        if alive:
+            result["account_info"] = alive[0].get("account_info")
+        if result["health"] == "alive":
+            result["status"] = "success"
+            progress.update(
+                task_id,
+                description=f"[green]✓ Жива: {file_path.name}[/green]",
+            )
+        else:
+            result["error"] = next(
+                account["error"] for account in accounts if account["health"] != "alive"
+            )
+            state = "не авторизована" if result["health"] == "dead" else "неизвестно"
+            progress.update(
+                task_id,
+                description=f"[red]✗ {file_path.name} - {state}[/red]",
+            )
+        return result
+
+    except Exception as e:
+        record_error(result, e)
+        progress.update(
+            task_id,
+            description=f"[red]✗ Проверка: ошибка {file_path.name}[/red]",
+        )
+        return result
+
+
+# -----------------------------------------------------------------------------
+# Вывод результатов
+# -----------------------------------------------------------------------------
+
+def format_count(value: Optional[int]) -> str:
+    return "-" if value is None else str(value)
+
+
+def print_account_table(results: List[Dict]) -> None:
+    from rich import box
+    from rich.table import Table
+
+    table = Table(
+        title="📊 Результаты конвертации",
+        box=box.ROUNDED,
+        show_header=True,
+        header_style="bold magenta",
+    )
+    table.add_column("№", style="cyan", width=4, justify="center")
+    table.add_column("Тип", style="yellow", width=12)
+    table.add_column("Имя", style="green", width=25)
+    table.add_column("Username", style="yellow", width=20)
+    table.add_column("Телефон", style="blue", width=15)
+    table.add_column("User ID", style="cyan", width=12)
+    table.add_column("Чаты", style="magenta", width=8, justify="center")
+    table.add_column("Контакты", style="magenta", width=10, justify="center")
+    table.add_column("Статус", style="bold", width=12, justify="center")
+    table.add_column("Результат", style="dim", width=30)
+
+    for idx, result in enumerate(results, 1):
+        conversion_type = f"{result.get('input_type', '?')} → {result.get('output_type', '?')}"
+        if result["status"] == "success" and result["account_info"]:
+            info = result["account_info"]
+            status_style = "[green]✓ Успешно[/green]"
+            name = info["name"]
+            username = info["username_display"]
+            phone = info["phone"]
+            user_id = str(info["user_id"])
+            chats = format_count(info.get("chats_count"))
+            contacts = format_count(info.get("contacts_count"))
+            if result.get("output_folder"):
+                output = Path(result["output_folder"]).name
+            elif result.get("output_file"):
+                output = Path(result["output_file"]).name
+            elif result.get("output_archive"):
+                output = f"{Path(result['output_archive']).name}:{result['archive_entry']}"
+            else:
+                output = "-"
+            if result.get("accounts"):
+                output = f"{output} (+{len(result['accounts']) - 1})"
+        elif result["status"] == "skipped":
+            status_style = "[yellow]⊘ Пропущено[/yellow]"
+            name = Path(result["input_file"]).stem
+            username = "-"
+            phone = "-"
+            user_id = "-"
+            chats = "-"
+            contacts = "-"
+            output = "-"
+            if result.get("error"):
+                name = (
+                    f"{name}\n[dim yellow]{result['error'][:30]}...[/dim yellow]"
+                )
+        else:
+            status_style = "[red]✗ Ошибка[/red]"
+            name = Path(result["input_file"]).stem
+            username = "-"
+            phone = "-"
+            user_id = "-"
+            chats = "-"
+            contacts = "-"
+            output = "-"
+            if result.get("error"):
+                name = (
+                    f"{name}\n[dim red]{result['error'][:30]}...[/dim red]"
+                )
+        table.add_row(
+            str(idx),
+            conversion_type,
+            name,
+            username,
+            phone,
+            user_id,
+            chats,
+            contacts,
+            status_style,
+            output,
+        )
+
+    console.print("\n")
+    console.print(table)
+
+
+STATUS_COUNTERS = {
+    "success": "successful",
+    "error": "failed",
+    "skipped": "skipped",
+}
+
+
+def make_summary() -> Dict:
+    return {
+        "conversion_date": datetime.now().isoformat(),
+        "total_sessions": 0,
+        "successful": 0,
+        "failed": 0,
+        "skipped": 0,
+    }
+
+
+def count_result(summary: Dict, result: Dict) -> None:
+    summary["total_sessions"] += 1
+    counter = STATUS_COUNTERS.get(result.get("status"))
+    if counter:
+        summary[counter] += 1
+    health = result.get("health")
+    if health:
+        counts = summary.setdefault("health", {})
+        counts[health] = counts.get(health, 0) + 1
+
+
+def write_results_json(
+    results: Iterable[Dict], summary: Dict, output_path: Path
+) -> None:
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("{\n")
+        for key in ("conversion_date", "total_sessions", "successful", "failed"):
+            f.write(f"  {json.dumps(key)}: {json.dumps(summary[key])},\n")
+        f.write('  "results": [')
+        empty = True
+        for result in results:
+            f.write("\n" if empty else ",\n")
+            f.write(
+                textwrap.indent(
+                    json.dumps(result, ensure_ascii=False, indent=2), "    "
+                )
+            )
+            empty = False
+        f.write("]\n}" if empty else "\n  ]\n}")
+
+
+def save_results_to_json(results: List[Dict]) -> None:
+    summary = make_summary()
+    for result in results:
+        count_result(summary, result)
+    write_results_json(results, summary, Path(RESULTS_FILE))
+    console.print(f"\n[green]✓ Результаты сохранены в {RESULTS_FILE}[/green]")
+
+
+def read_results_jsonl(path: str) -> Iterator[Dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def iter_results_jsonl(
+    path: str = RESULTS_JSONL_FILE, run: str = RESULTS_RUN
+) -> Iterator[Dict]:
+    # Запуски дописываются в один файл, каждая строка помечена run_id.
+    # last — последний запуск, all — все, иначе run_id нужного запуска.
+    if run == "last":
+        run = None
+        for result in read_results_jsonl(path):
+            run = result.get("run_id")
+    for result in read_results_jsonl(path):
+        if run == "all" or result.get("run_id") == run:
+            yield result
+
+
+def export_results_json(
+    results_path: str = RESULTS_JSONL_FILE,
+    output_path: str = RESULTS_FILE,
+    run: str = RESULTS_RUN,
+) -> None:
+    summary = make_summary()
+    for result in iter_results_jsonl(results_path, run):
+        count_result(summary, result)
+    write_results_json(
+        iter_results_jsonl(results_path, run), summary, Path(output_path)
+    )
+
+
+REPORT_COLUMNS = (
+    "input_file",
+    "input_type",
+    "output_type",
+    "status",
+    "name",
+    "username",
+    "phone",
+    "user_id",
+    "chats_count",
+    "contacts_count",
+    "accounts",
+    "output",
+    "duplicate_of",
+    "error",
+    "total_ms",
+)
+
+
+def result_output(result: Dict) -> str:
+    if result.get("output_archive"):
+        return f"{result['output_archive']}:{result.get('archive_entry', '')}"
+    return result.get("output_folder") or result.get("output_file") or ""
+
+
+def result_row(result: Dict) -> Dict:
+    info = result.get("account_info") or {}
+    return {
+        "input_file": result.get("input_file", ""),
+        "input_type": result.get("input_type", ""),
+        "output_type": result.get("output_type", ""),
+        "status": result.get("status", ""),
+        "name": info.get("name", ""),
+        "username": info.get("username") or "",
+        "phone": info.get("phone") or "",
+        "user_id": info.get("user_id", ""),
+        "chats_count": format_count(info.get("chats_count")) if info else "",
+        "contacts_count": format_count(info.get("contacts_count")) if info else "",
+        "accounts": len(result.get("accounts") or []) or "",
+        "output": result_output(result),
+        "duplicate_of": result.get("duplicate_of") or "",
+        "error": result.get("error") or "",
+        "total_ms": (result.get("timings") or {}).get("total", ""),
+    }
+
+
+def export_results_csv(
+    results_path: str = RESULTS_JSONL_FILE,
+    output_path: str = RESULTS_CSV_FILE,
+    run: str = RESULTS_RUN,
+) -> None:
+    with open(output_path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        for result in iter_results_jsonl(results_path, run):
+            writer.writerow(result_row(result))
+
+
+def export_results_html(
+    results_path: str = RESULTS_JSONL_FILE,
+    output_path: str = RESULTS_HTML_FILE,
+    run: str = RESULTS_RUN,
+) -> None:
+    summary = summarize_results(iter_results_jsonl(results_path, run))
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(
+            "<!DOCTYPE html>\n<html lang=\"ru\">\n<head>\n<meta charset=\"utf-8\">\n"
+            "<title>Результаты конвертации</title>\n<style>\n"
+            "body{font-family:sans-serif;margin:1em}"
+            "table{border-collapse:collapse;font-size:13px}"
+            "th,td{border:1px solid #ccc;padding:2px 6px;text-align:left}"
+            "th{background:#eee;position:sticky;top:0}"
+            ".success{color:#080}.error{color:#c00}.skipped{color:#a60}\n"
+            "</style>\n</head>\n<body>\n"
+        )
+        f.write(
+            f"<h1>Результаты конвертации</h1>\n<p>Всего: {summary['total']}, "
+            f"успешно: {summary['by_status'].get('success', 0)}, "
+            f"ошибок: {summary['by_status'].get('error', 0)}, "
+            f"пропущено: {summary['by_status'].get('skipped', 0)}</p>\n"
+        )
+        f.write("<table>\n<tr>")
+        f.write("".join(f"<th>{html.escape(column)}</th>" for column in REPORT_COLUMNS))
+        f.write("</tr>\n")
+        for result in iter_results_jsonl(results_path, run):
+            row = result_row(result)
+            f.write(f"<tr class=\"{html.escape(str(row['status']))}\">")
+            f.write(
+                "".join(
+                    f"<td>{html.escape(str(row[column]))}</td>"
+                    for column in REPORT_COLUMNS
+                )
+            )
+            f.write("</tr>\n")
+        f.write("</table>\n</body>\n</html>\n")
+
+
+def summarize_results(results: Iterable[Dict]) -> Dict:
+    by_status: Dict[str, int] = collections.Counter()
+    by_type: Dict[str, Dict[str, int]] = collections.defaultdict(collections.Counter)
+    errors: Dict[str, int] = collections.Counter()
+    durations: List[float] = []
+    total = 0
+    for result in results:
+        total += 1
+        status = result.get("status", "?")
+        by_status[status] += 1
+        by_type[f"{result.get('input_type', '?')} → {result.get('output_type', '?')}"][status] += 1
+        if status == "error" and result.get("error"):
+            errors[str(result["error"])[:120]] += 1
+        total_ms = (result.get("timings") or {}).get("total")
+        if total_ms is not None:
+            durations.append(total_ms)
+    durations.sort()
+    return {
+        "total": total,
+        "by_status": dict(by_status),
+        "by_type": {key: dict(value) for key, value in by_type.items()},
+        "top_errors": errors.most_common(REPORT_TOP_ERRORS),
+        "p50_ms": durations[len(durations) // 2] if durations else None,
+        "p99_ms": durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+        if durations
+        else None,
+    }
+
+
+def print_summary_report(summary: Dict) -> None:
+    from rich import box
+    from rich.table import Table
+
+    table = Table(
+        title=f"📊 Сводка: {summary['total']} результатов",
+        box=box.ROUNDED,
+        header_style="bold magenta",
+    )
+    table.add_column("Конвертация", style="yellow")
+    table.add_column("✓ Успешно", style="green", justify="right")
+    table.add_column("✗ Ошибка", style="red", justify="right")
+    table.add_column("⊘ Пропущено", style="yellow", justify="right")
+    for conversion_type, counts in sorted(summary["by_type"].items()):
+        table.add_row(
+            conversion_type,
+            str(counts.get("success", 0)),
+            str(counts.get("error", 0)),
+            str(counts.get("skipped", 0)),
+        )
+    console.print("\n")
+    console.print(table)
+    if summary["p50_ms"] is not None:
+        console.print(
+            f"[dim]Время на сессию: p50 {summary['p50_ms']:.0f} мс, "
+            f"p99 {summary['p99_ms']:.0f} мс[/dim]"
+        )
+    if summary["top_errors"]:
+        errors = Table(title="Частые ошибки", box=box.SIMPLE, header_style="bold red")
+        errors.add_column("Кол-во", justify="right", style="red")
+        errors.add_column("Ошибка")
+        for error, count in summary["top_errors"]:
+            errors.add_row(str(count), error)
+        console.print(errors)
+
+
+def print_results_report(results: List[Dict]) -> None:
+    from rich.prompt import Confirm
+
+    if len(results) <= REPORT_TABLE_LIMIT:
+        print_account_table(results)
+        return
+    print_summary_report(summarize_results(results))
+    if Confirm.ask(
+        f"[cyan]Показать полную таблицу ({len(results)} строк) постранично?[/cyan]",
+        default=False,
+    ):
+        with console.pager(styles=True):
+            print_account_table(results)
+
+
+class ResultSink:
+    def __init__(
+        self,
+        path: str = RESULTS_JSONL_FILE,
+        summary_path: str = SUMMARY_FILE,
+        flush_every: int = RESULTS_FLUSH_EVERY,
+    ) -> None:
+        self.path = Path(path)
+        self.summary_path = Path(summary_path)
+        self.flush_every = flush_every
+        self.summary = make_summary()
+        self.buffer: List[str] = []
+        self.last_flush = time.monotonic()
+        self.outputs: Set[str] = set()
+        # Файл только дописывается: результаты прерванного запуска остаются
+        # рядом с результатами следующего и различаются по run_id.
+        self.run_id = uuid.uuid4().hex[:12]
+        self.summary["run_id"] = self.run_id
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, result: Dict) -> None:
+        if result.get("output_file"):
+            self.outputs.add(result["output_file"])
+        self.buffer.append(
+            json.dumps({**result, "run_id": self.run_id}, ensure_ascii=False)
+        )
+        count_result(self.summary, result)
+        if (
+            len(self.buffer) >= self.flush_every
+            or time.monotonic() - self.last_flush >= RESULTS_FLUSH_INTERVAL
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffer:
+            self.file.write("\n".join(self.buffer) + "\n")
+            self.buffer.clear()
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+        summary = dict(
+            self.summary,
+            finished=datetime.now().isoformat(),
+            results_file=str(self.path),
+        )
+        with open(self.summary_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+# -----------------------------------------------------------------------------
+# Планировщик по DC
+# -----------------------------------------------------------------------------
+
+class DcBudget:
+    def __init__(
+        self, limit: float, max_limit: int, rate: float, adaptive: bool = True
+    ) -> None:
+        self.limit = limit
+        self.max_limit = max_limit
+        self.rate = rate
+        self.adaptive = adaptive
+        self.tokens = max(1.0, rate)
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.flood_waits = 0
+        self.error_rate = 0.0
+        self.queued = 0
+        # Отдельная очередь на каждый тип входа: упёршийся в свой лимит тип
+        # не задерживает остальные.
+        self.items: Dict[str, collections.deque] = {}
+
+    def refill(self, now: float) -> None:
+        if self.rate > 0:
+            self.tokens = min(
+                max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate
+            )
+        self.updated = now
+
+    def ready_type(self, blocked: Set[str]) -> Optional[str]:
+        for file_type, items in self.items.items():
+            if items and file_type not in blocked:
+                return file_type
+        return None
+
+    def append(self, item: Tuple) -> None:
+        self.items.setdefault(item[1], collections.deque()).append(item)
+        self.queued += 1
+
+    def next_start(self, now: float, blocked: Set[str]) -> Optional[float]:
+        if self.in_flight >= int(self.limit) or self.ready_type(blocked) is None:
+            return None
+        self.refill(now)
+        start = max(now, self.blocked_until)
+        if self.rate > 0 and self.tokens < 1:
+            start = max(start, now + (1 - self.tokens) / self.rate)
+        return start
+
+    def take(self, blocked: Set[str]) -> Tuple:
+        file_type = self.ready_type(blocked)
+        self.in_flight += 1
+        self.queued -= 1
+        if self.rate > 0:
+            self.tokens -= 1
+        # Тип уходит в конец порядка обхода, чтобы типы чередовались.
+        items = self.items.pop(file_type)
+        self.items[file_type] = items
+        return items.popleft()
+
+    def on_success(self) -> None:
+        self.error_rate -= self.error_rate / DC_ERROR_WINDOW
+        if self.adaptive:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_error(self) -> None:
+        # Сетевые ошибки и таймауты тоже признак перегрузки DC, но одиночные
+        # случаются всегда, поэтому лимит снижается только по их доле.
+        self.error_rate += (1 - self.error_rate) / DC_ERROR_WINDOW
+        if self.adaptive and self.error_rate > DC_ERROR_RATE:
+            self.limit = max(DC_MIN_CONCURRENCY, self.limit * DC_DECREASE)
+            self.error_rate = 0.0
+
+    def on_flood_wait(self, seconds: int) -> None:
+        self.flood_waits += 1
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        if self.adaptive:
+            self.limit = max(DC_MIN_CONCURRENCY, self.limit * DC_DECREASE)
+
+
+class DcScheduler:
+    def __init__(
+        self,
+        concurrency: int,
+        dc_concurrency: Optional[int] = None,
+        dc_rate: Optional[float] = None,
+        adaptive: bool = True,
+        buffer: int = QUEUE_SIZE,
+        type_limits: Optional[Dict[str, int]] = None,
+    ) -> None:
+        self.max_limit = max(1, concurrency)
+        initial = DC_CONCURRENCY if dc_concurrency is None else dc_concurrency
+        self.initial_limit = min(self.max_limit, initial) if initial > 0 else self.max_limit
+        self.rate = DC_RATE if dc_rate is None else dc_rate
+        self.adaptive = adaptive
+        self.budgets: Dict[int, DcBudget] = {}
+        self.space = asyncio.Semaphore(max(1, buffer))
+        self.changed = asyncio.Condition()
+        self.closed = False
+        self.in_flight = 0
+        self.type_limits = type_limits or {}
+        self.type_in_flight: Dict[str, int] = collections.Counter()
+
+    def blocked_types(self) -> Set[str]:
+        return {
+            file_type
+            for file_type, limit in self.type_limits.items()
+            if self.type_in_flight[file_type] >= limit
+        }
+
+    def budget(self, dc_id: int) -> DcBudget:
+        budget = self.budgets.get(dc_id)
+        if budget is None:
+            limit = self.initial_limit if self.adaptive else self.max_limit
+            budget = self.budgets[dc_id] = DcBudget(
+                limit, self.max_limit, self.rate, self.adaptive
+            )
+        return budget
+
+    async def put(self, dc_id: int, item: Tuple) -> None:
+        await self.space.acquire()
+        async with self.changed:
+            self.budget(dc_id).append(item)
+            self.changed.notify_all()
+
+    async def close(self) -> None:
+        async with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    async def get(self) -> Optional[Tuple[int, Tuple]]:
+        async with self.changed:
+            while True:
+                now = time.monotonic()
+                wake = None
+                blocked = self.blocked_types()
+                for dc_id, budget in self.budgets.items():
+                    start = budget.next_start(now, blocked)
+                    if start is None:
+                        continue
+                    if start <= now:
+                        item = budget.take(blocked)
+                        self.in_flight += 1
+                        self.type_in_flight[item[1]] += 1
+                        if not item[2]:
+                            self.space.release()
+                        return dc_id, item
+                    wake = start if wake is None else min(wake, start)
+
+                if (
+                    self.closed
+                    and self.in_flight == 0
+                    and not any(budget.queued for budget in self.budgets.values())
+                ):
+                    self.changed.notify_all()
+                    return None
+
+                try:
+                    await asyncio.wait_for(
+                        self.changed.wait(), None if wake is None else wake - now
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(
+        self,
+        dc_id: int,
+        file_type: str,
+        flood_wait: Optional[int] = None,
+        requeue: Optional[Tuple] = None,
+        transient_error: bool = False,
+    ) -> None:
+        async with self.changed:
+            budget = self.budgets[dc_id]
+            budget.in_flight -= 1
+            self.in_flight -= 1
+            self.type_in_flight[file_type] -= 1
+            if flood_wait is not None:
+                budget.on_flood_wait(flood_wait)
+            elif transient_error:
+                budget.on_error()
+            else:
+                budget.on_success()
+            if requeue is not None:
+                budget.append(requeue)
+            self.changed.notify_all()
+
+    def stats(self) -> Dict[int, Dict]:
+        return {
+            dc_id: {
+                "limit": round(budget.limit, 2),
+                "flood_waits": budget.flood_waits,
+            }
+            for dc_id, budget in sorted(self.budgets.items())
+        }
+
+
+# -----------------------------------------------------------------------------
+# Поиск дубликатов
+# -----------------------------------------------------------------------------
+
+def input_mtime_ns(path: Path) -> int:
+    return input_stat(path)[1]
+
+
+async def input_fingerprint(
+    file_path: Path, file_type: str, passcode: Optional[str] = None
+) -> Optional[Tuple[str, ...]]:
+    try:
+        materials = await read_input_materials(file_path, file_type, passcode)
+    except Exception:
+        return None
+    if not materials:
+        return None
+    return tuple(
+        sorted(
+            auth_key_fingerprint(material["auth_key"], material["dc_id"])
+            for material in materials
+        )
+    )
+
+
+async def choose_duplicate_winner(
+    group: List[Tuple[Path, str]], policy: str
+) -> Tuple[Path, str]:
+    group = sorted(group, key=lambda item: str(item[0]))
+    if policy == "prefer-session":
+        return min(group, key=lambda item: item[1] == "tdata")
+    if policy == "prefer-tdata":
+        return min(group, key=lambda item: item[1] != "tdata")
+    if policy in ("newest", "oldest"):
+        mtimes = await asyncio.gather(
+            *(asyncio.to_thread(input_mtime_ns, path) for path, _ in group)
+        )
+        ordered = sorted(zip(mtimes, range(len(group))))
+        index = ordered[-1][1] if policy == "newest" else ordered[0][1]
+        return group[index]
+    return group[0]
+
+
+async def dedupe_inputs(
+    input_files: Union[Iterable[Tuple[Path, str]], AsyncIterable[Tuple[Path, str]]],
+    policy: str = DEDUPE_POLICY,
+    concurrency: Optional[int] = None,
+    passcode: Optional[str] = None,
+) -> Tuple[List[Tuple[Path, str]], Dict[str, List[Tuple[Path, str]]]]:
+    limit = asyncio.Semaphore(max(1, concurrency or MAX_CONCURRENCY))
+    groups: Dict[Tuple[str, ...], List[Tuple[Path, str]]] = {}
+    unique: List[Tuple[Path, str]] = []
+
+    async def fingerprint_one(file_path: Path, file_type: str) -> None:
+        async with limit:
+            fingerprint = await input_fingerprint(file_path, file_type, passcode)
+        if fingerprint is None:
+            unique.append((file_path, file_type))
+        else:
+            groups.setdefault(fingerprint, []).append((file_path, file_type))
+
+    await asyncio.gather(
+        *[
+            fingerprint_one(file_path, file_type)
+            async for file_path, file_type in iterate_inputs(input_files)
+        ]
+    )
+
+    duplicates: Dict[str, List[Tuple[Path, str]]] = {}
+    for group in groups.values():
+        winner = await choose_duplicate_winner(group, policy)
+        unique.append(winner)
+        losers = [item for item in group if item != winner]
+        if losers:
+            duplicates[str(winner[0])] = sorted(losers, key=lambda item: str(item[0]))
+    unique.sort(key=lambda item: str(item[0]))
+    return unique, duplicates
+
+
+def make_duplicate_result(file_path: Path, file_type: str, original: Dict) -> Dict:
+    result = {
+        "input_file": str(file_path),
+        "input_type": file_type,
+        "output_type": original.get("output_type"),
+        "session_name": file_path.name,
+        "status": "skipped",
+        "account_info": original.get("account_info"),
+        "error": f"Дубликат {original['input_file']}",
+        "duplicate_of": original["input_file"],
+        "timestamp": datetime.now().isoformat(),
+    }
+    for key in ("output_folder", "output_file", "output_archive", "archive_entry"):
+        if original.get(key):
+            result[key] = original[key]
+    return result
+
+
+# -----------------------------------------------------------------------------
+# Разбиение на шарды
+# -----------------------------------------------------------------------------
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"шард задаётся как i/n, например 1/4: {value}"
+        ) from None
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"номер шарда должен быть от 1 до n: {value}")
+    return index, count
+
+
+def format_shard(shard: Tuple[int, int]) -> str:
+    return f"{shard[0]}/{shard[1]}"
+
+
+def shard_file_path(path: str, shard: Tuple[int, int]) -> str:
+    path = Path(path)
+    return str(path.with_name(f"{path.stem}.shard-{shard[0]}-of-{shard[1]}{path.suffix}"))
+
+
+def shard_of(key: str, count: int) -> int:
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+
+def shard_path_key(file_path: Path) -> str:
+    try:
+        return Path(file_path).relative_to(SESSIONS_DIR).as_posix()
+    except ValueError:
+        return Path(file_path).as_posix()
+
+
+async def select_shard(
+    input_files: Union[Iterable[Tuple[Path, str]], AsyncIterable[Tuple[Path, str]]],
+    shard: Tuple[int, int],
+    key: str = SHARD_KEY,
+    concurrency: Optional[int] = None,
+    passcode: Optional[str] = None,
+) -> AsyncIterator[Tuple[Path, str]]:
+    index, count = shard
+    if key == "path":
+        async for file_path, file_type in iterate_inputs(input_files):
+            if shard_of(shard_path_key(file_path), count) == index:
+                yield file_path, file_type
+        return
+
+    limit = asyncio.Semaphore(max(1, concurrency or MAX_CONCURRENCY))
+
+    async def shard_key(file_path: Path, file_type: str) -> str:
+        async with limit:
+            fingerprint = await input_fingerprint(file_path, file_type, passcode)
+        return fingerprint[0] if fingerprint else shard_path_key(file_path)
+
+    items = [item async for item in iterate_inputs(input_files)]
+    keys = await asyncio.gather(*(shard_key(*item) for item in items))
+    for item, item_key in zip(items, keys):
+        if shard_of(item_key, count) == index:
+            yield item
+
+
+def merge_results(
+    inputs: List[str],
+    results_path: str = RESULTS_JSONL_FILE,
+    summary_path: str = SUMMARY_FILE,
+) -> Dict:
+    sink = ResultSink(results_path, summary_path)
+    seen = set()
+    repeated = 0
+    try:
+        for path in inputs:
+            for result in iter_results_jsonl(path):
+                input_file = result.get("input_file")
+                if input_file in seen:
+                    repeated += 1
+                    continue
+                seen.add(input_file)
+                sink.write(result)
+        sink.summary["merged_from"] = list(inputs)
+        sink.summary["repeated"] = repeated
+    finally:
+        sink.close()
+    return sink.summary
+
+
+# -----------------------------------------------------------------------------
+# Режим наблюдения
+# -----------------------------------------------------------------------------
+
+async def watch_triggers(
+    path: str, poll_interval: float
+) -> AsyncIterator[Optional[Set[str]]]:
+    # Отдаёт изменившиеся пути или None, когда известно только, что пора
+    # пересканировать всю папку (без watchfiles).
+    try:
+        from watchfiles import awatch
+    except ImportError:
+        while True:
+            await asyncio.sleep(poll_interval)
+            yield None
+
+    async for changes in awatch(path, debounce=int(poll_interval * 1000), recursive=True):
+        yield {changed for _, changed in changes}
+
+
+def watch_input_path(changed: str) -> Optional[Path]:
+    # Путь из события → входной файл или папка tdata, к которым он относится.
+    root = Path(SESSIONS_DIR).resolve()
+    try:
+        relative = Path(changed).resolve().relative_to(root)
+    except ValueError:
+        return None
+    path = Path(SESSIONS_DIR) / relative
+    for parent in [path, *path.parents]:
+        if parent == Path(SESSIONS_DIR):
+            break
+        if parent.is_dir() and detect_session_type(parent) == "tdata":
+            return parent
+    if path.suffix == ".session" or not path.exists():
+        # Удалённый путь может быть ранее найденной папкой tdata.
+        return path
+    return None
+
+
+def watch_candidates(changed: Set[str]) -> Dict[str, Optional[str]]:
+    candidates: Dict[str, Optional[str]] = {}
+    for path in filter(None, map(watch_input_path, changed)):
+        if str(path) not in candidates:
+            candidates[str(path)] = (
+                detect_session_type(path) if path.exists() else None
+            )
+    return candidates
+
+
+def manifest_outputs() -> Set[str]:
+    rows = open_manifest().execute(
+        "SELECT output FROM manifest WHERE input_type = 'tdata' AND output IS NOT NULL"
+    )
+    return {row[0] for row in rows}
+
+
+async def watch_inputs(
+    file_type: Optional[str] = None,
+    poll_interval: float = WATCH_POLL_INTERVAL,
+    debounce: float = WATCH_DEBOUNCE,
+    stop: Optional[asyncio.Event] = None,
+    outputs: Optional[Set[str]] = None,
+) -> AsyncIterator[Tuple[Path, str]]:
+    # outputs — файлы сессий, которые записал сам конвертер (tdata → Telethon
+    # пишет в ту же папку); входами они не считаются.
+    stop = stop or asyncio.Event()
+    outputs = outputs if outputs is not None else set()
+    seen: Dict[str, Tuple[int, int]] = {}
+    pending: Dict[str, Tuple[Tuple[int, int], float, str]] = {}
+    changed: Set[str] = set()
+    rescan = True
+    triggers = watch_triggers(SESSIONS_DIR, poll_interval)
+    wake = asyncio.Event()
+    wake.set()
+
+    async def listen() -> None:
+        nonlocal rescan
+        async for paths in triggers:
+            if paths is None:
+                rescan = True
+            else:
+                changed.update(paths)
+            wake.set()
+
+    async def candidates() -> Dict[str, Optional[str]]:
+        nonlocal rescan
+        if rescan:
+            rescan = False
+            changed.clear()
+            found: Dict[str, Optional[str]] = dict.fromkeys([*seen, *pending])
+            async for file_path, session_type in iter_input_files(file_type):
+                found[str(file_path)] = session_type
+            return found
+        paths = set(changed)
+        changed.clear()
+        found = await asyncio.to_thread(watch_candidates, paths)
+        for key, (_, _, session_type) in pending.items():
+            found.setdefault(key, session_type)
+        return found
+
+    listener = asyncio.create_task(listen())
+    try:
+        while not stop.is_set():
+            timeout = debounce if pending else None
+            waiters = [asyncio.ensure_future(wake.wait()), asyncio.ensure_future(stop.wait())]
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in waiters:
+                waiter.cancel()
+            if stop.is_set():
+                break
+            wake.clear()
+
+            now = time.monotonic()
+            for key, session_type in (await candidates()).items():
+                if (
+                    session_type in (None, "unknown")
+                    or file_type not in (None, session_type)
+                    or key in outputs
+                ):
+                    seen.pop(key, None)
+                    pending.pop(key, None)
+                    continue
+                try:
+                    signature = await asyncio.to_thread(input_stat, Path(key))
+                except OSError:
+                    seen.pop(key, None)
+                    pending.pop(key, None)
+                    continue
+                if seen.get(key) == signature:
+                    pending.pop(key, None)
+                    continue
+                previous = pending.get(key)
+                if previous is None or previous[0] != signature:
+                    pending[key] = (signature, now, session_type)
+                elif now - previous[1] >= debounce:
+                    del pending[key]
+                    seen[key] = signature
+                    yield Path(key), session_type
+    finally:
+        listener.cancel()
+
+
+async def watch_conversion(
+    mode: str,
+    options: ConversionOptions,
+    sink: ResultSink,
+    concurrency: Optional[int] = None,
+    show_progress: bool = True,
+    poll_interval: float = WATCH_POLL_INTERVAL,
+    debounce: float = WATCH_DEBOUNCE,
+) -> None:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+    except (NotImplementedError, AttributeError):
+        pass
+    try:
+        await loop.run_in_executor(None, warm_cpu_pool)
+    except Exception as e:
+        console.print(f"[yellow]⚠ Не удалось заранее запустить пул процессов: {e}[/yellow]")
+    console.print(
+        f"[cyan]👀 Наблюдение за {SESSIONS_DIR}, остановка — Ctrl+C или SIGTERM[/cyan]"
+    )
+    if options.use_manifest:
+        sink.outputs.update(manifest_outputs())
+    await run_conversion_cycle(
+        watch_inputs(
+            None if mode == "auto" else mode, poll_interval, debounce, stop, sink.outputs
+        ),
+        mode,
+        options,
+        sink=sink,
+        concurrency=concurrency,
+        keep_results=False,
+        show_progress=show_progress,
+    )
+
+
+# -----------------------------------------------------------------------------
+# Локальный сервис конвертации
+# -----------------------------------------------------------------------------
+
+HTTP_REASONS = {
+    200: "OK",
+    202: "Accepted",
+    204: "No Content",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+class ServiceError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def extract_tdata_upload(data: bytes, target: Path) -> Path:
+    import io
+    import zipfile
+
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise ServiceError(400, "tdata загружается zip-архивом") from None
+    root = target.resolve()
+    with archive:
+        members = archive.infolist()
+        if len(members) > SERVICE_MAX_MEMBERS:
+            raise ServiceError(413, f"В архиве больше {SERVICE_MAX_MEMBERS} файлов")
+        # zipfile не распакует больше заявленного file_size, так что суммы
+        # по заголовкам достаточно против zip-бомб.
+        if sum(member.file_size for member in members) > SERVICE_MAX_EXTRACTED:
+            raise ServiceError(413, f"Распакованный архив больше {SERVICE_MAX_EXTRACTED} байт")
+        for member in members:
+            destination = (target / member.filename).resolve()
+            if not destination.is_relative_to(root):
+                raise ServiceError(400, f"Недопустимый путь в архиве: {member.filename}")
+        archive.extractall(target)
+    if (target / "tdata").is_dir():
+        return target / "tdata"
+    return target
+
+
+def job_output_paths(result: Dict) -> List[Path]:
+    paths = []
+    for item in [result] + list(result.get("accounts") or []):
+        for key in ("output_folder", "output_file", "output_archive"):
+            if item.get(key) and Path(item[key]) not in paths:
+                paths.append(Path(item[key]))
+    return [path for path in paths if path.exists()]
+
+
+def pack_job_outputs(paths: List[Path], output_path: Path) -> None:
+    import zipfile
+
+    with zipfile.ZipFile(
+        output_path, "w", zipfile.ZIP_DEFLATED, compresslevel=ARCHIVE_COMPRESSION
+    ) as archive:
+        for path in paths:
+            if path.is_dir():
+                for file in sorted(path.rglob("*")):
+                    if file.is_file():
+                        name = file.relative_to(path).as_posix()
+                        archive.write(file, f"{path.name}/{name}")
+            else:
+                archive.write(path, path.name)
+
+
+class ConversionService:
+    def __init__(
+        self,
+        workers: int = SERVICE_WORKERS,
+        queue_size: int = SERVICE_QUEUE_SIZE,
+        jobs_dir: str = SERVICE_DIR,
+        options: Optional[ConversionOptions] = None,
+        mode: str = "auto",
+        token: Optional[str] = None,
+    ) -> None:
+        import secrets
+
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.token = token or secrets.token_urlsafe(32)
+        self.queue_size = max(1, queue_size)
+        # Задачи идут через тот же планировщик по DC, что и convert: бюджеты
+        # DC общие для всех задач, а FloodWait откладывает задачу, а не роняет.
+        self.scheduler = DcScheduler(
+            self.workers, buffer=self.queue_size + self.workers
+        )
+        self.jobs_dir = Path(jobs_dir)
+        self.options = options or ConversionOptions(use_manifest=False)
+        if (
+            self.options.passcode_salt is None
+            and self.options.passcode_salt_policy == "batch"
+        ):
+            self.options = replace(
+                self.options, passcode_salt=os.urandom(PASSCODE_SALT_SIZE)
+            )
+        self.jobs: Dict[str, Dict] = {}
+        # Код-пароли задач не попадают в ответы /jobs
+        self.passcodes: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        self.running = 0
+        self.tasks: List[asyncio.Task] = []
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(
+        self,
+        host: str = SERVICE_HOST,
+        port: int = SERVICE_PORT,
+        unix_path: Optional[str] = None,
+    ) -> None:
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        # Пул процессов запускается до приёма соединений: процесс, порождённый
+        # fork посреди запроса, унаследовал бы сокет клиента и не дал бы
+        # соединению закрыться.
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, warm_cpu_pool)
+        except Exception as e:
+            console.print(f"[yellow]⚠ Не удалось заранее запустить пул процессов: {e}[/yellow]")
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        if unix_path:
+            self.server = await asyncio.start_unix_server(self.handle, unix_path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+
+    @property
+    def address(self) -> Any:
+        return self.server.sockets[0].getsockname()
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def submit(self, job: Dict) -> Dict:
+        self.evict()
+        queued = sum(1 for item in self.jobs.values() if item["status"] == "queued")
+        if queued >= self.queue_size:
+            self.passcodes.pop(job["id"], None)
+            shutil.rmtree(self.jobs_dir / job["id"], ignore_errors=True)
+            raise ServiceError(503, "Очередь заполнена, повторите позже")
+        self.jobs[job["id"]] = job
+        file_path = Path(job["input"])
+        if file_path.is_dir():
+            file_type = "tdata"
+        else:
+            file_type = await asyncio.to_thread(detect_session_type, file_path)
+        dc_id = (
+            0
+            if job["offline"]
+            else await asyncio.to_thread(session_dc_id, file_path, file_type)
+        )
+        await self.scheduler.put(dc_id, (job["id"], file_type, 0))
+        return job
+
+    def evict(self) -> None:
+        deadline = time.time() - SERVICE_JOB_TTL
+        for job_id, job in list(self.jobs.items()):
+            finished = job["finished"]
+            if job["status"] != "running" and finished and finished < deadline:
+                self.forget(job_id)
+
+    def forget(self, job_id: str) -> None:
+        job = self.jobs.pop(job_id)
+        self.passcodes.pop(job_id, None)
+        if job["status"] == "queued":
+            job["status"] = "cancelled"
+        shutil.rmtree(self.jobs_dir / job_id, ignore_errors=True)
+
+    async def worker(self) -> None:
+        while True:
+            entry = await self.scheduler.get()
+            if entry is None:
+                return
+            dc_id, (job_id, file_type, requeues) = entry
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != "queued":
+                await self.scheduler.release(dc_id, file_type)
+                continue
+            self.running += 1
+            job["status"] = "running"
+            job["started"] = job["started"] or time.time()
+            try:
+                result = await self.run_job(job, file_type)
+            except Exception as e:
+                result = {"status": "error", "error": str(e)}
+            finally:
+                self.running -= 1
+
+            flood_wait = result.get("flood_wait")
+            if (
+                flood_wait is not None
+                and flood_wait <= FLOOD_WAIT_MAX
+                and requeues < FLOOD_REQUEUE_LIMIT
+            ):
+                job["status"] = "queued"
+                await self.scheduler.release(
+                    dc_id, file_type, flood_wait, (job_id, file_type, requeues + 1)
+                )
+                continue
+
+            await self.scheduler.release(
+                dc_id,
+                file_type,
+                flood_wait,
+                transient_error=any(
+                    attempt.get("transient") for attempt in result.get("attempts", [])
+                ),
+            )
+            if requeues:
+                result["flood_requeues"] = requeues
+            self.passcodes.pop(job_id, None)
+            if "input_file" in result:
+                job["result"] = result
+            else:
+                job["error"] = result["error"]
+            job["status"] = "done" if result["status"] == "success" else "failed"
+            job["finished"] = time.time()
+
+    async def run_job(self, job: Dict, file_type: str) -> Dict:
+        # Код-пароль нужен и при повторе после FloodWait, поэтому он
+        # убирается из self.passcodes только по завершении задачи.
+        passcode, input_passcode = self.passcodes.get(job["id"], (None, None))
+        options = replace(
+            self.options,
+            info_level=job["info_level"],
+            offline=job["offline"],
+            passcode=passcode or self.options.passcode,
+            input_passcode=input_passcode or self.options.input_passcode,
+            output_dir=str(self.jobs_dir / job["id"] / "output"),
+        )
+        try:
+            return await convert_with_manifest(
+                Path(job["input"]), file_type, job["mode"], NullProgress(), 0, options
+            )
+        finally:
+            close_archive_writer(options.output_dir)
+
+    def create_job(
+        self, query: Dict[str, str], headers: Dict[str, str], body: bytes
+    ) -> Dict:
+        import base64
+
+        # Строка запроса попадает в журналы прокси и историю, код-пароли — нет.
+        if "passcode" in query or "input_passcode" in query:
+            raise ServiceError(400, "Код-пароль передаётся только в JSON-теле запроса")
+        json_body = headers.get("content-type", "").startswith("application/json")
+        if json_body:
+            try:
+                fields = json.loads(body or b"{}")
+            except ValueError:
+                raise ServiceError(400, "Тело запроса — некорректный JSON") from None
+            if not isinstance(fields, dict):
+                raise ServiceError(400, "Тело запроса должно быть объектом JSON")
+            query = dict(query, **fields)
+            body = b""
+        for key in SERVICE_STRING_FIELDS:
+            if query.get(key) is not None and not isinstance(query[key], str):
+                raise ServiceError(400, f"{key} должен быть строкой")
+        for key in ("passcode", "input_passcode"):
+            if query.get(key) and not query[key].isascii():
+                raise ServiceError(400, f"{key} должен состоять из ASCII-символов")
+        if not isinstance(query.get("offline", False), (bool, str)):
+            raise ServiceError(400, "offline должен быть true/false")
+        if json_body and query.get("data"):
+            try:
+                body = base64.b64decode(query["data"], validate=True)
+            except ValueError:
+                raise ServiceError(400, "data должно быть в base64") from None
+        direction = query.get("direction")
+        mode = SERVICE_DIRECTIONS.get(direction) if direction else self.mode
+        if mode is None:
+            raise ServiceError(
+                400, f"direction должен быть одним из: {', '.join(SERVICE_DIRECTIONS)}"
+            )
+        info_level = query.get("info_level", self.options.info_level)
+        if info_level not in INFO_LEVELS:
+            raise ServiceError(400, f"Неизвестный уровень информации: {info_level}")
+        offline = query.get("offline", self.options.offline)
+        if isinstance(offline, str):
+            offline = offline.lower() in ("1", "true", "yes")
+
+        job_id = uuid.uuid4().hex
+        if body:
+            job_dir = self.jobs_dir / job_id
+            job_dir.mkdir(parents=True)
+            if mode == "tdata" or (mode == "auto" and body[:2] == b"PK"):
+                try:
+                    file_path = extract_tdata_upload(body, job_dir / "input")
+                except ServiceError:
+                    shutil.rmtree(job_dir, ignore_errors=True)
+                    raise
+            else:
+                name = Path(query.get("name") or f"{job_id}.session").name
+                if not name.endswith(".session"):
+                    name += ".session"
+                file_path = job_dir / name
+                file_path.write_bytes(body)
+        elif query.get("path"):
+            root = Path(SESSIONS_DIR).resolve()
+            file_path = (root / query["path"]).resolve()
+            if not file_path.is_relative_to(root):
+                raise ServiceError(400, f"Путь должен быть внутри {SESSIONS_DIR}")
+            if not file_path.exists():
+                raise ServiceError(404, f"Нет такого файла: {query['path']}")
+        else:
+            raise ServiceError(400, "Нужен path или содержимое файла в теле запроса")
+
+        if query.get("passcode") or query.get("input_passcode"):
+            self.passcodes[job_id] = (
+                query.get("passcode"),
+                query.get("input_passcode"),
+            )
+        return {
+            "id": job_id,
+            "status": "queued",
+            "direction": direction or mode,
+            "mode": mode,
+            "info_level": info_level,
+            "offline": bool(offline),
+            "input": str(file_path),
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "result": None,
+            "error": None,
+        }
+
+    def job(self, job_id: str) -> Dict:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise ServiceError(404, f"Нет задачи {job_id}")
+        return job
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        from urllib.parse import parse_qsl, urlsplit
+
+        try:
+            try:
+                request_line = await reader.readline()
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode("latin-1").split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > SERVICE_MAX_UPLOAD:
+                    raise ServiceError(413, f"Больше {SERVICE_MAX_UPLOAD} байт")
+                body = await reader.readexactly(length) if length else b""
+            except (ValueError, asyncio.IncompleteReadError):
+                raise ServiceError(400, "Некорректный HTTP-запрос") from None
+            url = urlsplit(target)
+            await self.route(
+                method,
+                url.path.rstrip("/") or "/",
+                dict(parse_qsl(url.query)),
+                headers,
+                body,
+                writer,
+            )
+        except ServiceError as e:
+            extra = {"Retry-After": "1"} if e.status == 503 else {}
+            await self.respond(writer, e.status, {"error": str(e)}, extra)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def route(
+        self,
+        method: str,
+        path: str,
+        query: Dict[str, str],
+        headers: Dict[str, str],
+        body: bytes,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        import hmac
+
+        parts = path.strip("/").split("/")
+        authorization = headers.get("authorization", "")
+        if path != "/health" and not hmac.compare_digest(
+            authorization.encode(), f"Bearer {self.token}".encode()
+        ):
+            raise ServiceError(401, "Нужен заголовок Authorization: Bearer <токен>")
+        if path == "/health" and method == "GET":
+            await self.respond(writer, 200, {
+                "status": "ok",
+                "queued": sum(
+                    1 for job in self.jobs.values() if job["status"] == "queued"
+                ),
+                "running": self.running,
+                "workers": self.workers,
+                "jobs": len(self.jobs),
+            })
+        elif path == "/jobs" and method == "POST":
+            job = await self.submit(self.create_job(query, headers, body))
+            await self.respond(writer, 202, {"id": job["id"], "status": job["status"]})
+        elif path == "/jobs" and method == "GET":
+            await self.respond(writer, 200, {
+                "jobs": [
+                    {key: job[key] for key in ("id", "status", "direction", "created")}
+                    for job in self.jobs.values()
+                ]
+            })
+        elif len(parts) == 2 and parts[0] == "jobs" and method == "GET":
+            await self.respond(writer, 200, self.job(parts[1]))
+        elif len(parts) == 2 and parts[0] == "jobs" and method == "DELETE":
+            if self.job(parts[1])["status"] == "running":
+                raise ServiceError(409, "Задача выполняется, удалить её можно после завершения")
+            self.forget(parts[1])
+            await self.respond(writer, 204)
+        elif parts[0] == "jobs" and parts[2:] == ["result"] and method == "GET":
+            await self.send_result(writer, self.job(parts[1]))
+        elif parts[0] in ("health", "jobs"):
+            raise ServiceError(405, f"{method} не поддерживается для {path}")
+        else:
+            raise ServiceError(404, f"Нет такого адреса: {path}")
+
+    async def send_result(self, writer: asyncio.StreamWriter, job: Dict) -> None:
+        if job["status"] in ("queued", "running"):
+            raise ServiceError(409, f"Задача ещё не завершена: {job['status']}")
+        paths = job_output_paths(job["result"] or {})
+        if not paths:
+            raise ServiceError(404, "У задачи нет результата")
+        if len(paths) == 1 and paths[0].is_file():
+            await self.send_file(writer, paths[0], paths[0].name)
+            return
+        archive_path = self.jobs_dir / job["id"] / "result.zip"
+        archive_path.parent.mkdir(parents=True, exist_ok=True)
+        if not archive_path.exists():
+            await asyncio.to_thread(pack_job_outputs, paths, archive_path)
+        await self.send_file(writer, archive_path, f"{job['id']}.zip")
+
+    async def send_file(
+        self, writer: asyncio.StreamWriter, path: Path, name: str
+    ) -> None:
+        size = path.stat().st_size
+        await self.send_headers(writer, 200, "application/octet-stream", size, {
+            "Content-Disposition": f'attachment; filename="{name}"',
+        })
+        with open(path, "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, 1 << 16):
+                writer.write(chunk)
+                await writer.drain()
+
+    async def send_headers(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        content_type: str,
+        length: int,
+        extra: Optional[Dict[str, str]] = None,
+    ) -> None:
+        lines = [
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {length}",
+            "Connection: close",
+        ]
+        lines += [f"{name}: {value}" for name, value in (extra or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+    async def respond(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        payload: Optional[Dict] = None,
+        extra: Optional[Dict[str, str]] = None,
+    ) -> None:
+        body = b""
+        if payload is not None:
+            body = json.dumps(payload, ensure_ascii=False).encode()
+        await self.send_headers(
+            writer, status, "application/json; charset=utf-8", len(body), extra
+        )
+        writer.write(body)
+        await writer.drain()
+
+
+async def serve_conversions(
+    host: str = SERVICE_HOST,
+    port: int = SERVICE_PORT,
+    unix_path: Optional[str] = None,
+    workers: int = SERVICE_WORKERS,
+    queue_size: int = SERVICE_QUEUE_SIZE,
+    options: Optional[ConversionOptions] = None,
+    mode: str = "auto",
+    token: Optional[str] = None,
+) -> None:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+    except (NotImplementedError, AttributeError):
+        pass
+    service = ConversionService(
+        workers, queue_size, options=options, mode=mode, token=token
+    )
+    await service.start(host, port, unix_path)
+    if unix_path:
+        where = unix_path
+    else:
+        bound_host, bound_port = service.address[:2]
+        where = f"http://{bound_host}:{bound_port}"
+    console.print(f"[cyan]🌐 Сервис конвертации: {where}, остановка — Ctrl+C или SIGTERM[/cyan]")
+    if not token:
+        console.print(f"[cyan]🔑 Токен: {service.token}[/cyan]")
+    try:
+        await stop.wait()
+    finally:
+        await service.close()
+
+
+# -----------------------------------------------------------------------------
+# Меню и выбор режима
+# -----------------------------------------------------------------------------
+
+def show_menu() -> str:
+    from InquirerPy import inquirer
+    from rich.panel import Panel
+
+    console.print("\n")
+    console.print(
+        Panel.fit(
+            "[bold cyan]📋 Меню конвертации[/bold cyan]\n"
+            "[dim]↑↓ — навигация, Enter — выбор[/dim]",
+            border_style="cyan",
+        )
+    )
+    console.print()
+
+    choice = inquirer.select(
+        message="Выберите действие:",
+        choices=[
+            {"name": "Telethon → tdata — конвертировать Telethon сессии в tdata", "value": "1"},
+            {"name": "Pyrogram → tdata — конвертировать Pyrogram сессии в tdata", "value": "2"},
+            {"name": "tdata → Telethon — конвертировать tdata папки в Telethon сессии", "value": "3"},
+            {"name": "Автообработка — автоматически определить тип и конвертировать всё", "value": "4"},
+            {"name": "Выход", "value": "5"},
+        ],
+        default="4",
+        pointer="▶",
+    ).execute()
+
+    return choice
+
+
+def filter_files_by_type(
+    input_files: List[Tuple[Path, str]], file_type: str
+) -> List[Tuple[Path, str]]:
+    return [(path, ftype) for path, ftype in input_files if ftype == file_type]
+
+
+def make_skipped_result(
+    file_path: Path, file_type: str, output_type: str, reason: str
+) -> Dict:
+    return {
+        "input_file": str(file_path),
+        "input_type": file_type,
+        "output_type": output_type,
+        "status": "skipped",
+        "error": reason,
+        "timestamp": datetime.now().isoformat(),
+    }
+
+
+async def convert_input(
+    file_path: Path,
+    file_type: str,
+    mode: str,
+    progress: Progress,
+    task_id,
+    options: Optional[ConversionOptions] = None,
+) -> Dict:
+    if mode == "auto" or mode == file_type:
+        if options is not None and options.check_only and file_type in OUTPUT_TYPES:
+            return await check_input(file_path, file_type, progress, task_id, options)
+        if file_type == "telethon":
+            return await convert_telethon_to_tdata(
+                file_path, progress, task_id, options
+            )
+        if file_type == "pyrogram":
+            return await convert_pyrogram_to_tdata(
+                file_path, progress, task_id, options
+            )
+        if file_type == "tdata":
+            return await convert_tdata_to_telethon(
+                file_path, progress, task_id, options
+            )
+        return {
+            "input_file": str(file_path),
+            "input_type": "unknown",
+            "output_type": "unknown",
+            "status": "error",
+            "error": "Неизвестный тип файла",
+            "timestamp": datetime.now().isoformat(),
+        }
+    if mode == "telethon":
+        return make_skipped_result(
+            file_path, file_type, "tdata", "Пропущено (не Telethon)"
+        )
+    if mode == "pyrogram":
+        return make_skipped_result(
+            file_path, file_type, "tdata", "Пропущено (не Pyrogram)"
+        )
+    if mode == "tdata":
+        return make_skipped_result(
+            file_path, file_type, "telethon", "Пропущено (не tdata)"
+        )
+    return {
+        "input_file": str(file_path),
+        "input_type": file_type,
+        "output_type": "unknown",
+        "status": "error",
+        "error": "Неизвестный режим",
         "timestamp": datetime.now().isoformat(),
     }
 
+
+OUTPUT_TYPES = {"telethon": "tdata", "pyrogram": "tdata", "tdata": "telethon"}
+
+
+async def convert_with_retries(
+    file_path: Path,
+    file_type: str,
+    mode: str,
+    progress: Progress,
+    task_id,
+    options: Optional[ConversionOptions] = None,
+) -> Dict:
+    options = options or ConversionOptions()
+    attempts: List[Dict] = []
+    result = None
     try:
+        async with asyncio.timeout(options.session_timeout or None):
+            for attempt in range(1, max(0, options.retries) + 2):
+                if attempt > 1:
+                    progress.update(
+                        task_id,
+                        description=f"[yellow]↻ Повтор {attempt - 1}: {file_path.name}[/yellow]",
+                    )
+                    await asyncio.sleep(retry_delay(attempt - 1))
+                start = time.perf_counter()
+                result = await convert_input(
+                    file_path, file_type, mode, progress, task_id, options
+                )
+                retryable = result.pop("retryable", False)
+                record = {
+                    "attempt": attempt,
+                    "status": result["status"],
+                    "error": result.get("error"),
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                }
+                if retryable:
+                    record["transient"] = True
+                if "hedged" in result:
+                    record["hedged"] = result.pop("hedged")
+                attempts.append(record)
+                if not retryable:
+                    break
+    except TimeoutError:
+        error = f"Сессия не уложилась в {options.session_timeout:g} с"
+        attempts.append(
+            {
+                "attempt": len(attempts) + 1,
+                "status": "error",
+                "error": error,
+                "transient": True,
+            }
+        )
+        result = {
+            "input_file": str(file_path),
+            "input_type": file_type,
+            "output_type": OUTPUT_TYPES.get(file_type, "unknown"),
+            "session_name": file_path.name,
+            "status": "error",
+            "account_info": None,
+            "error": error,
+            "timestamp": datetime.now().isoformat(),
+            "timings": {},
+        }
         progress.update(
             task_id,
-            description=f"[cyan]tdata: загрузка {tdata_folder.name}...[/cyan]",
+            description=f"[red]✗ Превышено время: {file_path.name}[/red]",
         )
+    if result["status"] != "skipped":
+        result["attempts"] = attempts
+    return result
 
-        tdesk = TDesktop(str(tdata_folder))
-        if not tdesk.isLoaded():
-            result["error"] = "Не удалось загрузить tdata"
-            progress.update(
-                task_id,
-                description=f"[red]✗ tdata: не загружен[/red]",
-            )
-            return result
 
-        progress.update(
-            task_id,
-            description=f"[cyan]tdata: конвертация в Telethon...[/cyan]",
+async def convert_with_manifest(
+    file_path: Path,
+    file_type: str,
+    mode: str,
+    progress: Progress,
+    task_id,
+    options: Optional[ConversionOptions] = None,
+) -> Dict:
+    options = options or ConversionOptions()
+    started = time.time()
+    start = time.perf_counter()
+    if options.check_only:
+        result = await convert_with_retries(
+            file_path, file_type, mode, progress, task_id, options
         )
-
-        temp_session_name = f"temp_{tdata_folder.name}.session"
-        temp_session_path = Path(temp_session_name)
-        api = API.TelegramDesktop.Generate()
-        client = await tdesk.ToTelethon(
-            session=str(temp_session_path.with_suffix("")),
-            flag=UseCurrentSession,
-            api=api,
+        if options.use_manifest and result.get("health") and file_path.exists():
+            with timed_stage(result, "manifest_record"):
+                await health_record(file_path, file_type, result)
+        return finish_timings(result, started, start)
+    if not options.use_manifest:
+        result = await convert_with_retries(
+            file_path, file_type, mode, progress, task_id, options
         )
-        await client.connect()
-
-        if not await client.is_user_authorized():
-            result["error"] = "Сессия не авторизована"
-            progress.update(
-                task_id,
-                description=f"[red]✗ tdata: не авторизована[/red]",
-            )
-            return result
+        return finish_timings(result, started, start)
 
+    lookup_start = time.perf_counter()
+    previous = await manifest_lookup(file_path, file_type, options)
+    dead = None
+    if not previous and options.skip_dead:
+        dead = await health_lookup(file_path)
+    lookup_seconds = time.perf_counter() - lookup_start
+    if previous:
         progress.update(
             task_id,
-            description=f"[cyan]tdata: получение информации...[/cyan]",
+            description=f"[yellow]⊘ Уже сконвертировано: {file_path.name}[/yellow]",
         )
-        account_info = await get_account_info(client)
-        if not account_info:
-            result["error"] = "Не удалось получить информацию об аккаунте"
-            return result
+        result = make_resumed_result(previous)
+    elif dead:
+        progress.update(
+            task_id,
+            description=f"[yellow]⊘ Не авторизована: {file_path.name}[/yellow]",
+        )
+        result = make_dead_result(file_path, file_type, dead)
+    else:
+        result = await convert_with_retries(
+            file_path, file_type, mode, progress, task_id, options
+        )
+    record_stage(result, "manifest_lookup", started, lookup_seconds)
+    if result["status"] in ("success", "error") and file_path.exists():
+        with timed_stage(result, "manifest_record"):
+            await manifest_record(file_path, file_type, result, options)
+    return finish_timings(result, started, start)
 
-        session_name = get_output_session_name(account_info, "session")
-        output_file = Path(SESSIONS_DIR) / session_name
-        Path(SESSIONS_DIR).mkdir(parents=True, exist_ok=True)
 
-        if temp_session_path.exists():
-            temp_session_path.rename(output_file)
+def finish_timings(result: Dict, started: float, start: float) -> Dict:
+    record_stage(result, "total", started, time.perf_counter() - start)
+    metrics.observe_result(result)
+    return result
 
-        result["account_info"] = account_info
-        result["output_file"] = str(output_file)
 
-        result["status"] = "success"
-        progress.update(
-            task_id,
-            description=f"[green]✓ tdata → Telethon: {tdata_folder.name}[/green]",
+def make_type_limits(
+    type_concurrency: Optional[Dict[str, int]],
+) -> Dict[str, int]:
+    limits = TYPE_CONCURRENCY if type_concurrency is None else type_concurrency
+    return {
+        file_type: limit
+        for file_type, limit in limits.items()
+        if limit and limit > 0
+    }
+
+
+class NullProgress:
+    def __enter__(self) -> "NullProgress":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+    def add_task(self, description: str, total=None, **fields) -> int:
+        return 0
+
+    def update(self, task_id, **fields) -> None:
+        pass
+
+    def advance(self, task_id, advance: float = 1) -> None:
+        pass
+
+    def remove_task(self, task_id) -> None:
+        pass
+
+
+class AggregateProgress:
+    def __init__(self, window: int = PROGRESS_ACTIVE_WINDOW) -> None:
+        from rich.live import Live
+        from rich.progress import (
+            BarColumn,
+            MofNCompleteColumn,
+            Progress,
+            ProgressColumn,
+            TextColumn,
+            TimeElapsedColumn,
+            TimeRemainingColumn,
         )
-        return result
+        from rich.text import Text
 
-    except Exception as e:
-        result["error"] = str(e)
-        result["status"] = "error"
-        progress.update(
-            task_id,
-            description=f"[red]✗ tdata: ошибка {tdata_folder.name}[/red]",
+        class ThroughputColumn(ProgressColumn):
+            def render(self, task) -> Text:
+                return Text(f"{task.speed or 0:.1f}/с", style="cyan")
+
+        self.window = window
+        self.overall = Progress(
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            MofNCompleteColumn(),
+            ThroughputColumn(),
+            TimeElapsedColumn(),
+            TimeRemainingColumn(),
+            console=console.get(),
+        )
+        self.items: Dict[int, str] = {}
+        self.next_item_id = -1
+        self.live = Live(
+            get_renderable=self.render,
+            console=console.get(),
+            refresh_per_second=4,
+            transient=False,
         )
-        return result
-    finally:
-        if client:
-            try:
-                await client.disconnect()
-            except Exception:
-                pass
-        temp_session_path = Path(f"temp_{tdata_folder.name}.session")
-        if temp_session_path.exists() and result.get("status") != "success":
-            try:
-                temp_session_path.unlink()
-            except Exception:
-                pass
 
+    def render(self):
+        from rich.console import Group
+        from rich.text import Text
 
-# -----------------------------------------------------------------------------
-# Вывод результатов
-# -----------------------------------------------------------------------------
+        active = list(self.items.values())[-self.window:]
+        lines = [Text.from_markup(description) for description in active]
+        if len(self.items) > self.window:
+            lines.append(
+                Text(f"… и ещё {len(self.items) - self.window} в работе", style="dim")
+            )
+        return Group(self.overall, *lines)
 
-def print_account_table(results: List[Dict]) -> None:
-    table = Table(
-        title="📊 Результаты конвертации",
-        box=box.ROUNDED,
-        show_header=True,
-        header_style="bold magenta",
+    def __enter__(self) -> "AggregateProgress":
+        self.live.start()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.live.stop()
+        return False
+
+    def add_task(self, description: str, total=None, item: bool = False, **fields) -> int:
+        if not item:
+            return self.overall.add_task(description, total=total, **fields)
+        task_id = self.next_item_id
+        self.next_item_id -= 1
+        self.items[task_id] = description
+        return task_id
+
+    def update(self, task_id, description=None, completed=None, **fields) -> None:
+        if task_id not in self.items:
+            self.overall.update(
+                task_id, description=description, completed=completed, **fields
+            )
+            return
+        if completed:
+            self.items.pop(task_id, None)
+        elif description is not None:
+            self.items[task_id] = description
+
+    def advance(self, task_id, advance: float = 1) -> None:
+        if task_id not in self.items:
+            self.overall.advance(task_id, advance)
+
+    def remove_task(self, task_id) -> None:
+        if self.items.pop(task_id, None) is None and task_id >= 0:
+            self.overall.remove_task(task_id)
+
+
+def make_progress(show_progress: bool = True, mode: Optional[str] = None):
+    if not show_progress:
+        return NullProgress()
+    if (mode or PROGRESS_MODE) == "aggregate":
+        return AggregateProgress()
+
+    from rich.progress import (
+        BarColumn,
+        Progress,
+        SpinnerColumn,
+        TaskProgressColumn,
+        TextColumn,
     )
-    table.add_column("№", style="cyan", width=4, justify="center")
-    table.add_column("Тип", style="yellow", width=12)
-    table.add_column("Имя", style="green", width=25)
-    table.add_column("Username", style="yellow", width=20)
-    table.add_column("Телефон", style="blue", width=15)
-    table.add_column("User ID", style="cyan", width=12)
-    table.add_column("Чаты", style="magenta", width=8, justify="center")
-    table.add_column("Контакты", style="magenta", width=10, justify="center")
-    table.add_column("Статус", style="bold", width=12, justify="center")
-    table.add_column("Результат", style="dim", width=30)
 
-    for idx, result in enumerate(results, 1):
-        conversion_type = f"{result.get('input_type', '?')} → {result.get('output_type', '?')}"
-        if result["status"] == "success" and result["account_info"]:
-            info = result["account_info"]
-            status_style = "[green]✓ Успешно[/green]"
-            name = info["name"]
-            username = info["username_display"]
-            phone = info["phone"]
-            user_id = str(info["user_id"])
-            chats = str(info["chats_count"])
-            contacts = str(info["contacts_count"])
-            if result.get("output_folder"):
-                output = Path(result["output_folder"]).name
-            elif result.get("output_file"):
-                output = Path(result["output_file"]).name
-            else:
-                output = "-"
-        elif result["status"] == "skipped":
-            status_style = "[yellow]⊘ Пропущено[/yellow]"
-            name = Path(result["input_file"]).stem
-            username = "-"
-            phone = "-"
-            user_id = "-"
-            chats = "-"
-            contacts = "-"
-            output = "-"
-            if result.get("error"):
-                name = (
-                    f"{name}\n[dim yellow]{result['error'][:30]}...[/dim yellow]"
-                )
-        else:
-            status_style = "[red]✗ Ошибка[/red]"
-            name = Path(result["input_file"]).stem
-            username = "-"
-            phone = "-"
-            user_id = "-"
-            chats = "-"
-            contacts = "-"
-            output = "-"
-            if result.get("error"):
-                name = (
-                    f"{name}\n[dim red]{result['error'][:30]}...[/dim red]"
+    return Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        TaskProgressColumn(),
+        console=console.get(),
+    )
+
+
+async def iterate_inputs(
+    input_files: Union[Iterable, AsyncIterable],
+) -> AsyncIterator[Tuple[Path, str]]:
+    if hasattr(input_files, "__aiter__"):
+        async for item in input_files:
+            yield item
+    else:
+        for item in input_files:
+            yield item
+
+
+async def process_conversion(
+    input_files: Union[
+        Iterable[Tuple[Path, str]], AsyncIterable[Tuple[Path, str]]
+    ],
+    mode: str,
+    concurrency: Optional[int] = None,
+    type_concurrency: Optional[Dict[str, int]] = None,
+    options: Optional[ConversionOptions] = None,
+    sink: Optional[ResultSink] = None,
+    keep_results: bool = True,
+    show_progress: bool = True,
+    duplicates: Optional[Dict[str, List[Tuple[Path, str]]]] = None,
+) -> List[Dict]:
+    if not (options and options.check_only):
+        Path(TDATAS_DIR).mkdir(parents=True, exist_ok=True)
+        Path(SESSIONS_DIR).mkdir(parents=True, exist_ok=True)
+
+    limit = max(1, concurrency or MAX_CONCURRENCY)
+    offline = bool(options and options.offline)
+    scheduler = DcScheduler(
+        limit,
+        adaptive=not offline,
+        buffer=max(limit, QUEUE_SIZE),
+        type_limits=make_type_limits(type_concurrency),
+    )
+    results = []
+    finished_tasks: collections.deque = collections.deque()
+    counters: Dict[str, int] = collections.Counter()
+    discovered = 0
+
+    with make_progress(show_progress) as progress:
+        overall_id = progress.add_task("[bold]Обработано", total=None)
+
+        async def produce() -> None:
+            nonlocal discovered
+            try:
+                async for file_path, file_type in iterate_inputs(input_files):
+                    dc_id = (
+                        0
+                        if offline
+                        else await asyncio.to_thread(session_dc_id, file_path, file_type)
+                    )
+                    discovered += 1 + len((duplicates or {}).get(str(file_path), []))
+                    progress.update(overall_id, total=discovered)
+                    await scheduler.put(dc_id, (file_path, file_type, 0))
+            finally:
+                await scheduler.close()
+
+        def count_output(result: Dict) -> None:
+            counters[result.get("status")] += 1
+            progress.update(
+                overall_id,
+                description=f"[bold]Обработано[/bold] "
+                f"[green]✓ {counters['success']}[/green] "
+                f"[red]✗ {counters['error']}[/red] "
+                f"[yellow]⊘ {counters['skipped']}[/yellow]",
+            )
+            progress.advance(overall_id)
+
+        def finish_task(task_id) -> None:
+            progress.update(task_id, completed=1)
+            finished_tasks.append(task_id)
+            if len(finished_tasks) > PROGRESS_KEEP_FINISHED:
+                progress.remove_task(finished_tasks.popleft())
+
+        async def worker() -> None:
+            while True:
+                entry = await scheduler.get()
+                if entry is None:
+                    return
+                dc_id, (file_path, file_type, requeues) = entry
+                task_id = progress.add_task("[cyan]Ожидание...", total=1, item=True)
+                result = await convert_with_manifest(
+                    file_path, file_type, mode, progress, task_id, options
                 )
-        table.add_row(
-            str(idx),
-            conversion_type,
-            name,
-            username,
-            phone,
-            user_id,
-            chats,
-            contacts,
-            status_style,
-            output,
-        )
+                flood_wait = result.get("flood_wait")
+                if (
+                    flood_wait is not None
+                    and flood_wait <= FLOOD_WAIT_MAX
+                    and requeues < FLOOD_REQUEUE_LIMIT
+                ):
+                    progress.update(
+                        task_id,
+                        description=f"[yellow]⏸ FloodWait {flood_wait} с (DC {dc_id}), "
+                        f"повтор позже: {file_path.name}[/yellow]",
+                    )
+                    finish_task(task_id)
+                    await scheduler.release(
+                        dc_id,
+                        file_type,
+                        flood_wait,
+                        (file_path, file_type, requeues + 1),
+                    )
+                    continue
 
-    console.print("\n")
-    console.print(table)
+                await scheduler.release(
+                    dc_id,
+                    file_type,
+                    flood_wait,
+                    transient_error=any(
+                        attempt.get("transient") for attempt in result.get("attempts", [])
+                    ),
+                )
+                if requeues:
+                    result["flood_requeues"] = requeues
+                finish_task(task_id)
+                copies = (duplicates or {}).get(str(file_path), [])
+                if copies:
+                    result["duplicates"] = [str(path) for path, _ in copies]
+                for output in [result] + [
+                    make_duplicate_result(path, copy_type, result)
+                    for path, copy_type in copies
+                ]:
+                    count_output(output)
+                    if sink is not None:
+                        sink.write(output)
+                    if keep_results:
+                        results.append(output)
 
+        await asyncio.gather(produce(), *(worker() for _ in range(limit)))
 
-def save_results_to_json(results: List[Dict]) -> None:
-    output = {
-        "conversion_date": datetime.now().isoformat(),
-        "total_sessions": len(results),
-        "successful": sum(1 for r in results if r["status"] == "success"),
-        "failed": sum(1 for r in results if r["status"] == "error"),
-        "results": results,
-    }
-    results_path = Path(RESULTS_FILE)
-    with open(results_path, "w", encoding="utf-8") as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
-    console.print(f"\n[green]✓ Результаты сохранены в {RESULTS_FILE}[/green]")
+    return sorted(results, key=lambda r: r["input_file"])
 
 
 # -----------------------------------------------------------------------------
-# Меню и выбор режима
+# Дополнение информации после офлайн-конвертации
 # -----------------------------------------------------------------------------
 
-def show_menu() -> str:
-    console.print("\n")
-    console.print(
-        Panel.fit(
-            "[bold cyan]📋 Меню конвертации[/bold cyan]\n"
-            "[dim]↑↓ — навигация, Enter — выбор[/dim]",
-            border_style="cyan",
-        )
+async def read_result_material(result: Dict) -> Optional[Dict]:
+    if result["input_type"] == "telethon":
+        return read_telethon_session(Path(result["input_file"]))
+    if result["input_type"] == "pyrogram":
+        return await read_pyrogram_session(Path(result["input_file"]))
+    if result.get("output_file"):
+        return read_telethon_session(Path(result["output_file"]))
+    return None
+
+
+async def enrich_result(
+    result: Dict,
+    level: str = INFO_LEVEL,
+    options: Optional[ConversionOptions] = None,
+) -> None:
+    from telethon.sessions import MemorySession
+
+    options = options or ConversionOptions()
+    material = await read_result_material(result)
+    if not material:
+        return
+
+    api = generate_api()
+    client = await connect_client(
+        result,
+        lambda: make_telethon_client(
+            MemorySession(), material["auth_key"], material["dc_id"], api
+        ),
     )
-    console.print()
+    try:
+        async with stage_deadline(result, "authorize"):
+            authorized = await client.is_user_authorized()
+        if not authorized:
+            result["error"] = "Сессия не авторизована"
+            return
+        account_info = await get_account_info(client, level, result=result)
+    finally:
+        await disconnect_client(client)
+    if not account_info:
+        return
 
-    choice = inquirer.select(
-        message="Выберите действие:",
-        choices=[
-            {"name": "Telethon → tdata — конвертировать Telethon сессии в tdata", "value": "1"},
-            {"name": "Pyrogram → tdata — конвертировать Pyrogram сессии в tdata", "value": "2"},
-            {"name": "tdata → Telethon — конвертировать tdata папки в Telethon сессии", "value": "3"},
-            {"name": "Автообработка — автоматически определить тип и конвертировать всё", "value": "4"},
-            {"name": "Выход", "value": "5"},
-        ],
-        default="4",
-        pointer="▶",
-    ).execute()
+    cache_put(material, account_info)
+    result["account_info"] = account_info
+    result["info_level"] = account_info["info_level"]
+    result["enriched"] = True
 
-    return choice
+    if result.get("output_folder"):
+        current = Path(result["output_folder"])
+        target = current.parent / get_output_folder_name(account_info)
+        if not material.get("user_id"):
+            await run_in_cpu_pool(
+                save_tdata_worker,
+                material["auth_key"],
+                material["dc_id"],
+                account_info["user_id"],
+                str(target),
+                options.passcode,
+                options.passcode_salt,
+            )
+            if target != current:
+                shutil.rmtree(current, ignore_errors=True)
+            result["output_folder"] = str(target)
+        elif target != current and not target.exists():
+            current.rename(target)
+            result["output_folder"] = str(target)
+    elif result.get("output_archive") and result.get("archive_entry") == "tdata":
+        # zip на аккаунт можно переписать целиком; общий tar запуска — нет,
+        # его записи остаются как есть.
+        current = Path(result["output_archive"])
+        if not material.get("user_id"):
+            files = await run_in_cpu_pool(
+                render_tdata_worker,
+                material["auth_key"],
+                material["dc_id"],
+                account_info["user_id"],
+                options.passcode,
+                options.passcode_salt,
+            )
+            archive = open_archive_writer(
+                options.output_format, options.compression, options.output_dir
+            )
+            target, _ = archive.add(get_output_folder_name(account_info), files)
+            if Path(target) != current:
+                current.unlink(missing_ok=True)
+            result["output_archive"] = target
+        else:
+            target = current.with_name(f"{get_output_folder_name(account_info)}.zip")
+            if target != current and not target.exists():
+                current.rename(target)
+                result["output_archive"] = str(target)
+    elif result.get("output_file"):
+        current = Path(result["output_file"])
+        target = current.parent / get_output_session_name(account_info)
+        if target != current and not target.exists():
+            current.rename(target)
+            result["output_file"] = str(target)
 
+    input_file = Path(result["input_file"])
+    if options.use_manifest and input_file.exists():
+        await manifest_record(input_file, result["input_type"], result, options)
 
-def filter_files_by_type(
-    input_files: List[Tuple[Path, str]], file_type: str
-) -> List[Tuple[Path, str]]:
-    return [(path, ftype) for path, ftype in input_files if ftype == file_type]
 
+async def enrich_offline_results(
+    results: List[Dict],
+    level: str = INFO_LEVEL,
+    concurrency: Optional[int] = None,
+    show_progress: bool = True,
+    options: Optional[ConversionOptions] = None,
+) -> None:
+    pending = [
+        r for r in results if r.get("offline") and r["status"] == "success"
+    ]
+    if not pending:
+        return
 
-async def process_conversion(
-    input_files: List[Tuple[Path, str]], mode: str
-) -> List[Dict]:
-    results = []
-    Path(TDATAS_DIR).mkdir(parents=True, exist_ok=True)
-    Path(SESSIONS_DIR).mkdir(parents=True, exist_ok=True)
+    limit = asyncio.Semaphore(max(1, concurrency or MAX_CONCURRENCY))
 
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        TaskProgressColumn(),
-        console=console,
-    ) as progress:
-        tasks = []
-        for file_path, file_type in input_files:
-            task_id = progress.add_task("[cyan]Ожидание...", total=1)
-            tasks.append((file_path, file_type, task_id))
-
-        for file_path, file_type, task_id in tasks:
-            if mode == "auto" or (
-                mode == "telethon" and file_type == "telethon"
-            ):
-                if file_type == "telethon":
-                    result = await convert_telethon_to_tdata(
-                        file_path, progress, task_id
-                    )
-                elif file_type == "pyrogram":
-                    result = await convert_pyrogram_to_tdata(
-                        file_path, progress, task_id
-                    )
-                elif file_type == "tdata":
-                    result = await convert_tdata_to_telethon(
-                        file_path, progress, task_id
-                    )
-                else:
-                    result = {
-                        "input_file": str(file_path),
-                        "input_type": "unknown",
-                        "output_type": "unknown",
-                        "status": "error",
-                        "error": "Неизвестный тип файла",
-                        "timestamp": datetime.now().isoformat(),
-                    }
-            elif mode == "telethon" and file_type != "telethon":
-                result = {
-                    "input_file": str(file_path),
-                    "input_type": file_type,
-                    "output_type": "tdata",
-                    "status": "skipped",
-                    "error": "Пропущено (не Telethon)",
-                    "timestamp": datetime.now().isoformat(),
-                }
-            elif mode == "pyrogram" and file_type != "pyrogram":
-                result = {
-                    "input_file": str(file_path),
-                    "input_type": file_type,
-                    "output_type": "tdata",
-                    "status": "skipped",
-                    "error": "Пропущено (не Pyrogram)",
-                    "timestamp": datetime.now().isoformat(),
-                }
-            elif mode == "tdata" and file_type != "tdata":
-                result = {
-                    "input_file": str(file_path),
-                    "input_type": file_type,
-                    "output_type": "telethon",
-                    "status": "skipped",
-                    "error": "Пропущено (не tdata)",
-                    "timestamp": datetime.now().isoformat(),
-                }
-            else:
-                result = {
-                    "input_file": str(file_path),
-                    "input_type": file_type,
-                    "output_type": "unknown",
-                    "status": "error",
-                    "error": "Неизвестный режим",
-                    "timestamp": datetime.now().isoformat(),
-                }
-            results.append(result)
-            progress.update(task_id, completed=1)
+    with make_progress(show_progress) as progress:
+        task_id = progress.add_task(
+            "[cyan]Получение информации об аккаунтах...", total=len(pending)
+        )
 
-    return results
+        async def run_one(result: Dict) -> None:
+            async with limit:
+                try:
+                    await enrich_result(result, level, options)
+                except Exception as e:
+                    result["error"] = str(e)
+            progress.advance(task_id)
+
+        await asyncio.gather(*(run_one(r) for r in pending))
 
 
 # -----------------------------------------------------------------------------
@@ -666,12 +4634,66 @@ async def process_conversion(
 # -----------------------------------------------------------------------------
 
 async def run_conversion_cycle(
-    input_files: List[Tuple[Path, str]], mode: str
+    input_files: Optional[
+        Union[Iterable[Tuple[Path, str]], AsyncIterable[Tuple[Path, str]]]
+    ],
+    mode: str,
+    options: Optional[ConversionOptions] = None,
+    enrich: bool = False,
+    sink: Optional[ResultSink] = None,
+    concurrency: Optional[int] = None,
+    keep_results: bool = True,
+    show_progress: bool = True,
 ) -> List[Dict]:
-    return await process_conversion(input_files, mode)
+    options = options or ConversionOptions()
+    if input_files is None:
+        input_files = iter_input_files(None if mode == "auto" else mode)
+    if options.shard is not None:
+        input_files = select_shard(
+            input_files,
+            options.shard,
+            options.shard_key,
+            concurrency,
+            options.input_passcode,
+        )
+    duplicates = None
+    if options.dedupe != "off":
+        input_files, duplicates = await dedupe_inputs(
+            input_files, options.dedupe, concurrency, options.input_passcode
+        )
+    if not enrich:
+        return await process_conversion(
+            input_files,
+            mode,
+            concurrency=concurrency,
+            options=options,
+            sink=sink,
+            keep_results=keep_results,
+            show_progress=show_progress,
+            duplicates=duplicates,
+        )
+
+    results = await process_conversion(
+        input_files,
+        mode,
+        concurrency=concurrency,
+        options=options,
+        show_progress=show_progress,
+        duplicates=duplicates,
+    )
+    level = options.info_level if options.info_level != "none" else "identity"
+    await enrich_offline_results(results, level, concurrency, show_progress, options)
+    if sink is not None:
+        for result in results:
+            sink.write(result)
+    return results
 
 
-def main() -> None:
+def interactive_main() -> None:
+    from InquirerPy import inquirer
+    from rich.panel import Panel
+    from rich.prompt import Confirm
+
     console.print(
         Panel.fit(
             "[bold cyan]🔄 Конвертер Telegram Sessions[/bold cyan]\n"
@@ -687,18 +4709,6 @@ def main() -> None:
             console.print("\n[yellow]👋 До свидания![/yellow]\n")
             break
 
-        input_files = find_input_files()
-        if not input_files:
-            console.print(
-                f"\n[yellow]⚠ Нет файлов в папке {SESSIONS_DIR}[/yellow]\n"
-            )
-            if not Confirm.ask("[cyan]Продолжить?[/cyan]", default=True):
-                break
-            continue
-
-        Path(TDATAS_DIR).mkdir(parents=True, exist_ok=True)
-        Path(SESSIONS_DIR).mkdir(parents=True, exist_ok=True)
-
         mode_map = {
             "1": ("telethon", "Telethon → tdata"),
             "2": ("pyrogram", "Pyrogram → tdata"),
@@ -707,29 +4717,68 @@ def main() -> None:
         }
 
         mode, mode_name = mode_map[choice]
+        console.print(f"\n[cyan]Режим: {mode_name}[/cyan]\n")
+
+        offline = inquirer.confirm(
+            message="Офлайн-режим (без подключения к Telegram)?",
+            default=False,
+        ).execute()
+        enrich = offline and inquirer.confirm(
+            message="Дополнить информацию об аккаунтах после конвертации?",
+            default=False,
+        ).execute()
+        info_level = "none"
+        if not offline or enrich:
+            info_level = inquirer.select(
+                message="Объём информации об аккаунте:",
+                choices=[
+                    {"name": "Полная — точное число чатов и контактов", "value": "full"},
+                    {"name": "Счётчики — только общее число от сервера", "value": "counts"},
+                    {"name": "Профиль — только имя, username и телефон", "value": "identity"},
+                    {"name": "Без информации", "value": "none"},
+                ],
+                default=INFO_LEVEL,
+                pointer="▶",
+            ).execute()
+        dedupe = inquirer.confirm(
+            message="Пропускать копии одного и того же аккаунта?",
+            default=False,
+        ).execute()
+        options = ConversionOptions(
+            offline=offline,
+            info_level=info_level,
+            dedupe="first" if dedupe else "off",
+        )
 
-        if mode != "auto":
-            filtered_files = filter_files_by_type(input_files, mode)
-            if not filtered_files:
+        sink = ResultSink()
+        try:
+            results = asyncio.run(
+                run_conversion_cycle(None, mode, options, enrich, sink)
+            )
+        finally:
+            sink.close()
+        if not results:
+            if mode == "auto":
+                console.print(
+                    f"\n[yellow]⚠ Нет файлов в папке {SESSIONS_DIR}[/yellow]\n"
+                )
+            else:
                 console.print(
                     f"\n[yellow]⚠ Не найдено файлов типа '{mode}'[/yellow]\n"
                 )
-                continue
-            input_files = filtered_files
-
-        console.print(
-            f"\n[cyan]📁 Найдено файлов: {len(input_files)}[/cyan]"
-        )
-        console.print(f"[cyan]Режим: {mode_name}[/cyan]\n")
+            if not Confirm.ask("[cyan]Продолжить?[/cyan]", default=True):
+                break
+            continue
 
-        results = asyncio.run(run_conversion_cycle(input_files, mode))
+        console.print(f"\n[cyan]📁 Обработано файлов: {len(results)}[/cyan]")
 
-        print_account_table(results)
-        save_results_to_json(results)
+        print_results_report(results)
+        export_results_json()
+        console.print(f"\n[green]✓ Результаты сохранены в {RESULTS_FILE}[/green]")
 
-        successful = sum(1 for r in results if r["status"] == "success")
-        failed = sum(1 for r in results if r["status"] == "error")
-        skipped = sum(1 for r in results if r["status"] == "skipped")
+        successful = sink.summary["successful"]
+        failed = sink.summary["failed"]
+        skipped = sink.summary["skipped"]
 
         console.print(
             f"\n[bold]📈 Итого:[/bold] "
@@ -746,6 +4795,759 @@ def main() -> None:
         if not Confirm.ask("[cyan]Выполнить ещё одну операцию?[/cyan]", default=True):
             break
 
+    shutdown_cpu_pool()
+    close_account_cache()
+    close_manifest()
+    close_archive_writer()
+
+
+# -----------------------------------------------------------------------------
+# Командная строка
+# -----------------------------------------------------------------------------
+
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_USAGE = 2
+EXIT_NO_INPUT = 3
+EXIT_INTERRUPTED = 130
+
+MODES = ("telethon", "pyrogram", "tdata", "auto")
+
+
+def apply_directories(args: argparse.Namespace) -> None:
+    global SESSIONS_DIR, TDATAS_DIR, CPU_WORKERS, DC_CONCURRENCY, DC_RATE, PROGRESS_MODE
+    if getattr(args, "sessions_dir", None):
+        SESSIONS_DIR = args.sessions_dir
+    if getattr(args, "tdatas_dir", None):
+        TDATAS_DIR = args.tdatas_dir
+    if getattr(args, "cpu_workers", None):
+        CPU_WORKERS = args.cpu_workers
+    if getattr(args, "dc_concurrency", None) is not None:
+        DC_CONCURRENCY = args.dc_concurrency
+    if getattr(args, "dc_rate", None) is not None:
+        DC_RATE = args.dc_rate
+    if getattr(args, "connect_timeout", None) is not None:
+        STAGE_TIMEOUTS["connect"] = args.connect_timeout
+    if getattr(args, "progress_mode", None):
+        PROGRESS_MODE = args.progress_mode
+
+
+def command_scan(args: argparse.Namespace) -> int:
+    counts: Dict[str, int] = collections.Counter()
+    file_type = None if args.mode == "auto" else args.mode
+
+    async def scan() -> None:
+        async for path, session_type in iter_input_files(file_type):
+            counts[session_type] += 1
+            print(f"{session_type}\t{path}")
+
+    asyncio.run(scan())
+    print(
+        json.dumps({"total": sum(counts.values()), "by_type": dict(counts)}),
+        file=sys.stderr,
+    )
+    return EXIT_OK if counts else EXIT_NO_INPUT
+
+
+def command_convert(args: argparse.Namespace) -> int:
+    if args.dry_run:
+        return command_scan(args)
+
+    options = ConversionOptions(
+        offline=args.offline,
+        info_level=args.info_level,
+        use_cache=not args.no_cache,
+        trust_cache=args.trust_cache,
+        use_manifest=not args.no_manifest,
+        session_timeout=args.session_timeout,
+        retries=args.retries,
+        hedge_after=args.hedge_after,
+        output_format=args.output_format,
+        compression=args.compression,
+        dedupe=args.dedupe,
+        shard=args.shard,
+        shard_key=args.shard_key,
+        passcode=args.tdata_passcode,
+        input_passcode=args.input_passcode,
+        passcode_salt_policy=args.passcode_salt,
+        skip_dead=not args.include_dead,
+    )
+    if args.watch and (args.enrich or args.dedupe != "off" or args.shard_key != "path"):
+        print(
+            "--watch нельзя сочетать с --enrich, --dedupe и --shard-key fingerprint: "
+            "им нужен весь список входных файлов сразу",
+            file=sys.stderr,
+        )
+        return EXIT_USAGE
+    results_path, summary_path = args.results, args.summary
+    if args.shard is not None:
+        if results_path == RESULTS_JSONL_FILE:
+            results_path = shard_file_path(results_path, args.shard)
+        if summary_path == SUMMARY_FILE:
+            summary_path = shard_file_path(summary_path, args.shard)
+    sink = ResultSink(
+        results_path,
+        summary_path,
+        flush_every=1 if args.watch else RESULTS_FLUSH_EVERY,
+    )
+    if args.shard is not None:
+        sink.summary["shard"] = format_shard(args.shard)
+    try:
+        start_metrics_exporters(args.metrics_file, args.metrics_port)
+    except OSError as e:
+        print(f"Не удалось запустить экспорт метрик: {e}", file=sys.stderr)
+        sink.close()
+        return EXIT_USAGE
+    if args.trace:
+        open_trace_log(args.trace)
+    if args.store:
+        open_session_store(args.store)
+    try:
+        if args.watch:
+            asyncio.run(
+                watch_conversion(
+                    args.mode,
+                    options,
+                    sink,
+                    concurrency=args.concurrency,
+                    show_progress=not args.no_progress,
+                    poll_interval=args.poll_interval,
+                    debounce=args.debounce,
+                )
+            )
+        else:
+            asyncio.run(
+                run_conversion_cycle(
+                    None,
+                    args.mode,
+                    options,
+                    args.enrich,
+                    sink,
+                    concurrency=args.concurrency,
+                    keep_results=False,
+                    show_progress=not args.no_progress,
+                )
+            )
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    finally:
+        sink.close()
+        shutdown_cpu_pool()
+        close_account_cache()
+        close_manifest()
+        close_trace_log()
+        close_archive_writer()
+        close_session_store()
+        metrics.close()
+
+    if args.export_json:
+        export_results_json(results_path, args.export_json)
+    if args.export_csv:
+        export_results_csv(results_path, args.export_csv)
+    if args.export_html:
+        export_results_html(results_path, args.export_html)
+    print(json.dumps(sink.summary, ensure_ascii=False))
+
+    if sink.summary["total_sessions"] == 0:
+        return EXIT_NO_INPUT
+    if sink.summary["failed"]:
+        return EXIT_FAILURES
+    return EXIT_OK
+
+
+def command_check(args: argparse.Namespace) -> int:
+    STAGE_TIMEOUTS.update(CHECK_TIMEOUTS)
+    if args.connect_timeout is not None:
+        STAGE_TIMEOUTS["connect"] = args.connect_timeout
+    options = ConversionOptions(
+        use_cache=False,
+        use_manifest=not args.no_manifest,
+        session_timeout=args.session_timeout,
+        retries=args.retries,
+        hedge_after=args.hedge_after,
+        shard=args.shard,
+        input_passcode=args.input_passcode,
+        check_only=True,
+        check_get_me=args.get_me,
+    )
+    results_path, summary_path = args.results, args.summary
+    if args.shard is not None:
+        if results_path == HEALTH_RESULTS_FILE:
+            results_path = shard_file_path(results_path, args.shard)
+        if summary_path == HEALTH_SUMMARY_FILE:
+            summary_path = shard_file_path(summary_path, args.shard)
+    sink = ResultSink(results_path, summary_path)
+    try:
+        asyncio.run(
+            run_conversion_cycle(
+                None,
+                args.mode,
+                options,
+                sink=sink,
+                concurrency=args.concurrency,
+                keep_results=False,
+                show_progress=not args.no_progress,
+            )
+        )
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    finally:
+        sink.close()
+        shutdown_cpu_pool()
+        close_manifest()
+
+    print(json.dumps(sink.summary, ensure_ascii=False))
+    if sink.summary["total_sessions"] == 0:
+        return EXIT_NO_INPUT
+    if sink.summary["failed"]:
+        return EXIT_FAILURES
+    return EXIT_OK
+
+
+def command_serve(args: argparse.Namespace) -> int:
+    options = ConversionOptions(
+        offline=args.offline,
+        info_level=args.info_level,
+        use_cache=not args.no_cache,
+        trust_cache=args.trust_cache,
+        use_manifest=False,
+        session_timeout=args.session_timeout,
+        retries=args.retries,
+        passcode=args.tdata_passcode,
+        input_passcode=args.input_passcode,
+        passcode_salt_policy=args.passcode_salt,
+    )
+    try:
+        asyncio.run(
+            serve_conversions(
+                args.host,
+                args.port,
+                args.unix,
+                workers=args.workers,
+                queue_size=args.queue_size,
+                options=options,
+                mode=args.mode,
+                token=args.token,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Не удалось запустить сервис: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    finally:
+        shutdown_cpu_pool()
+        close_account_cache()
+    return EXIT_OK
+
+
+def command_report(args: argparse.Namespace) -> int:
+    if not Path(args.results).exists():
+        print(f"Нет файла результатов: {args.results}", file=sys.stderr)
+        return EXIT_NO_INPUT
+    summary = summarize_results(iter_results_jsonl(args.results, args.run))
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False))
+    else:
+        print_summary_report(summary)
+    if args.csv:
+        export_results_csv(args.results, args.csv, args.run)
+    if args.html:
+        export_results_html(args.results, args.html, args.run)
+    return EXIT_OK if summary["total"] else EXIT_NO_INPUT
+
+
+def command_merge(args: argparse.Namespace) -> int:
+    inputs = args.inputs
+    if not inputs:
+        pattern = Path(RESULTS_JSONL_FILE)
+        inputs = sorted(
+            str(path) for path in Path().glob(f"{pattern.stem}.shard-*-of-*{pattern.suffix}")
+        )
+    missing = [path for path in inputs if not Path(path).exists()]
+    if missing:
+        print(f"Нет файлов результатов: {', '.join(missing)}", file=sys.stderr)
+        return EXIT_NO_INPUT
+    if not inputs:
+        print("Не найдено файлов результатов шардов", file=sys.stderr)
+        return EXIT_NO_INPUT
+    if any(Path(path).resolve() == Path(args.results).resolve() for path in inputs):
+        print(f"Файл {args.results} указан и как вход, и как выход", file=sys.stderr)
+        return EXIT_USAGE
+
+    summary = merge_results(inputs, args.results, args.summary)
+    if args.export_json:
+        export_results_json(args.results, args.export_json)
+    if args.csv:
+        export_results_csv(args.results, args.csv)
+    if args.html:
+        export_results_html(args.results, args.html)
+    print(json.dumps(summary, ensure_ascii=False))
+
+    if summary["total_sessions"] == 0:
+        return EXIT_NO_INPUT
+    if summary["failed"]:
+        return EXIT_FAILURES
+    return EXIT_OK
+
+
+def command_store_import(args: argparse.Namespace) -> int:
+    store = SessionStore(args.store)
+    try:
+        summary = asyncio.run(
+            import_to_store(
+                store,
+                None if args.mode == "auto" else args.mode,
+                args.concurrency,
+                args.input_passcode,
+            )
+        )
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    finally:
+        store.close()
+        shutdown_cpu_pool()
+        close_account_cache()
+    print(json.dumps(summary, ensure_ascii=False))
+    if summary["inputs"] == 0:
+        return EXIT_NO_INPUT
+    return EXIT_FAILURES if summary["failed"] else EXIT_OK
+
+
+def command_store_export(args: argparse.Namespace) -> int:
+    options = ConversionOptions(
+        offline=True,
+        output_format=args.output_format,
+        compression=args.compression,
+        passcode=args.tdata_passcode,
+        passcode_salt_policy=args.passcode_salt,
+    )
+    store = SessionStore(args.store)
+    try:
+        summary = asyncio.run(
+            export_from_store(store, args.to, options, args.concurrency)
+        )
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    finally:
+        store.close()
+        shutdown_cpu_pool()
+        close_archive_writer()
+    print(json.dumps(summary, ensure_ascii=False))
+    if summary["accounts"] == 0:
+        return EXIT_NO_INPUT
+    return EXIT_FAILURES if summary["failed"] else EXIT_OK
+
+
+def command_store_stats(args: argparse.Namespace) -> int:
+    store = SessionStore(args.store)
+    try:
+        print(json.dumps(store.stats(), ensure_ascii=False))
+    finally:
+        store.close()
+    return EXIT_OK
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Конвертер Telegram sessions: Telethon ↔ tdata, Pyrogram → tdata. "
+        "Без аргументов запускается интерактивное меню.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--mode", choices=MODES, default="auto", help="направление конвертации"
+    )
+    common.add_argument(
+        "--sessions-dir", help=f"папка с входными файлами (по умолчанию {SESSIONS_DIR})"
+    )
+    common.add_argument(
+        "--tdatas-dir", help=f"папка для tdata (по умолчанию {TDATAS_DIR})"
+    )
+
+    passcodes = argparse.ArgumentParser(add_help=False)
+    passcodes.add_argument(
+        "--tdata-passcode", default=os.environ.get("TDATA_PASSCODE"), metavar="PASSCODE",
+        help="защитить выходные tdata локальным код-паролем "
+        "(или переменная окружения TDATA_PASSCODE)",
+    )
+    passcodes.add_argument(
+        "--input-passcode", default=os.environ.get("TDATA_INPUT_PASSCODE"),
+        metavar="PASSCODE",
+        help="код-пароль входных tdata (или переменная окружения TDATA_INPUT_PASSCODE)",
+    )
+    passcodes.add_argument(
+        "--passcode-salt", choices=PASSCODE_SALT_POLICIES, default=PASSCODE_SALT_POLICY,
+        help="batch — одна соль на запуск, ключ код-пароля считается один раз на процесс; "
+        "account — своя соль и полный расчёт ключа для каждого аккаунта",
+    )
+
+    scan = subparsers.add_parser(
+        "scan", parents=[common], help="только найти и классифицировать входные файлы"
+    )
+    scan.set_defaults(handler=command_scan)
+
+    convert = subparsers.add_parser(
+        "convert", parents=[common, passcodes], help="конвертировать без интерактивного меню"
+    )
+    convert.add_argument(
+        "--concurrency", type=int, default=MAX_CONCURRENCY,
+        help="число одновременных конвертаций",
+    )
+    convert.add_argument(
+        "--cpu-workers", type=int, help="размер пула процессов для tdata"
+    )
+    convert.add_argument(
+        "--dc-concurrency", type=int,
+        help=f"начальный лимит одновременных конвертаций на DC (по умолчанию {DC_CONCURRENCY}, "
+        "дальше подстраивается по FloodWait)",
+    )
+    convert.add_argument(
+        "--dc-rate", type=float,
+        help="не больше стольких запусков в секунду на DC (0 — без ограничения)",
+    )
+    convert.add_argument(
+        "--info-level", choices=INFO_LEVELS, default=INFO_LEVEL,
+        help="объём информации об аккаунте",
+    )
+    convert.add_argument(
+        "--offline", action="store_true", help="не подключаться к Telegram"
+    )
+    convert.add_argument(
+        "--output-format", choices=OUTPUT_FORMATS, default=OUTPUT_FORMAT,
+        help="tdata: папки (dir), zip на аккаунт или один tar на запуск",
+    )
+    convert.add_argument(
+        "--compression", type=int, choices=range(10), default=ARCHIVE_COMPRESSION,
+        metavar="0-9", help="уровень сжатия архивов (0 — без сжатия)",
+    )
+    convert.add_argument(
+        "--dedupe", choices=DEDUPE_POLICIES, default=DEDUPE_POLICY,
+        help="перед конвертацией найти копии одного аккаунта и сконвертировать "
+        "только одну: first — первая по пути, newest/oldest — по времени изменения, "
+        "prefer-session/prefer-tdata — по типу",
+    )
+    convert.add_argument(
+        "--shard", type=parse_shard, metavar="I/N",
+        help="обработать только свою часть входных файлов (1..N); файлы результатов "
+        "получают суффикс .shard-I-of-N",
+    )
+    convert.add_argument(
+        "--shard-key", choices=SHARD_KEYS, default=SHARD_KEY,
+        help="чем распределять: путь относительно папки сессий или отпечаток ключа "
+        "авторизации",
+    )
+    convert.add_argument(
+        "--session-timeout", type=float, default=SESSION_TIMEOUT, metavar="SECONDS",
+        help="предел на все попытки одной сессии (0 — без ограничения)",
+    )
+    convert.add_argument(
+        "--connect-timeout", type=float, metavar="SECONDS",
+        help=f"предел на подключение (по умолчанию {STAGE_TIMEOUTS['connect']:g})",
+    )
+    convert.add_argument(
+        "--retries", type=int, default=RETRY_ATTEMPTS,
+        help="повторов при временных сетевых ошибках",
+    )
+    convert.add_argument(
+        "--hedge-after", type=float, default=HEDGE_AFTER, metavar="SECONDS",
+        help="если подключение не завершилось за это время, параллельно начать второе "
+        "(0 — выключено)",
+    )
+    convert.add_argument(
+        "--enrich", action="store_true",
+        help="после офлайн-конвертации дополнить информацию об аккаунтах",
+    )
+    convert.add_argument(
+        "--no-cache", action="store_true", help="не использовать кэш аккаунтов"
+    )
+    convert.add_argument(
+        "--trust-cache", action="store_true",
+        help="для аккаунтов из кэша не подключаться к Telegram и не проверять "
+        "авторизацию",
+    )
+    convert.add_argument(
+        "--include-dead", action="store_true",
+        help="не пропускать сессии, которые команда check нашла неавторизованными",
+    )
+    convert.add_argument(
+        "--no-manifest", action="store_true",
+        help="не пропускать уже сконвертированные файлы",
+    )
+    convert.add_argument(
+        "--no-progress", action="store_true", help="не показывать прогресс"
+    )
+    convert.add_argument(
+        "--progress-mode", choices=PROGRESS_MODES, default=PROGRESS_MODE,
+        help="rows — строка на сессию, aggregate — общая полоса, скорость, ETA "
+        "и несколько активных сессий",
+    )
+    convert.add_argument(
+        "--watch", action="store_true",
+        help="не завершаться: следить за папкой сессий и конвертировать новые и "
+        "изменённые файлы по мере появления",
+    )
+    convert.add_argument(
+        "--poll-interval", type=float, default=WATCH_POLL_INTERVAL, metavar="SECONDS",
+        help="как часто пересканировать папку, если не установлен watchfiles",
+    )
+    convert.add_argument(
+        "--debounce", type=float, default=WATCH_DEBOUNCE, metavar="SECONDS",
+        help="брать файл в работу, только когда он столько секунд не менялся",
+    )
+    convert.add_argument(
+        "--dry-run", action="store_true",
+        help="только показать найденные файлы, ничего не конвертировать",
+    )
+    convert.add_argument(
+        "--results", default=RESULTS_JSONL_FILE, help="файл результатов JSON Lines"
+    )
+    convert.add_argument(
+        "--summary", default=SUMMARY_FILE, help="файл с итогами"
+    )
+    convert.add_argument(
+        "--export-json", metavar="PATH",
+        help="дополнительно выгрузить результаты в одном JSON",
+    )
+    convert.add_argument(
+        "--export-csv", nargs="?", const=RESULTS_CSV_FILE, metavar="PATH",
+        help=f"выгрузить результаты в CSV (по умолчанию {RESULTS_CSV_FILE})",
+    )
+    convert.add_argument(
+        "--export-html", nargs="?", const=RESULTS_HTML_FILE, metavar="PATH",
+        help=f"выгрузить результаты в HTML (по умолчанию {RESULTS_HTML_FILE})",
+    )
+    convert.add_argument(
+        "--metrics-file", metavar="PATH",
+        help="писать метрики этапов в текстовом формате Prometheus",
+    )
+    convert.add_argument(
+        "--metrics-port", type=int, metavar="PORT",
+        help=f"отдавать метрики по HTTP на {METRICS_HOST}:PORT/metrics",
+    )
+    convert.add_argument(
+        "--trace", nargs="?", const=TRACE_FILE, metavar="PATH",
+        help=f"писать журнал этапов, по строке на этап (по умолчанию {TRACE_FILE})",
+    )
+    convert.add_argument(
+        "--store", nargs="?", const=STORE_FILE, metavar="PATH",
+        help=f"дополнительно сохранять аккаунты в общее хранилище (по умолчанию {STORE_FILE})",
+    )
+    convert.set_defaults(handler=command_convert)
+
+    check = subparsers.add_parser(
+        "check", parents=[common],
+        help="только проверить, авторизованы ли сессии, ничего не записывая",
+    )
+    check.add_argument(
+        "--concurrency", type=int, default=CHECK_CONCURRENCY,
+        help="число одновременных проверок",
+    )
+    check.add_argument(
+        "--dc-concurrency", type=int,
+        help="начальный лимит одновременных проверок на DC",
+    )
+    check.add_argument(
+        "--get-me", action="store_true",
+        help="дополнительно запросить имя, username и телефон",
+    )
+    check.add_argument(
+        "--connect-timeout", type=float, metavar="SECONDS",
+        help=f"предел на подключение (по умолчанию {CHECK_TIMEOUTS['connect']:g})",
+    )
+    check.add_argument(
+        "--session-timeout", type=float, default=CHECK_SESSION_TIMEOUT, metavar="SECONDS",
+        help="предел на все попытки одной сессии (0 — без ограничения)",
+    )
+    check.add_argument(
+        "--retries", type=int, default=CHECK_RETRY_ATTEMPTS,
+        help="повторов при временных сетевых ошибках",
+    )
+    check.add_argument(
+        "--hedge-after", type=float, default=HEDGE_AFTER, metavar="SECONDS",
+        help="если подключение не завершилось за это время, параллельно начать второе",
+    )
+    check.add_argument(
+        "--shard", type=parse_shard, metavar="I/N",
+        help="проверить только свою часть входных файлов (1..N)",
+    )
+    check.add_argument(
+        "--input-passcode", default=os.environ.get("TDATA_INPUT_PASSCODE"),
+        metavar="PASSCODE",
+        help="код-пароль входных tdata (или переменная окружения TDATA_INPUT_PASSCODE)",
+    )
+    check.add_argument(
+        "--no-manifest", action="store_true",
+        help="не записывать результат проверки в манифест",
+    )
+    check.add_argument(
+        "--no-progress", action="store_true", help="не показывать прогресс"
+    )
+    check.add_argument(
+        "--progress-mode", choices=PROGRESS_MODES, default="aggregate",
+        help="rows — строка на сессию, aggregate — общая полоса",
+    )
+    check.add_argument(
+        "--results", default=HEALTH_RESULTS_FILE, help="файл результатов JSON Lines"
+    )
+    check.add_argument(
+        "--summary", default=HEALTH_SUMMARY_FILE, help="файл с итогами"
+    )
+    check.set_defaults(handler=command_check)
+
+    serve = subparsers.add_parser(
+        "serve", parents=[common, passcodes],
+        help="локальный HTTP-сервис с очередью задач конвертации",
+    )
+    serve.add_argument("--host", default=SERVICE_HOST, help="адрес для прослушивания")
+    serve.add_argument("--port", type=int, default=SERVICE_PORT, help="порт")
+    serve.add_argument(
+        "--unix", metavar="PATH", help="слушать Unix-сокет вместо TCP"
+    )
+    serve.add_argument(
+        "--token", default=os.environ.get("TDATA_SERVICE_TOKEN"),
+        help="токен для заголовка Authorization: Bearer (или переменная окружения "
+        "TDATA_SERVICE_TOKEN); без него создаётся случайный и печатается при запуске",
+    )
+    serve.add_argument(
+        "--workers", type=int, default=SERVICE_WORKERS,
+        help="число одновременно выполняемых задач",
+    )
+    serve.add_argument(
+        "--queue-size", type=int, default=SERVICE_QUEUE_SIZE,
+        help="сколько задач может ждать в очереди; сверх этого — ответ 503",
+    )
+    serve.add_argument(
+        "--info-level", choices=INFO_LEVELS, default=INFO_LEVEL,
+        help="объём информации об аккаунте, если задача его не указала",
+    )
+    serve.add_argument(
+        "--offline", action="store_true",
+        help="по умолчанию не подключаться к Telegram",
+    )
+    serve.add_argument(
+        "--session-timeout", type=float, default=SESSION_TIMEOUT, metavar="SECONDS",
+        help="предел на все попытки одной задачи (0 — без ограничения)",
+    )
+    serve.add_argument(
+        "--retries", type=int, default=RETRY_ATTEMPTS,
+        help="повторов при временных сетевых ошибках",
+    )
+    serve.add_argument(
+        "--no-cache", action="store_true", help="не использовать кэш аккаунтов"
+    )
+    serve.add_argument(
+        "--trust-cache", action="store_true",
+        help="для аккаунтов из кэша не подключаться к Telegram и не проверять "
+        "авторизацию",
+    )
+    serve.set_defaults(handler=command_serve)
+
+    report = subparsers.add_parser(
+        "report", help="сводка и выгрузка по файлу результатов"
+    )
+    report.add_argument(
+        "--results", default=RESULTS_JSONL_FILE, help="файл результатов JSON Lines"
+    )
+    report.add_argument(
+        "--csv", nargs="?", const=RESULTS_CSV_FILE, metavar="PATH",
+        help=f"выгрузить в CSV (по умолчанию {RESULTS_CSV_FILE})",
+    )
+    report.add_argument(
+        "--html", nargs="?", const=RESULTS_HTML_FILE, metavar="PATH",
+        help=f"выгрузить в HTML (по умолчанию {RESULTS_HTML_FILE})",
+    )
+    report.add_argument(
+        "--run", default=RESULTS_RUN, metavar="RUN_ID",
+        help="какой запуск показать: last (по умолчанию), all или run_id из файла",
+    )
+    report.add_argument(
+        "--json", action="store_true", help="напечатать сводку в JSON"
+    )
+    report.set_defaults(handler=command_report)
+
+    merge = subparsers.add_parser(
+        "merge", help="объединить результаты шардов в один отчёт"
+    )
+    merge.add_argument(
+        "inputs", nargs="*", metavar="RESULTS",
+        help="файлы результатов шардов (по умолчанию conversion_results.shard-*-of-*.jsonl)",
+    )
+    merge.add_argument(
+        "--results", default=RESULTS_JSONL_FILE, help="куда записать общие результаты"
+    )
+    merge.add_argument(
+        "--summary", default=SUMMARY_FILE, help="куда записать общие итоги"
+    )
+    merge.add_argument(
+        "--export-json", metavar="PATH",
+        help="дополнительно выгрузить результаты в одном JSON",
+    )
+    merge.add_argument(
+        "--csv", nargs="?", const=RESULTS_CSV_FILE, metavar="PATH",
+        help=f"выгрузить в CSV (по умолчанию {RESULTS_CSV_FILE})",
+    )
+    merge.add_argument(
+        "--html", nargs="?", const=RESULTS_HTML_FILE, metavar="PATH",
+        help=f"выгрузить в HTML (по умолчанию {RESULTS_HTML_FILE})",
+    )
+    merge.set_defaults(handler=command_merge)
+
+    store = subparsers.add_parser(
+        "store", help="общее SQLite-хранилище сессий: импорт, экспорт, статистика"
+    )
+    store_actions = store.add_subparsers(dest="action", required=True)
+    store_common = argparse.ArgumentParser(add_help=False)
+    store_common.add_argument(
+        "--store", default=STORE_FILE, metavar="PATH", help="файл хранилища"
+    )
+    store_common.add_argument(
+        "--concurrency", type=int, default=MAX_CONCURRENCY,
+        help="число одновременных операций",
+    )
+
+    store_import = store_actions.add_parser(
+        "import", parents=[common, store_common, passcodes],
+        help="загрузить сессии и tdata из папки в хранилище",
+    )
+    store_import.set_defaults(handler=command_store_import)
+
+    store_export = store_actions.add_parser(
+        "export", parents=[common, store_common, passcodes],
+        help="выгрузить все аккаунты из хранилища",
+    )
+    store_export.add_argument(
+        "--to", choices=("telethon", "tdata"), required=True, help="формат выгрузки"
+    )
+    store_export.add_argument(
+        "--output-format", choices=OUTPUT_FORMATS, default=OUTPUT_FORMAT,
+        help="для tdata: папки (dir), zip на аккаунт или один tar",
+    )
+    store_export.add_argument(
+        "--compression", type=int, choices=range(10), default=ARCHIVE_COMPRESSION,
+        metavar="0-9", help="уровень сжатия архивов",
+    )
+    store_export.set_defaults(handler=command_store_export)
+
+    store_stats = store_actions.add_parser(
+        "stats", parents=[store_common], help="сколько аккаунтов в хранилище"
+    )
+    store_stats.set_defaults(handler=command_store_stats)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        interactive_main()
+        return EXIT_OK
+
+    args = build_parser().parse_args(argv)
+    apply_directories(args)
+    return args.handler(args)
+
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
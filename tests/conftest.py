@@ -0,0 +1,31 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+INPUTS = {"telethon": "alpha.session", "pyrogram": "beta.session", "tdata": "gamma/tdata"}
+MATERIALS = {
+    "telethon": {"auth_key": bytes(range(256)), "dc_id": 2, "user_id": None},
+    "pyrogram": {"auth_key": bytes(range(255, -1, -1)), "dc_id": 4, "user_id": 777},
+    "tdata": {"auth_key": bytes(range(128)) * 2, "dc_id": 5, "user_id": 555},
+}
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    import benchmark
+    import main
+
+    monkeypatch.chdir(tmp_path)
+    sessions = tmp_path / main.SESSIONS_DIR
+    sessions.mkdir()
+    main.write_telethon_session(sessions / INPUTS["telethon"], MATERIALS["telethon"])
+    benchmark.write_pyrogram_session(sessions / INPUTS["pyrogram"], MATERIALS["pyrogram"])
+    tdata = MATERIALS["tdata"]
+    main.save_tdata_worker(
+        tdata["auth_key"], tdata["dc_id"], tdata["user_id"], str(sessions / INPUTS["tdata"])
+    )
+    yield tmp_path
+    main.shutdown_cpu_pool()
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("telethon")
+
+from telethon import errors  # noqa: E402
+
+import main  # noqa: E402
+
+
+class FakeClient:
+    def __init__(self, error=None):
+        self.error = error
+
+    async def __call__(self, request):
+        assert type(request).__name__ == "GetStateRequest"
+        if self.error is not None:
+            raise self.error
+
+    async def disconnect(self):
+        pass
+
+
+def check(monkeypatch, error=None):
+    async def connect_client(result, make_client, hedge_after=0.0, make_hedge=None):
+        return FakeClient(error)
+
+    monkeypatch.setattr(main, "connect_client", connect_client)
+    material = {"auth_key": bytes(256), "dc_id": 2, "user_id": 42}
+    return asyncio.run(main.check_account(material, main.ConversionOptions(), {}))
+
+
+def test_check_alive(monkeypatch):
+    assert check(monkeypatch)["health"] == "alive"
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        errors.AuthKeyUnregisteredError(request=None),
+        errors.SessionRevokedError(request=None),
+        errors.UserDeactivatedBanError(request=None),
+    ],
+)
+def test_check_dead(monkeypatch, error):
+    assert check(monkeypatch, error)["health"] == "dead"
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        errors.FloodWaitError(request=None, capture=5),
+        errors.ServerError(request=None, message="INTERNAL", code=500),
+    ],
+)
+def test_check_retryable_errors_are_not_dead(monkeypatch, error):
+    with pytest.raises(type(error)):
+        check(monkeypatch, error)
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("opentele")
+pytest.importorskip("TGConvertor")
+
+import benchmark  # noqa: E402
+import main  # noqa: E402
+from conftest import INPUTS, MATERIALS  # noqa: E402
+
+
+def convert(*argv, offline=True):
+    argv = ("--offline", *argv) if offline else argv
+    assert main.main(["convert", "--no-progress", *argv]) in (
+        main.EXIT_OK,
+        main.EXIT_FAILURES,
+    )
+    results = main.iter_results_jsonl()
+    return {
+        Path(result["input_file"]).relative_to(main.SESSIONS_DIR).as_posix(): result
+        for result in results
+    }
+
+
+def test_offline_round_trip(workdir):
+    results = convert()
+
+    assert {result["status"] for result in results.values()} == {"success"}
+    for kind in ("telethon", "pyrogram"):
+        material = MATERIALS[kind]
+        [account] = main.load_tdata_worker(results[INPUTS[kind]]["output_folder"])
+        assert account["auth_key"] == material["auth_key"]
+        assert account["dc_id"] == material["dc_id"]
+    [account] = main.load_tdata_worker(results[INPUTS["pyrogram"]]["output_folder"])
+    assert account["user_id"] == 777
+
+    session = main.read_telethon_session(Path(results[INPUTS["tdata"]]["output_file"]))
+    assert session["auth_key"] == MATERIALS["tdata"]["auth_key"]
+    assert session["dc_id"] == MATERIALS["tdata"]["dc_id"]
+
+
+def test_manifest_skips_unchanged_inputs(workdir):
+    convert()
+    results = convert()
+
+    assert {results[name]["status"] for name in INPUTS.values()} == {"skipped"}
+
+    material = dict(MATERIALS["telethon"], auth_key=bytes(256))
+    main.write_telethon_session(Path(main.SESSIONS_DIR, INPUTS["telethon"]), material)
+    results = convert()
+
+    assert results[INPUTS["telethon"]]["status"] == "success"
+    assert results[INPUTS["pyrogram"]]["status"] == "skipped"
+    [account] = main.load_tdata_worker(results[INPUTS["telethon"]]["output_folder"])
+    assert account["auth_key"] == bytes(256)
+
+
+def test_passcode_output_unlocks(workdir):
+    results = convert("--mode", "telethon", "--tdata-passcode", "s3cret")
+
+    result = results[INPUTS["telethon"]]
+    assert result["passcode_protected"]
+    folder = result["output_folder"]
+    [account] = main.load_tdata_worker(folder, "s3cret")
+    assert account["auth_key"] == MATERIALS["telethon"]["auth_key"]
+
+
+def test_manifest_reconverts_when_output_options_change(workdir):
+    convert()
+    results = convert("--tdata-passcode", "s3cret")
+
+    assert results[INPUTS["telethon"]]["status"] == "success"
+    assert results[INPUTS["pyrogram"]]["status"] == "success"
+    assert results[INPUTS["tdata"]]["status"] == "skipped"
+    folder = results[INPUTS["pyrogram"]]["output_folder"]
+    assert main.load_tdata_worker(folder, "s3cret")[0]["user_id"] == 777
+
+
+def test_manifest_passcode_is_not_stored(workdir, monkeypatch):
+    import hashlib
+    import sqlite3
+
+    convert("--mode", "telethon", "--tdata-passcode", "s3cret")
+    # Следующий запуск — новый процесс со своей солью.
+    monkeypatch.setattr(main, "_manifest_passcode_salt", None)
+    results = convert("--mode", "telethon", "--tdata-passcode", "s3cret")
+    assert results[INPUTS["telethon"]]["status"] == "skipped"
+
+    results = convert("--mode", "telethon", "--tdata-passcode", "other")
+    assert results[INPUTS["telethon"]]["status"] == "success"
+
+    conn = sqlite3.connect(main.MANIFEST_FILE)
+    [options] = conn.execute("SELECT options FROM manifest").fetchone()
+    conn.close()
+    salt, verifier = json.loads(options)["passcode"].split(":")
+    assert len(bytes.fromhex(salt)) == main.PASSCODE_SALT_SIZE
+    assert verifier not in hashlib.sha256(b"other").hexdigest()
+
+
+@pytest.mark.parametrize("output_format", ["dir", "zip"])
+def test_enrich_rewrites_user_id(workdir, monkeypatch, output_format):
+    backend = benchmark.FakeBackend(latency_ms=0, jitter_ms=0)
+    monkeypatch.setattr(main, "create_client", backend.client_factory())
+    argv = ("--mode", "telethon", "--enrich", "--output-format", output_format)
+
+    result = convert(*argv)[INPUTS["telethon"]]
+
+    user_id = int.from_bytes(MATERIALS["telethon"]["auth_key"][:4], "big")
+    assert result["account_info"]["user_id"] == user_id
+    name = f"tdata_bench_{user_id}"
+    if output_format == "dir":
+        folder = Path(result["output_folder"])
+        assert folder.name == name
+    else:
+        archive = Path(result["output_archive"])
+        zips = [path.name for path in Path(main.TDATAS_DIR).glob("*.zip")]
+        assert zips == [f"{name}.zip"] and archive.name == zips[0]
+        shutil.unpack_archive(archive, workdir / "unpacked")
+        folder = workdir / "unpacked" / "tdata"
+    assert main.load_tdata_worker(str(folder))[0]["user_id"] == user_id
+
+    assert convert(*argv)[INPUTS["telethon"]]["status"] == "skipped"
+
+
+def test_cached_account_is_still_authorized(workdir, monkeypatch):
+    backend = benchmark.FakeBackend(latency_ms=0, jitter_ms=0)
+    monkeypatch.setattr(main, "create_client", backend.client_factory())
+    argv = ("--mode", "pyrogram", "--no-manifest")
+    assert convert(*argv, offline=False)[INPUTS["pyrogram"]]["status"] == "success"
+
+    backend.unauthorized_rate = 1.0
+    result = convert(*argv, offline=False)[INPUTS["pyrogram"]]
+    assert result["status"] == "error"
+
+    requests = backend.requests
+    result = convert(*argv, "--trust-cache", offline=False)[INPUTS["pyrogram"]]
+    assert result["status"] == "success" and result["cached"]
+    assert backend.requests == requests
+
+
+def test_rerun_keeps_interrupted_results(workdir):
+    crashed = main.ResultSink()
+    crashed.write({"input_file": "interrupted", "status": "error"})
+    crashed.flush()
+    crashed.file.close()  # процесс упал, close() не вызван
+
+    results = convert()
+    assert "interrupted" not in {result["input_file"] for result in results.values()}
+    [result] = main.iter_results_jsonl(run=crashed.run_id)
+    assert result["input_file"] == "interrupted"
+    runs = {result["run_id"] for result in main.iter_results_jsonl(run="all")}
+    assert len(runs) == 2 and crashed.run_id in runs
+
+    summary = json.loads(Path(main.SUMMARY_FILE).read_text(encoding="utf-8"))
+    assert summary["run_id"] in runs - {crashed.run_id}
+
+
+
+def test_dedupe_and_shard_open_protected_tdata(workdir):
+    material = MATERIALS["telethon"]
+    copy = workdir / main.SESSIONS_DIR / "copy" / "tdata"
+    main.save_tdata_worker(material["auth_key"], material["dc_id"], 1, str(copy), "secret")
+    inputs = [
+        (workdir / main.SESSIONS_DIR / INPUTS["telethon"], "telethon"),
+        (copy, "tdata"),
+    ]
+
+    async def run(passcode):
+        unique, _ = await main.dedupe_inputs(inputs, "prefer-session", passcode=passcode)
+        shards = [
+            [item async for item in main.select_shard(
+                inputs, (index, 2), "fingerprint", passcode=passcode
+            )]
+            for index in (1, 2)
+        ]
+        return unique, shards
+
+    unique, _ = asyncio.run(run(None))
+    assert len(unique) == 2
+    unique, shards = asyncio.run(run("secret"))
+    assert unique == inputs[:1]
+    assert sorted(len(shard) for shard in shards) == [0, 2]
@@ -0,0 +1,53 @@
+import asyncio
+
+import main
+
+
+async def take(scheduler, count):
+    return [
+        (await asyncio.wait_for(scheduler.get(), 1))[1][1] for _ in range(count)
+    ]
+
+
+def test_type_limit_does_not_block_other_types():
+    async def run():
+        scheduler = main.DcScheduler(
+            4, adaptive=False, dc_rate=0, type_limits={"tdata": 1}
+        )
+        for index in range(3):
+            await scheduler.put(0, (f"t{index}", "tdata", 0))
+        for index in range(3):
+            await scheduler.put(0, (f"s{index}", "telethon", 0))
+        started = await take(scheduler, 4)
+        assert sorted(started) == ["tdata", "telethon", "telethon", "telethon"]
+
+        await scheduler.release(0, "tdata")
+        assert await take(scheduler, 1) == ["tdata"]
+
+    asyncio.run(run())
+
+
+def test_types_alternate_within_a_dc():
+    async def run():
+        scheduler = main.DcScheduler(6, adaptive=False, dc_rate=0)
+        for file_type in ["tdata"] * 3 + ["pyrogram"] * 3:
+            await scheduler.put(0, ("path", file_type, 0))
+        assert await take(scheduler, 4) == ["tdata", "pyrogram", "tdata", "pyrogram"]
+
+    asyncio.run(run())
+
+
+def test_error_rate_lowers_dc_limit():
+    budget = main.DcBudget(8, 16, 0)
+    budget.on_error()
+    assert budget.limit == 8
+
+    errors = 1
+    while budget.limit == 8 and errors < main.DC_ERROR_WINDOW:
+        budget.on_error()
+        errors += 1
+    assert budget.limit == 8 * main.DC_DECREASE
+
+    for _ in range(main.DC_ERROR_WINDOW):
+        budget.on_success()
+    assert budget.limit > 8 * main.DC_DECREASE
@@ -0,0 +1,164 @@
+import asyncio
+import base64
+import io
+import json
+import zipfile
+
+import pytest
+
+pytest.importorskip("opentele")
+
+import benchmark  # noqa: E402
+import main  # noqa: E402
+from conftest import INPUTS  # noqa: E402
+
+
+def run_service(check):
+    async def run():
+        service = main.ConversionService(
+            workers=2, options=main.ConversionOptions(use_manifest=False, offline=True)
+        )
+        await service.start("127.0.0.1", 0)
+        host, port = service.address[:2]
+
+        async def request(method, path, body=b"", token=service.token, **kwargs):
+            status, payload = await benchmark.http_request(
+                host, port, method, path, body, token=token, **kwargs
+            )
+            return status, json.loads(payload) if payload else None
+
+        try:
+            await check(service, request)
+        finally:
+            await service.close()
+
+    asyncio.run(run())
+
+
+async def wait_job(request, job_id):
+    while True:
+        status, job = await request("GET", f"/jobs/{job_id}")
+        assert status == 200
+        if job["status"] not in ("queued", "running"):
+            return job
+        await asyncio.sleep(0.02)
+
+
+def test_service_requires_token(workdir):
+    async def check(service, request):
+        assert (await request("GET", "/health", token=""))[0] == 200
+        assert (await request("GET", "/jobs", token=""))[0] == 401
+        assert (await request("GET", "/jobs", token="wrong"))[0] == 401
+        assert (await request("GET", "/jobs"))[0] == 200
+
+    run_service(check)
+
+
+def test_service_passcode_only_in_json_body(workdir):
+    session = workdir / main.SESSIONS_DIR / INPUTS["telethon"]
+
+    async def check(service, request):
+        status, _ = await request(
+            "POST",
+            "/jobs?direction=telethon-tdata&passcode=secret",
+            session.read_bytes(),
+            content_type="application/octet-stream",
+        )
+        assert status == 400
+
+        body = json.dumps({
+            "direction": "telethon-tdata",
+            "name": "upload.session",
+            "passcode": "secret",
+            "data": base64.b64encode(session.read_bytes()).decode(),
+        }).encode()
+        status, job = await request("POST", "/jobs", body)
+        assert status == 202
+        job = await wait_job(request, job["id"])
+        assert job["status"] == "done"
+        assert job["result"]["passcode_protected"]
+        output = main.Path(job["result"]["output_folder"])
+        assert output.parent == service.jobs_dir / job["id"] / "output"
+        assert not (workdir / main.TDATAS_DIR).exists() or not any(
+            (workdir / main.TDATAS_DIR).iterdir()
+        )
+
+    run_service(check)
+
+
+def test_service_caps_tdata_archives(workdir, monkeypatch):
+    monkeypatch.setattr(main, "SERVICE_MAX_MEMBERS", 2)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name in ("tdata/a", "tdata/b", "tdata/c"):
+            archive.writestr(name, b"x")
+
+    async def check(service, request):
+        status, _ = await request(
+            "POST", "/jobs?direction=tdata-telethon", buffer.getvalue(),
+            content_type="application/zip",
+        )
+        assert status == 413
+        assert not any(service.jobs_dir.iterdir())
+
+    run_service(check)
+
+
+def test_service_refuses_to_delete_running_job(workdir):
+    async def check(service, request):
+        body = json.dumps({"path": INPUTS["telethon"]}).encode()
+        status, job = await request("POST", "/jobs", body)
+        assert status == 202
+        await wait_job(request, job["id"])
+        service.jobs[job["id"]]["status"] = "running"
+        assert (await request("DELETE", f"/jobs/{job['id']}"))[0] == 409
+        service.jobs[job["id"]]["status"] = "done"
+        assert (await request("DELETE", f"/jobs/{job['id']}"))[0] == 204
+
+    run_service(check)
+
+
+def test_service_requeues_flood_waits(workdir, monkeypatch):
+    convert = main.convert_with_manifest
+    calls = []
+
+    async def flood_once(file_path, *args):
+        calls.append(file_path)
+        if len(calls) == 1:
+            return {"input_file": str(file_path), "status": "error", "flood_wait": 0}
+        return await convert(file_path, *args)
+
+    monkeypatch.setattr(main, "convert_with_manifest", flood_once)
+
+    async def check(service, request):
+        body = json.dumps({"path": INPUTS["telethon"]}).encode()
+        status, job = await request("POST", "/jobs", body)
+        assert status == 202
+        job = await wait_job(request, job["id"])
+        assert job["status"] == "done"
+        assert job["result"]["flood_requeues"] == 1
+        assert len(calls) == 2
+        assert service.scheduler.budgets[0].flood_waits == 1
+
+    run_service(check)
+
+
+@pytest.mark.parametrize("body", [
+    b"[1, 2]",
+    b"42",
+    b"{not json",
+    b'{"name": 1, "data": "AA=="}',
+    b'{"path": []}',
+    b'{"direction": {"x": 1}}',
+    b'{"info_level": 5}',
+    b'{"offline": [1]}',
+    b'{"data": "not base64!"}',
+    "{\"path\": \"a\", \"passcode\": \"пароль\"}".encode(),
+])
+def test_service_rejects_malformed_json(workdir, body):
+    async def check(service, request):
+        status, payload = await request("POST", "/jobs", body)
+        assert status == 400, payload
+        assert not service.jobs
+
+    run_service(check)
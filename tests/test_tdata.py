@@ -0,0 +1,67 @@
+import pytest
+
+pytest.importorskip("opentele")
+
+import main  # noqa: E402
+
+AUTH_KEY = bytes(range(256))
+
+
+@pytest.mark.parametrize("dc_id", [1, 2, 4])
+def test_tdata_round_trip(tmp_path, dc_id):
+    out_folder = tmp_path / "tdata"
+    main.save_tdata_worker(AUTH_KEY, dc_id, 123456789, str(out_folder))
+
+    accounts = main.load_tdata_worker(str(out_folder))
+
+    assert accounts == [{"auth_key": AUTH_KEY, "dc_id": dc_id, "user_id": 123456789}]
+
+
+def test_render_tdata_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "RENDER_DIR", str(tmp_path))
+    files = main.render_tdata_worker(AUTH_KEY, 2, 42)
+
+    out_folder = tmp_path / "rendered"
+    for name, data in files.items():
+        target = out_folder / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+
+    assert main.load_tdata_worker(str(out_folder)) == [
+        {"auth_key": AUTH_KEY, "dc_id": 2, "user_id": 42}
+    ]
+
+
+@pytest.mark.parametrize("salt", [None, bytes(range(32))])
+def test_passcode_unlock(tmp_path, salt):
+    from opentele.exception import TDataBadDecryptKey
+
+    out_folder = tmp_path / "tdata"
+    main.save_tdata_worker(AUTH_KEY, 2, 42, str(out_folder), "s3cret", salt)
+
+    assert main.load_tdata_worker(str(out_folder), "s3cret") == [
+        {"auth_key": AUTH_KEY, "dc_id": 2, "user_id": 42}
+    ]
+    with pytest.raises(TDataBadDecryptKey):
+        main.load_tdata_worker(str(out_folder), "wrong")
+
+
+def test_passcode_key_cache_matches_opentele():
+    from opentele import td
+    from PyQt5.QtCore import QByteArray
+
+    salt, passcode = QByteArray(bytes(range(32))), QByteArray(b"s3cret")
+    expected = td.Storage.CreateLocalKey(salt, passcode).key
+    main.install_passcode_key_cache()
+
+    assert td.Storage.CreateLocalKey(salt, passcode).key == expected
+    assert td.Storage.CreateLocalKey(salt, passcode).key == expected
+    assert td.Storage.CreateLocalKey.cache_info().hits >= 1
+    assert td.Storage.CreateLocalKey(salt).key == td.Storage.CreateLocalKey(
+        salt, QByteArray()
+    ).key
+
+
+def test_passcode_must_be_ascii():
+    with pytest.raises(ValueError):
+        main.ConversionOptions(passcode="пароль")
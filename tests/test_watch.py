@@ -0,0 +1,72 @@
+import asyncio
+import sys
+
+import pytest
+
+pytest.importorskip("opentele")
+
+import main  # noqa: E402
+from conftest import INPUTS, MATERIALS  # noqa: E402
+
+
+async def collect(inputs, count):
+    found = []
+    while len(found) < count:
+        path, file_type = await asyncio.wait_for(inputs.__anext__(), 10)
+        found.append((path.relative_to(main.SESSIONS_DIR).as_posix(), file_type))
+    return sorted(found)
+
+
+@pytest.mark.parametrize("backend", ["poll", "watchfiles"])
+def test_watch_picks_up_new_inputs_only(workdir, monkeypatch, backend):
+    if backend == "poll":
+        monkeypatch.setitem(sys.modules, "watchfiles", None)
+    else:
+        pytest.importorskip("watchfiles")
+    sessions = workdir / main.SESSIONS_DIR
+
+    async def run():
+        stop = asyncio.Event()
+        outputs = {f"{main.SESSIONS_DIR}/session_output.session"}
+        inputs = main.watch_inputs(None, 0.1, 0.2, stop, outputs)
+
+        assert await collect(inputs, 3) == sorted(
+            (name, kind) for kind, name in INPUTS.items()
+        )
+
+        output = sessions / "session_output.session"
+        main.write_telethon_session(output, MATERIALS["tdata"])
+        main.write_telethon_session(sessions / "delta.session", MATERIALS["tdata"])
+        assert await collect(inputs, 1) == [("delta.session", "telethon")]
+
+        (sessions / INPUTS["tdata"] / "extra").write_bytes(b"1")
+        assert await collect(inputs, 1) == [(INPUTS["tdata"], "tdata")]
+
+        stop.set()
+        with pytest.raises(StopAsyncIteration):
+            await inputs.__anext__()
+
+    asyncio.run(run())
+
+
+def test_online_conversion_leaves_inputs_untouched(workdir, monkeypatch):
+    import benchmark
+
+    backend = benchmark.FakeBackend(latency_ms=0, jitter_ms=0)
+    factory = backend.client_factory()
+    sessions = []
+
+    def create_client(session, api):
+        sessions.append(session)
+        return factory(session, api)
+
+    # Настоящий Telethon переписывает файл SQLiteSession при подключении,
+    # поэтому входной .session не должен попадать в клиент.
+    monkeypatch.setattr(main, "create_client", create_client)
+    session = workdir / main.SESSIONS_DIR / INPUTS["telethon"]
+    before = (session.read_bytes(), main.input_stat(session))
+
+    argv = ["convert", "--no-progress", "--no-manifest", "--mode", "telethon"]
+    assert main.main(argv) == main.EXIT_OK
+    assert sessions and not any(isinstance(item, str) for item in sessions)
+    assert (session.read_bytes(), main.input_stat(session)) == before